@@ -48,7 +48,7 @@ def compute_enabling_processing_times(trace_info, bpmn_graph, max_waiting, max_p
             max_processing[ev_info.task_id] = 0
         task_sequence.append(ev_info.task_id)
 
-    _, _, _, enabling_times = bpmn_graph.reply_trace(task_sequence, flow_arcs_frequency, True, trace_info.event_list)
+    _, _, _, enabling_times = bpmn_graph.reply_trace_variant(task_sequence, flow_arcs_frequency, trace_info.event_list)
     for i in range(0, len(enabling_times)):
         ev_info = trace_info.event_list[i]
         if ev_info.started_at < enabling_times[i]:
@@ -102,10 +102,9 @@ def compute_kpi_times_from_csv_log(log_path, bpmn_graph):
 
     for trace_info in trace_list:
         task_sequence = sort_by_completion_times(trace_info)
-        is_correct, fired_tasks, pending_tokens, enabling_times = bpmn_graph.reply_trace(task_sequence,
-                                                                                         flow_arcs_frequency,
-                                                                                         True,
-                                                                                         trace_info.event_list)
+        is_correct, fired_tasks, pending_tokens, enabling_times = bpmn_graph.reply_trace_variant(task_sequence,
+                                                                                                 flow_arcs_frequency,
+                                                                                                 trace_info.event_list)
         for i in range(0, len(enabling_times)):
             total_enablement += 1
             if trace_info.event_list[i].started_at < enabling_times[i]:
@@ -150,6 +149,7 @@ def preprocess_xes_log(log_path, bpmn_path, out_f_path, minutes_x_granule, min_c
     flow_arcs_frequency = dict()
     min_date = None
     task_events = dict()
+    trace_variants = dict()  # Task sequence -> number of traces, each variant is replayed once
     observed_task_resources = dict()
     min_max_task_duration = dict()
     total_events = 0
@@ -211,11 +211,11 @@ def preprocess_xes_log(log_path, bpmn_path, out_f_path, minutes_x_granule, min_c
                     min_max_task_duration[task_name][1] = max(min_max_task_duration[task_name][1], duration)
 
         trace_info.filter_incomplete_events()
-        task_sequence = sort_by_completion_times(trace_info)
-        is_correct, fired_tasks, pending_tokens, _ = bpmn_graph.reply_trace(task_sequence,
-                                                                            flow_arcs_frequency,
-                                                                            True,
-                                                                            trace_info.event_list)
+        task_sequence = tuple(sort_by_completion_times(trace_info))
+        trace_variants[task_sequence] = trace_variants.get(task_sequence, 0) + 1
+
+    for task_sequence in trace_variants:
+        bpmn_graph.reply_trace_variant(task_sequence, flow_arcs_frequency, None, trace_variants[task_sequence])
 
     resource_freq_ratio = dict()
     for r_name in resource_freq:
@@ -566,14 +566,13 @@ def discover_arrival_time_distribution(initial_events, arrival_calendar):
 
 
 def discover_aggregated_task_distributions(task_events, fit_cal, res_calendar: RCalendar):
-    durations = list()
-    for ev_info in task_events:
-        if ev_info.started_at is None or ev_info.completed_at is None:
-            continue
-        real_duration = (ev_info.completed_at - ev_info.started_at).total_seconds()
-        if fit_cal and res_calendar is not None and res_calendar.total_weekly_work > 0:
-            real_duration = res_calendar.find_working_time(ev_info.started_at, ev_info.completed_at)
-        durations.append(real_duration)
+    task_events = [ev_info for ev_info in task_events
+                   if ev_info.started_at is not None and ev_info.completed_at is not None]
+    if fit_cal and res_calendar is not None and res_calendar.total_weekly_work > 0:
+        durations = res_calendar.find_working_times([ev_info.started_at for ev_info in task_events],
+                                                    [ev_info.completed_at for ev_info in task_events]).tolist()
+    else:
+        durations = [(ev_info.completed_at - ev_info.started_at).total_seconds() for ev_info in task_events]
     aggregated_task_distribution = best_fit_distribution(durations)
     # if print_info:
     #     # print("Total Events: %d, Distribution: %s"
@@ -598,11 +597,12 @@ def discover_resource_task_duration_distribution(task_res_evts, res_calendars, t
                 event_list = task_res_evts[t_id][r_id]
             elif r_id in joint_events:
                 event_list = joint_events[r_id]
-            durations = list()
-            for ev_info in event_list:
-                real_duration = (ev_info.completed_at - ev_info.started_at).total_seconds() if not fit_c \
-                    else res_calendars[r_id].find_working_time(ev_info.started_at, ev_info.completed_at)
-                durations.append(real_duration)
+            if fit_c:
+                durations = res_calendars[r_id].find_working_times([ev_info.started_at for ev_info in event_list],
+                                                                   [ev_info.completed_at for ev_info in event_list])
+                durations = durations.tolist()
+            else:
+                durations = [(ev_info.completed_at - ev_info.started_at).total_seconds() for ev_info in event_list]
             full_task_durations += durations
             if len(durations) < min_evts:
                 pending_resources.append(r_id)
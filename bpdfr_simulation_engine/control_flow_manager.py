@@ -1,12 +1,15 @@
-import copy
+import bisect
+import itertools
 import sys
-from collections import deque
+from array import array
+from collections import deque, OrderedDict
 from enum import Enum
 
 import pm4py
-import random
 from pm4py.objects.conversion.process_tree import converter
 
+from bpdfr_simulation_engine.probability_distributions import UniformBlocks
+
 
 class BPMN(Enum):
     TASK = 'TASK'
@@ -18,6 +21,9 @@ class BPMN(Enum):
     UNDEFINED = 'UNDEFINED'
 
 
+# Uniforms of the routing when no stream is given, from the global random state
+default_uniforms = UniformBlocks()
+
 class ElementInfo:
     def __init__(self, element_type, element_id, element_name):
         self.id = element_id
@@ -36,17 +42,21 @@ class ElementInfo:
         return self.type in [BPMN.EXCLUSIVE_GATEWAY, BPMN.PARALLEL_GATEWAY, BPMN.INCLUSIVE_GATEWAY]
 
 
+class TokenCounts(dict):
+    # Tokens of the flows marked at some point, the other flows of the model have none (without an entry)
+    def __missing__(self, flow_id):
+        return 0
+
+
 class ProcessState:
     def __init__(self, bpmn_graph):
         self.arcs_bitset = bpmn_graph.arcs_bitset
-        self.tokens = dict()
+        self.tokens = TokenCounts()
         self.flow_date = dict()
         self.state_mask = 0
-        for flow_arc in bpmn_graph.flow_arcs:
-            self.tokens[flow_arc] = 0
 
     def add_token(self, flow_id):
-        if flow_id in self.tokens:
+        if flow_id in self.arcs_bitset:
             self.tokens[flow_id] += 1
             self.state_mask |= self.arcs_bitset[flow_id]
 
@@ -56,16 +66,180 @@ class ProcessState:
             self.state_mask &= ~self.arcs_bitset[flow_id]
 
     def has_token(self, flow_id):
-        return flow_id in self.tokens and self.tokens[flow_id] > 0
+        return self.tokens.get(flow_id, 0) > 0
 
     def pending_tokens(self):
         marked_flows = list()
         for flow_id in self.tokens:
             if self.tokens[flow_id] > 0:
                 marked_flows.append(flow_id)
+        # In the order of the flows in the model
+        marked_flows.sort(key=self.arcs_bitset.get)
         return marked_flows
 
 
+class RoutingTable:
+    # Precomputed routing of a split (element with several outgoing flows), i.e., the immutable tuples of the flows it
+    # can take. XOR decisions search a cumulative-probability tuple with one uniform, and OR decisions take each flow
+    # with one uniform per flow, indexing the tuple of the flows taken by the bitmask of the flows selected (OR splits
+    # with more than MAX_OR_TABLE flows build the tuple instead). The order in which the flows are fired is a permutation of
+    # the flows taken, which are precomputed (on demand) for up to MAX_ORDERED flows. Then, routing allocates nothing.
+    ALL = 0  # e.g., parallel gateways, tasks and events with several outgoing flows
+    EXCLUSIVE = 1
+    INCLUSIVE = 2
+    MAX_OR_TABLE = 10
+    MAX_ORDERED = 4
+
+    def __init__(self, kind, flows, probabilities=None):
+        self.kind = kind
+        self.flows = tuple(flows)  # In the order of the probabilities
+        self.probabilities = tuple(probabilities) if probabilities is not None else None
+        self.single_outcomes = tuple([(f_id,) for f_id in self.flows])
+        self.cumulative = None
+        self.outcomes = None  # OR splits: bitmask of the flows selected -> tuple of the flows
+        self._orderings = dict()  # Tuple of flows -> tuple of its permutations
+        if kind != self.ALL:
+            # Normalized to 1 (or equal probabilities if none), as the fallback of OR splits taking no flow
+            total = sum(self.probabilities)
+            weights = self.probabilities if total > 0 else [1] * len(self.flows)
+            total = total if total > 0 else len(self.flows)
+            cumulative = list(itertools.accumulate([weight / total for weight in weights]))
+            cumulative[-1] = 1.0
+            self.cumulative = tuple(cumulative)
+        if kind == self.INCLUSIVE and len(self.flows) <= self.MAX_OR_TABLE:
+            self.outcomes = tuple([self._flows_of(selected) for selected in range(0, 1 << len(self.flows))])
+
+    @staticmethod
+    def for_split(e_type, outgoing_flows, choice, flow_key=None):
+        # Table of a split of type e_type (BPMN), over the outgoing flows or, for the XOR/OR decisions, the candidates
+        # of their branching Choice (equally likely outgoing flows if it has none, see verify_simulation_input).
+        # flow_key maps the flow ids (e.g., to the flow indexes of a CompiledBPMNGraph)
+        flow_key = flow_key if flow_key is not None else (lambda f_id: f_id)
+        if e_type in [BPMN.EXCLUSIVE_GATEWAY, BPMN.INCLUSIVE_GATEWAY]:
+            kind = RoutingTable.EXCLUSIVE if e_type is BPMN.EXCLUSIVE_GATEWAY else RoutingTable.INCLUSIVE
+            if choice is None:
+                return RoutingTable(kind, [flow_key(f_id) for f_id in outgoing_flows],
+                                    [1 / len(outgoing_flows)] * len(outgoing_flows))
+            return RoutingTable(kind, [flow_key(f_id) for f_id in choice.candidates_list], choice.probability_list)
+        return RoutingTable(RoutingTable.ALL, [flow_key(f_id) for f_id in outgoing_flows])
+
+    def route(self, branching):
+        # Tuple of the flows taken, drawing the uniforms from branching (UniformBlocks)
+        if self.kind == self.ALL:
+            return self.flows
+        if self.kind == self.INCLUSIVE:
+            selected = 0
+            f_bit = 1
+            for probability in self.probabilities:
+                if branching.next() < probability:
+                    selected |= f_bit
+                f_bit <<= 1
+            if selected > 0:
+                return self.outcomes[selected] if self.outcomes is not None else self._flows_of(selected)
+        return self.single_outcomes[bisect.bisect_right(self.cumulative, branching.next())]
+
+    def order(self, flows, tie_breaking):
+        # Random order (uniform permutation) of the flows taken, drawing from tie_breaking (UniformBlocks)
+        if len(flows) < 2:
+            return flows
+        permutations = self._orderings.get(flows)
+        if permutations is None:
+            if len(flows) > self.MAX_ORDERED:
+                flows = list(flows)
+                tie_breaking.shuffle(flows)
+                return flows
+            permutations = self._orderings[flows] = tuple(itertools.permutations(flows))
+        return permutations[tie_breaking.index(len(permutations))]
+
+    def choice_outcomes(self):
+        # Every tuple of flows route can return, in the order of the flows
+        if self.kind == self.ALL:
+            return [self.flows]
+        if self.kind == self.EXCLUSIVE:
+            return list(self.single_outcomes)
+        outcomes = list()
+        for size in range(1, len(self.flows) + 1):
+            outcomes.extend(itertools.combinations(self.flows, size))
+        return outcomes
+
+    def _flows_of(self, selected):
+        return tuple([self.flows[i] for i in range(0, len(self.flows)) if selected >> i & 1])
+
+
+class VariantEvent:
+    # Stand-in of the i-th event of a trace while replaying its variant, whose dates are references to the dates of
+    # that event, i.e., (0, i) -> started_at and (1, i) -> completed_at
+    __slots__ = ('started_at', 'completed_at')
+
+    def __init__(self, e_index):
+        self.started_at = (0, e_index)
+        self.completed_at = (1, e_index)
+
+
+class ReplayedVariant:
+    # Result of replaying a task sequence (variant), the same for all the traces with that sequence: whether all the
+    # tasks fired, the tokens left, the frequency of each flow (i.e., added to the frequencies of the log once per
+    # trace) and the event whose date enabled each task (as a VariantEvent date, None if unknown)
+    __slots__ = ('is_correct', 'fired_tasks', 'pending_tokens', 'f_arcs_frequency', 'enabling_dates')
+
+    def __init__(self, bpmn_graph, task_sequence):
+        self.f_arcs_frequency = dict()
+        self.is_correct, self.fired_tasks, self.pending_tokens, self.enabling_dates = bpmn_graph.reply_trace(
+            task_sequence, self.f_arcs_frequency, True, [VariantEvent(i) for i in range(0, len(task_sequence))])
+
+    def enabling_times(self, trace):
+        if trace is None:
+            return [None] * len(self.enabling_dates)
+        enabling_times = list()
+        for e_date in self.enabling_dates:
+            if e_date is None:
+                enabling_times.append(None)
+            else:
+                enabling_times.append(trace[e_date[1]].completed_at if e_date[0] else trace[e_date[1]].started_at)
+        return enabling_times
+
+
+class ClosestPredecessors:
+    # Backward breadth-first search from an element, indexed by the replay indexes of its BPMNGraph: the tasks (and
+    # start event) to cross from each predecessor to the element along the shortest path, and the flow leaving each
+    # predecessor on that path (-1 if not reached). The decision flows of a path are collected walking these flows.
+    __slots__ = ('e_index', 'distance', 'next_flow')
+
+    def __init__(self, bpmn_graph, e_index):
+        total_elements = len(bpmn_graph.replay_element_ids)
+        self.e_index = e_index
+        self.distance = array('i', [-1]) * total_elements
+        self.next_flow = array('i', [-1]) * total_elements
+        counts_distance = bpmn_graph.replay_counts_distance
+        pred_arcs = bpmn_graph.replay_pred_arcs
+        self.distance[e_index] = 0
+        pred_queue = deque([e_index])
+        while pred_queue:
+            c_index = pred_queue.popleft()
+            for p_index, f_index in pred_arcs[c_index]:
+                if self.distance[p_index] < 0:
+                    self.next_flow[p_index] = f_index
+                    self.distance[p_index] = self.distance[c_index] + counts_distance[p_index]
+                    pred_queue.append(p_index)
+
+    def distance_from(self, bpmn_graph, p_id):
+        # None if p_id is not a task (or start event) preceding the element
+        p_index = bpmn_graph.replay_element_index[p_id]
+        if p_index == self.e_index or self.distance[p_index] < 0 or not bpmn_graph.replay_counts_distance[p_index]:
+            return None
+        return self.distance[p_index]
+
+    def decision_flows_from(self, bpmn_graph, p_id):
+        decision_flows = list()
+        p_index = bpmn_graph.replay_element_index[p_id]
+        while p_index != self.e_index:
+            f_index = self.next_flow[p_index]
+            if bpmn_graph.replay_is_decision[p_index]:
+                decision_flows.append(bpmn_graph.replay_flow_ids[f_index])
+            p_index = bpmn_graph.replay_flow_target[f_index]
+        return decision_flows
+
+
 class BPMNGraph:
     def __init__(self):
         self.starting_event = None
@@ -81,13 +255,25 @@ class BPMNGraph:
         self.decision_successors = dict()
         self.element_probability = None
         self.task_resource_probability = None
-        self.closest_distance = None
-        self.decision_flows_sortest_path = None
+        self.closest_predecessors = OrderedDict()  # Element id -> ClosestPredecessors, least recently used first
+        self.max_closest_predecessors = 512
+        self.replay_element_ids = None  # Integer indexes of the elements and flows, built on the first unfired task
+        self.routing = dict()  # Split id -> RoutingTable, built with the branching probabilities
+        self.replayed_variants = dict()  # Tuple of task names -> ReplayedVariant (see reply_trace_variant)
+        self._search_stack = list()  # Scratch buffers of closer_enabled_predecessors, reused by every search
+        self._search_visited = set()
+        self._search_dicts = list()
         self._c_trace = None
 
     def set_element_probabilities(self, element_probability, task_resource_probability):
         self.element_probability = element_probability
         self.task_resource_probability = task_resource_probability
+        self.routing = dict()
+        for e_id in self.element_info:
+            e_info = self.element_info[e_id]
+            if len(e_info.outgoing_flows) > 1:
+                self.routing[e_id] = RoutingTable.for_split(e_info.type, e_info.outgoing_flows,
+                                                            element_probability.get(e_id))
 
     def add_bpmn_element(self, element_id, element_info):
         if element_info.type == BPMN.START_EVENT:
@@ -97,6 +283,7 @@ class BPMNGraph:
         self.element_info[element_id] = element_info
         self.from_name[element_info.name] = element_id
         self.nodes_bitset[element_id] = (1 << len(self.element_info))
+        self._clear_closest_predecessors()
 
     def add_flow_arc(self, flow_id, source_id, target_id):
         for node_id in [source_id, target_id]:
@@ -106,6 +293,7 @@ class BPMNGraph:
         self.element_info[target_id].incoming_flows.append(flow_id)
         self.flow_arcs[flow_id] = [source_id, target_id]
         self.arcs_bitset[flow_id] = (1 << len(self.flow_arcs))
+        self._clear_closest_predecessors()
 
     def encode_or_join_predecesors(self):
         for e_id in self.element_info:
@@ -146,16 +334,21 @@ class BPMNGraph:
         visited = {or_join_id}
         self.or_join_conflicting_pred[or_join_id] = set()
         for in_flow in self.element_info[or_join_id].incoming_flows:
-            self._dfs_from_or_join(or_join_id, in_flow, self._get_predecessor(in_flow), visited)
+            self._dfs_from_or_join(or_join_id, self._get_predecessor(in_flow), visited)
 
-    def _dfs_from_or_join(self, or_id, flow_id, e_info, visited):
-        visited.add(e_info.id)
-        if e_info.type in [BPMN.INCLUSIVE_GATEWAY, BPMN.EXCLUSIVE_GATEWAY] and e_info.is_split():
-            self.or_join_conflicting_pred[or_id].add(e_info.id)
-        for in_flow in e_info.incoming_flows:
-            prev_info = self._get_predecessor(in_flow)
-            if prev_info.id not in visited and prev_info.is_gateway():
-                self._dfs_from_or_join(or_id, flow_id, prev_info, visited)
+    def _dfs_from_or_join(self, or_id, e_info, visited):
+        # Gateways reached backwards from e_info through other gateways, with an explicit stack (i.e., long cascades of
+        # gateways do not reach the recursion limit)
+        dfs_stack = [e_info]
+        while dfs_stack:
+            e_info = dfs_stack.pop()
+            visited.add(e_info.id)
+            if e_info.type in [BPMN.INCLUSIVE_GATEWAY, BPMN.EXCLUSIVE_GATEWAY] and e_info.is_split():
+                self.or_join_conflicting_pred[or_id].add(e_info.id)
+            for in_flow in reversed(e_info.incoming_flows):
+                prev_info = self._get_predecessor(in_flow)
+                if prev_info.id not in visited and prev_info.is_gateway():
+                    dfs_stack.append(prev_info)
 
     def discover_path(self, from_e_id, to_e_id):
         if from_e_id not in self.element_info or to_e_id not in self.element_info:
@@ -214,7 +407,10 @@ class BPMNGraph:
                 return False
         return False
 
-    def update_process_state(self, e_id, p_state):
+    def update_process_state(self, e_id, p_state, branching=None, tie_breaking=None):
+        # The uniforms of the routing (UniformBlocks) default to the global random state if not given
+        branching = branching if branching is not None else default_uniforms
+        tie_breaking = tie_breaking if tie_breaking is not None else default_uniforms
         if not self.is_enabled(e_id, p_state):
             return []
         enabled_tasks = list()
@@ -228,19 +424,13 @@ class BPMNGraph:
                     p_state.state_mask &= ~self.arcs_bitset[in_flow]
             f_arcs = e_info.outgoing_flows
             if len(f_arcs) > 1:
-                if e_info.type is BPMN.EXCLUSIVE_GATEWAY:
-                    f_arcs = [self.element_probability[e_info.id].get_outgoing_flow()]
-                else:
-                    if e_info.type in [BPMN.TASK, BPMN.PARALLEL_GATEWAY, BPMN.START_EVENT]:
-                        f_arcs = copy.deepcopy(e_info.outgoing_flows)
-                    elif e_info.type is BPMN.INCLUSIVE_GATEWAY:
-                        f_arcs = self.element_probability[e_info.id].get_multiple_flows()
-                random.shuffle(f_arcs)
+                routing = self.routing[e_info.id]
+                f_arcs = routing.order(routing.route(branching), tie_breaking)
             for f_arc in f_arcs:
                 self._find_next(f_arc, p_state, enabled_tasks, to_execute)
             current += 1
         if len(enabled_tasks) > 1:
-            random.shuffle(enabled_tasks)
+            tie_breaking.shuffle(enabled_tasks)
         return enabled_tasks
 
     def reply_trace(self, task_sequence, f_arcs_frequency, post_p=True, trace=None):
@@ -294,61 +484,84 @@ class BPMNGraph:
         self._c_trace = None
         return is_correct, fired_tasks, p_state.pending_tokens(), task_enabling
 
+    def reply_trace_variant(self, task_sequence, f_arcs_frequency, trace=None, count=1):
+        # Same result as reply_trace (with post-processing), but each distinct task sequence (variant) is replayed once.
+        # The tokens do not depend on the dates of the events, so the variant is replayed on stand-ins of its events,
+        # and only the enabling times are taken from the dates of the trace (None without trace). The flow frequencies
+        # of the variant are added count times, e.g., once per trace, or at once for all the traces of the variant.
+        variant_key = tuple(task_sequence)
+        variant = self.replayed_variants.get(variant_key)
+        if variant is None:
+            variant = self.replayed_variants[variant_key] = ReplayedVariant(self, task_sequence)
+        for flow_id in variant.f_arcs_frequency:
+            f_arcs_frequency[flow_id] = f_arcs_frequency.get(flow_id, 0) + variant.f_arcs_frequency[flow_id] * count
+        return variant.is_correct, list(variant.fired_tasks), list(variant.pending_tokens), \
+            variant.enabling_times(trace)
+
     def postprocess_unfired_tasks(self, task_sequence: list, fired_tasks: list, f_arcs_frequency: dict,
                                   task_enablement: list):
-        if self.closest_distance is None:
-            self._sort_by_closest_predecesors()
         task_sequence = [task_name for task_name in task_sequence if task_name in self.from_name]
         for i in range(0, len(fired_tasks)):
             if not fired_tasks[i]:
                 e_info = self.element_info[self.from_name.get(task_sequence[i])]
-                fix_from = [self.starting_event, self.closest_distance[e_info.id][self.starting_event]]
+                e_pred = self._closest_predecessors(e_info.id)
+                fix_from = [self.starting_event, e_pred.distance_from(self, self.starting_event)]
+                if fix_from[1] is None:
+                    fix_from = [None, sys.maxsize]
                 j = i - 1
                 while j >= 0:
-                    p_info = self.element_info[self.from_name.get(task_sequence[j])]
-                    if p_info.id in self.closest_distance[e_info.id] and self.closest_distance[e_info.id][p_info.id] < \
-                            fix_from[1]:
-                        fix_from = [p_info.id, self.closest_distance[e_info.id][p_info.id]]
+                    p_distance = e_pred.distance_from(self, self.from_name.get(task_sequence[j]))
+                    if p_distance is not None and p_distance < fix_from[1]:
+                        fix_from = [self.from_name.get(task_sequence[j]), p_distance]
                         if fix_from[1] == 1:
                             break
                     j -= 1
                 if fix_from[0] is not None:
                     if task_enablement[i] is None:
                         task_enablement[i] = self._c_trace[j].completed_at if j >= 0 else self._c_trace[0].completed_at
-                    for flow_id in self.decision_flows_sortest_path[e_info.id][fix_from[0]]:
+                    for flow_id in e_pred.decision_flows_from(self, fix_from[0]):
                         if flow_id not in f_arcs_frequency:
                             f_arcs_frequency[flow_id] = 0
                         f_arcs_frequency[flow_id] += 1
 
-    def _sort_by_closest_predecesors(self):
-        self.closest_distance = dict()
-        self.decision_flows_sortest_path = dict()
-        for e_id in self.element_info:
-            self.closest_distance[e_id] = dict()
-            pred_seq = dict()
-            distance_map = {e_id: 0}
-            pred_queue = deque([self.element_info[e_id]])
-            while pred_queue:
-                e_info = pred_queue.popleft()
-                for flow_id in e_info.incoming_flows:
-                    pred_info = self._get_predecessor(flow_id)
-                    if pred_info.id not in distance_map:
-                        pred_seq[pred_info.id] = flow_id
-                        dist = distance_map[e_info.id]
-                        if pred_info.type in [BPMN.TASK, BPMN.START_EVENT]:
-                            dist += 1
-                            self.closest_distance[e_id][pred_info.id] = dist
-                        distance_map[pred_info.id] = dist
-                        pred_queue.append(pred_info)
-            self.decision_flows_sortest_path[e_id] = dict()
-            for p_id in self.element_info:
-                self.decision_flows_sortest_path[e_id][p_id] = list()
-                if p_id is not e_id and p_id in self.closest_distance[e_id]:
-                    p_info = self.element_info[p_id]
-                    while p_info.id is not e_id:
-                        if p_info.type in [BPMN.INCLUSIVE_GATEWAY, BPMN.EXCLUSIVE_GATEWAY] and p_info.is_split():
-                            self.decision_flows_sortest_path[e_id][p_id].append(pred_seq[p_info.id])
-                        p_info = self._get_successor(pred_seq[p_info.id])
+    def _closest_predecessors(self, e_id):
+        # Searched on demand per element, keeping only the max_closest_predecessors most recently used, i.e., the
+        # memory does not grow with the square of the elements of the model
+        e_pred = self.closest_predecessors.get(e_id)
+        if e_pred is not None:
+            self.closest_predecessors.move_to_end(e_id)
+            return e_pred
+        if self.replay_element_ids is None:
+            self._index_replay_elements()
+        e_pred = ClosestPredecessors(self, self.replay_element_index[e_id])
+        self.closest_predecessors[e_id] = e_pred
+        if len(self.closest_predecessors) > self.max_closest_predecessors:
+            self.closest_predecessors.popitem(last=False)
+        return e_pred
+
+    def _index_replay_elements(self):
+        self.replay_element_ids = list(self.element_info.keys())
+        self.replay_element_index = {e_id: i for i, e_id in enumerate(self.replay_element_ids)}
+        self.replay_flow_ids = list(self.flow_arcs.keys())
+        self.replay_flow_target = array('i', [self.replay_element_index[self.flow_arcs[f_id][1]]
+                                              for f_id in self.replay_flow_ids])
+        flow_index = {f_id: i for i, f_id in enumerate(self.replay_flow_ids)}
+        self.replay_pred_arcs = list()
+        self.replay_counts_distance = array('b')
+        self.replay_is_decision = array('b')
+        for e_id in self.replay_element_ids:
+            e_info = self.element_info[e_id]
+            self.replay_pred_arcs.append(tuple([(self.replay_element_index[self.flow_arcs[f_id][0]], flow_index[f_id])
+                                                for f_id in e_info.incoming_flows]))
+            self.replay_counts_distance.append(e_info.type in [BPMN.TASK, BPMN.START_EVENT])
+            self.replay_is_decision.append(e_info.type in [BPMN.INCLUSIVE_GATEWAY, BPMN.EXCLUSIVE_GATEWAY]
+                                           and e_info.is_split())
+
+    def _clear_closest_predecessors(self):
+        # The searches and replays cached are of the graph before an element or flow was added
+        self.closest_predecessors = OrderedDict()
+        self.replay_element_ids = None
+        self.replayed_variants = dict()
 
     def try_firing(self, task_index, from_index, task_sequence, fired_tasks, pending_tasks, p_state,
                    f_arcs_frequency, fired_or_splits):
@@ -372,12 +585,66 @@ class BPMNGraph:
 
     def closer_enabled_predecessors(self, e_info, flow_id, enabled_pred, or_firing, path_split, visited, p_state, dist,
                                     min_dist):
+        # Depth-first search backwards from e_info of the closest enabled elements, with an explicit stack of frames
+        # [e_info, enabled_pred, or_firing, path_split, dist, next incoming flow, c_min, closest branch, searched branch]
+        # (i.e., large cascades of gateways do not reach the recursion limit). The branches of an XOR join are searched
+        # in scratch dictionaries, returned to a pool once merged into (or discarded by) the join.
+        search_stack = self._search_stack
+        base = len(search_stack)
+        c_min = self._enter_predecessor(e_info, flow_id, enabled_pred, or_firing, path_split, visited, p_state, dist,
+                                        min_dist)
+        while len(search_stack) > base:
+            frame = search_stack[-1]
+            e_info = frame[0]
+            if c_min is not None:
+                self._merge_branch(frame, c_min)
+            in_flows = e_info.incoming_flows
+            is_xor_join = e_info.type is BPMN.EXCLUSIVE_GATEWAY and e_info.is_join()
+            while frame[5] < len(in_flows):
+                in_flow = in_flows[frame[5]]
+                frame[5] += 1
+                pred_info = self._get_predecessor(in_flow)
+                if pred_info.id in visited:
+                    continue
+                if is_xor_join:
+                    frame[8] = [self._scratch_dict(), self._scratch_dict(), self._scratch_dict()]
+                    c_min = self._enter_predecessor(pred_info, in_flow, frame[8][0], frame[8][1], frame[8][2],
+                                                    visited, p_state, frame[4] + 1, min_dist)
+                elif pred_info.is_gateway():
+                    c_min = self._enter_predecessor(pred_info, in_flow, frame[1], frame[2], frame[3], visited,
+                                                    p_state, frame[4] + 1, min_dist)
+                else:
+                    continue
+                if c_min is None:
+                    break  # The frame of pred_info was pushed, i.e., its result is merged when popped
+                self._merge_branch(frame, c_min)
+            if search_stack[-1] is not frame:
+                continue
+            search_stack.pop()
+            if is_xor_join and frame[7] is not None:
+                closer_pred, or_f, temp_path = frame[7]
+                for e_id in closer_pred:
+                    frame[1][e_id] = closer_pred[e_id]
+                for e_id in temp_path:
+                    frame[3][e_id] = temp_path[e_id]
+                for e_id in or_f:
+                    frame[2][e_id] = frame[4]
+                self._release_branch(frame[7])
+            c_min = frame[6]
+            if len(search_stack) == base:
+                return c_min, frame[1], frame[2], frame[3]
+        return c_min, enabled_pred, or_firing, path_split
+
+    def _enter_predecessor(self, e_info, flow_id, enabled_pred, or_firing, path_split, visited, p_state, dist,
+                           min_dist):
+        # Distance to the closest enabled element if known without searching the predecessors of e_info, otherwise
+        # None and the frame of e_info is pushed
         if self.is_enabled(e_info.id, p_state):
             if dist not in enabled_pred:
                 enabled_pred[dist] = list()
             enabled_pred[dist].append([e_info, flow_id])
             min_dist[0] = max(min_dist[0], dist)
-            return dist, enabled_pred, or_firing, path_split
+            return dist
         elif e_info.type is BPMN.INCLUSIVE_GATEWAY and e_info.is_join():
             for in_or in e_info.incoming_flows:
                 if p_state.has_token(in_or):
@@ -386,41 +653,44 @@ class BPMNGraph:
         if e_info.type in [BPMN.INCLUSIVE_GATEWAY, BPMN.EXCLUSIVE_GATEWAY]:
             path_split[e_info.id] = flow_id
         visited.add(e_info.id)
-        if e_info.is_gateway():
-            if e_info.type is BPMN.EXCLUSIVE_GATEWAY and e_info.is_join():
-                closer_pred, temp_path, or_f = dict(), dict(), dict()
-                c_min = sys.maxsize
-                for in_flow in e_info.incoming_flows:
-                    pr_info = self._get_predecessor(in_flow)
-                    if pr_info.id not in visited:
-                        d, e_p, o_f, t_path = self.closer_enabled_predecessors(pr_info, in_flow, dict(), dict(), dict(),
-                                                                               visited, p_state, dist + 1, min_dist)
-                        if d < c_min:
-                            c_min, closer_pred, or_f, temp_path = d, e_p, o_f, t_path
-                for e_id in closer_pred:
-                    enabled_pred[e_id] = closer_pred[e_id]
-                for e_id in temp_path:
-                    path_split[e_id] = temp_path[e_id]
-                for e_id in or_f:
-                    or_firing[e_id] = dist
-                return c_min, enabled_pred, or_firing, path_split
-            else:
-                c_min = dist if e_info.id in or_firing else sys.maxsize
-                for in_flow in e_info.incoming_flows:
-                    pred_info = self._get_predecessor(in_flow)
-                    if pred_info.id not in visited and pred_info.is_gateway():
-                        res = self.closer_enabled_predecessors(pred_info, in_flow, enabled_pred, or_firing, path_split,
-                                                               visited, p_state, dist + 1, min_dist)
-                        c_min = min(res[0], c_min)
+        if not e_info.is_gateway():
+            return sys.maxsize
+        if e_info.type is BPMN.EXCLUSIVE_GATEWAY and e_info.is_join():
+            c_min = sys.maxsize
+        else:
+            c_min = dist if e_info.id in or_firing else sys.maxsize
+        self._search_stack.append([e_info, enabled_pred, or_firing, path_split, dist, 0, c_min, None, None])
+        return None
+
+    def _merge_branch(self, frame, c_min):
+        # Result of the last predecessor searched from the frame, for an XOR join only the closest branch is kept
+        if frame[8] is None:
+            frame[6] = min(c_min, frame[6])
+            return
+        if c_min < frame[6]:
+            frame[6] = c_min
+            if frame[7] is not None:
+                self._release_branch(frame[7])
+            frame[7] = frame[8]
+        else:
+            self._release_branch(frame[8])
+        frame[8] = None
+
+    def _scratch_dict(self):
+        return self._search_dicts.pop() if self._search_dicts else dict()
 
-                return c_min, enabled_pred, or_firing, path_split
-        return sys.maxsize, enabled_pred, or_firing, path_split
+    def _release_branch(self, branch):
+        for s_dict in branch:
+            s_dict.clear()
+            self._search_dicts.append(s_dict)
 
     def _find_enabled_predecessors(self, from_task_info, p_state):
         pred_info = self._get_predecessor(from_task_info.incoming_flows[0])
         max_dist = [0]
+        visited = self._search_visited
+        visited.clear()
         closer_pred = self.closer_enabled_predecessors(pred_info, from_task_info.incoming_flows[0], dict(),
-                                                       dict(), dict(), set(), p_state, 0,
+                                                       dict(), dict(), visited, p_state, 0,
                                                        max_dist)
         enabled_pred = deque()
         for i in range(0, max_dist[0] + 1):
@@ -578,6 +848,340 @@ class BPMNGraph:
                 to_execute.append(next_e)
 
 
+class CompiledProcessState:
+    # Marking of a case in a CompiledBPMNGraph, i.e., the bitmask of the marked flows (bit i set if flow i holds a
+    # token), and only for the flows holding more than one token, their extra tokens (None if there's none). Then, the
+    # memory of a case depends on the flows marked instead of on the size of the model. The marking is safe (the
+    # bitmask identifies it) if extra_tokens is None.
+    __slots__ = ('state_mask', 'extra_tokens')
+
+    def __init__(self):
+        self.state_mask = 0
+        self.extra_tokens = None
+
+    def tokens_of(self, f_index):
+        if not self.state_mask >> f_index & 1:
+            return 0
+        return 1 + (self.extra_tokens.get(f_index, 0) if self.extra_tokens is not None else 0)
+
+
+class TransitionDecision:
+    # Branching decision reached by a memoized transition, i.e., the split gateway and the nodes following each choice
+    # (tuple of the indexes of the outgoing flows taken)
+    __slots__ = ('gateway', 'next_nodes')
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.next_nodes = dict()
+
+
+class TransitionResult:
+    # Marking after a memoized transition and the tasks it enables (before the tie-breaking shuffle). The state_mask is
+    # None if the transition is played on the tokens instead, e.g., if it leads to an unsafe marking
+    __slots__ = ('state_mask', 'enabled_tasks')
+
+    def __init__(self, state_mask, enabled_tasks):
+        self.state_mask = state_mask
+        self.enabled_tasks = enabled_tasks
+
+
+class CompiledBPMNGraph:
+    # Integer-indexed copy of a BPMNGraph for the token game of the simulation. The elements and flows are numbered in
+    # their order in the graph, and each element keeps the tuples of its incoming/outgoing flows and the bitmask of its
+    # incoming flows, i.e., checking whether an element is enabled is a mask test instead of a loop over dicts. The
+    # ids are only mapped at the boundaries, i.e., update_process_state takes and returns element ids as BPMNGraph.
+    TASK = 0
+    START_EVENT = 1
+    END_EVENT = 2
+    EXCLUSIVE_GATEWAY = 3
+    INCLUSIVE_GATEWAY = 4
+    PARALLEL_GATEWAY = 5
+    UNDEFINED = 6
+
+    def __init__(self, bpmn_graph: BPMNGraph):
+        type_codes = {BPMN.TASK: self.TASK, BPMN.START_EVENT: self.START_EVENT, BPMN.END_EVENT: self.END_EVENT,
+                      BPMN.EXCLUSIVE_GATEWAY: self.EXCLUSIVE_GATEWAY, BPMN.INCLUSIVE_GATEWAY: self.INCLUSIVE_GATEWAY,
+                      BPMN.PARALLEL_GATEWAY: self.PARALLEL_GATEWAY}
+        self.element_ids = list(bpmn_graph.element_info.keys())  # Index -> element id
+        self.element_index = dict()  # Element id -> index
+        for e_index in range(0, len(self.element_ids)):
+            self.element_index[self.element_ids[e_index]] = e_index
+        self.flow_ids = list(bpmn_graph.flow_arcs.keys())  # Index -> flow id
+        self.flow_index = dict()  # Flow id -> index
+        for f_index in range(0, len(self.flow_ids)):
+            self.flow_index[self.flow_ids[f_index]] = f_index
+        self.flow_target = [self.element_index[bpmn_graph.flow_arcs[f_id][1]] for f_id in self.flow_ids]
+
+        self.element_type = list()
+        self.incoming_flows = list()
+        self.outgoing_flows = list()
+        self.incoming_mask = list()  # Index -> bitmask of the incoming flows
+        self.split_mask = list()  # Index -> bitmask enabling an OR split, i.e., its first incoming and outgoing flows
+        self.or_join_mask = list()  # Index -> bitmask of the flows preceding an OR join (0 for other elements)
+        self.routing = list()  # Index -> RoutingTable over the flow indexes (None if a single outgoing flow)
+        for e_id in self.element_ids:
+            e_info = bpmn_graph.element_info[e_id]
+            e_type = type_codes.get(e_info.type, self.UNDEFINED)
+            in_flows = tuple([self.flow_index[f_id] for f_id in e_info.incoming_flows])
+            out_flows = tuple([self.flow_index[f_id] for f_id in e_info.outgoing_flows])
+            self.element_type.append(e_type)
+            self.incoming_flows.append(in_flows)
+            self.outgoing_flows.append(out_flows)
+            self.incoming_mask.append(self._flows_mask(in_flows))
+            self.split_mask.append(self._flows_mask(in_flows[:1] + out_flows))
+            # BPMNGraph numbers the flow bits from 1, i.e., its masks are shifted one position
+            self.or_join_mask.append(bpmn_graph.or_join_pred[e_id][1] >> 1 if e_id in bpmn_graph.or_join_pred else 0)
+            choice = bpmn_graph.element_probability.get(e_id) if bpmn_graph.element_probability is not None else None
+            self.routing.append(RoutingTable.for_split(e_info.type, e_info.outgoing_flows, choice,
+                                                       self.flow_index.get) if len(out_flows) > 1 else None)
+        self.starting_event = bpmn_graph.starting_event
+        self.end_event = bpmn_graph.end_event
+        self._starting_index = self.element_index.get(bpmn_graph.starting_event)
+        self._task_indexes = [e_index for e_index in range(0, len(self.element_ids))
+                              if self.element_type[e_index] == self.TASK]
+
+        # Memoized transitions (see memoize_transitions), None if the token game is always played
+        self._transitions = None
+        self._transition_nodes = dict()  # Transition -> nodes (decisions and results) of its tree
+        self._cached_nodes = 0
+        self._max_transitions = 0
+        self.transition_hits = 0
+        self.transition_misses = 0
+
+    def memoize_transitions(self, max_transitions, explore=True):
+        # Caches the transitions of the safe markings, i.e., (state_mask, fired element) -> the tree of the branching
+        # decisions it reaches, whose leaves are the marking after the transition and the tasks it enables. Then, a case
+        # step draws the decisions and looks up the result instead of playing the token game. The nodes of the trees
+        # (decisions and results) count against max_transitions, e.g., an OR split with k outgoing flows may add up to
+        # 2^k - 1 nodes. If explore, the markings reachable from the initial one are explored up-front (breadth-first)
+        # until max_transitions nodes are cached, and the rest are cached as they are reached, discarding the least
+        # recently used transitions beyond max_transitions nodes.
+        # Within a transition the elements are fired in a fixed order, and only the tasks enabled are shuffled. The token
+        # game fires the flows of a split in a random order, which only changes the result if an OR join is reached while
+        # they are pending, so those transitions are played on the tokens instead, taking the decisions already drawn.
+        # Then, the results follow the same distribution as the token game but do not draw the same random numbers.
+        self._transitions = OrderedDict()
+        self._transition_nodes = dict()
+        self._cached_nodes = 0
+        self._max_transitions = max_transitions
+        if explore:
+            self._explore_transitions()
+
+    def cached_transitions(self):
+        return len(self._transitions) if self._transitions is not None else 0
+
+    def cached_nodes(self):
+        return self._cached_nodes
+
+    def initial_state(self):
+        return CompiledProcessState()
+
+    def is_enabled(self, e_id, p_state: CompiledProcessState):
+        e_index = self.element_index.get(e_id)
+        return e_index is not None and self._is_enabled(e_index, p_state.state_mask)
+
+    def _is_enabled(self, e_index, state_mask):
+        if e_index == self._starting_index:
+            return True
+        e_type = self.element_type[e_index]
+        in_mask = self.incoming_mask[e_index]
+        if e_type in (self.TASK, self.END_EVENT, self.PARALLEL_GATEWAY):
+            return state_mask & in_mask == in_mask
+        elif e_type == self.EXCLUSIVE_GATEWAY:
+            return state_mask & in_mask != 0
+        elif e_type == self.INCLUSIVE_GATEWAY:
+            if len(self.outgoing_flows[e_index]) > 1:
+                return state_mask & self.split_mask[e_index] != 0
+            if state_mask & in_mask == in_mask:
+                return True
+            return state_mask & in_mask != 0 and self.or_join_mask[e_index] & state_mask == 0
+        return False
+
+    def update_process_state(self, e_id, p_state: CompiledProcessState, branching=None, tie_breaking=None):
+        # Same token game (and draws of uniforms) as BPMNGraph.update_process_state
+        branching = branching if branching is not None else default_uniforms
+        tie_breaking = tie_breaking if tie_breaking is not None else default_uniforms
+        e_index = self.element_index.get(e_id)
+        if e_index is None or not self._is_enabled(e_index, p_state.state_mask):
+            return []
+        drawn = None  # Split gateway -> choice drawn by the memoized transition, taken by the token game instead
+        if self._transitions is not None and p_state.extra_tokens is None:
+            drawn = dict()
+            enabled_tasks = self._memoized_transition(e_index, p_state, branching, drawn)
+            if enabled_tasks is not None:
+                if len(enabled_tasks) > 1:
+                    tie_breaking.shuffle(enabled_tasks)
+                return enabled_tasks
+        state_mask, extra_tokens = p_state.state_mask, p_state.extra_tokens
+        element_type, outgoing_flows, flow_target = self.element_type, self.outgoing_flows, self.flow_target
+        incoming_mask, task_type, routing = self.incoming_mask, self.TASK, self.routing
+        enabled_tasks = list()
+        to_execute = [e_index]
+        current = 0
+        while current < len(to_execute):
+            e_index = to_execute[current]
+            for in_flow in self.incoming_flows[e_index]:
+                if extra_tokens is not None and in_flow in extra_tokens:
+                    extra_tokens[in_flow] -= 1
+                    if extra_tokens[in_flow] == 0:
+                        del extra_tokens[in_flow]
+                        if not extra_tokens:
+                            extra_tokens = None
+                else:
+                    state_mask &= ~(1 << in_flow)
+            f_arcs = outgoing_flows[e_index]
+            if len(f_arcs) > 1:
+                taken = drawn.pop(e_index, None) if drawn else None
+                f_arcs = routing[e_index].order(taken if taken is not None else routing[e_index].route(branching),
+                                                tie_breaking)
+            for f_arc in f_arcs:
+                if state_mask >> f_arc & 1:
+                    if extra_tokens is None:
+                        extra_tokens = dict()
+                    extra_tokens[f_arc] = extra_tokens.get(f_arc, 0) + 1
+                else:
+                    state_mask |= 1 << f_arc
+                next_e = flow_target[f_arc]
+                # The tasks (most of the elements) are enabled once all their incoming flows are marked
+                if element_type[next_e] == task_type:
+                    if state_mask & incoming_mask[next_e] == incoming_mask[next_e]:
+                        enabled_tasks.append(self.element_ids[next_e])
+                elif self._is_enabled(next_e, state_mask):
+                    to_execute.append(next_e)
+            current += 1
+        p_state.state_mask, p_state.extra_tokens = state_mask, extra_tokens
+        if len(enabled_tasks) > 1:
+            tie_breaking.shuffle(enabled_tasks)
+        return enabled_tasks
+
+    def _memoized_transition(self, e_index, p_state: CompiledProcessState, branching, drawn):
+        # Enabled tasks (and the marking updated) by the memoized transition, None if it is played on the tokens (see
+        # _walk_transition), then the first choice drawn at each split gateway is left in drawn for the token game
+        state_mask = p_state.state_mask
+        key = (state_mask, e_index)
+        node = self._transitions.get(key)
+        if node is None:
+            self.transition_misses += 1
+            node = self._walk_transition(e_index, state_mask, [])
+            if self._reserve_node(None):
+                self._transitions[key] = node
+                self._transition_nodes[key] = 1
+        else:
+            self.transition_hits += 1
+            self._transitions.move_to_end(key)
+        decisions = list()
+        while type(node) is TransitionDecision:
+            choice = self.routing[node.gateway].route(branching)
+            decisions.append(choice)
+            if node.gateway not in drawn:
+                drawn[node.gateway] = choice
+            next_node = node.next_nodes.get(choice)
+            if next_node is None:
+                next_node = self._walk_transition(e_index, state_mask, decisions)
+                if key in self._transitions and self._reserve_node(key):
+                    node.next_nodes[choice] = next_node
+            node = next_node
+        if node.state_mask is None:
+            return None
+        p_state.state_mask = node.state_mask
+        return list(node.enabled_tasks)
+
+    def _reserve_node(self, key):
+        # Room for a new node in the tree of the transition key (a new transition if None), discarding the least
+        # recently used transitions. False if the tree of key alone takes max_transitions nodes, then the node is
+        # walked but not cached
+        transitions = self._transitions
+        while self._cached_nodes >= self._max_transitions:
+            lru_key = next(iter(transitions), None)
+            if lru_key is None or lru_key == key:
+                return False
+            del transitions[lru_key]
+            self._cached_nodes -= self._transition_nodes.pop(lru_key)
+        self._cached_nodes += 1
+        if key is not None:
+            self._transition_nodes[key] += 1
+        return True
+
+    def _walk_transition(self, e_index, state_mask, decisions):
+        # Token game on a safe marking (bitmask) taking the given decisions, in order, at the split gateways. Returns a
+        # TransitionDecision at the first split gateway beyond the decisions, or the TransitionResult. The result is
+        # unsafe (played on the tokens) if it leads to an unsafe marking, or if it reaches an OR join (not fully marked)
+        # after a split fired several flows, as whether the join is enabled depends on the order they are fired
+        element_type, outgoing_flows, flow_target = self.element_type, self.outgoing_flows, self.flow_target
+        incoming_mask, task_type, inclusive_type = self.incoming_mask, self.TASK, self.INCLUSIVE_GATEWAY
+        d_index = 0
+        reordered = False
+        enabled_tasks = list()
+        to_execute = [e_index]
+        current = 0
+        while current < len(to_execute):
+            e_index = to_execute[current]
+            state_mask &= ~incoming_mask[e_index]
+            f_arcs = outgoing_flows[e_index]
+            if len(f_arcs) > 1 and element_type[e_index] in (self.EXCLUSIVE_GATEWAY, self.INCLUSIVE_GATEWAY):
+                if d_index == len(decisions):
+                    return TransitionDecision(e_index)
+                f_arcs = decisions[d_index]
+                d_index += 1
+            reordered = reordered or len(f_arcs) > 1
+            for f_arc in f_arcs:
+                f_bit = 1 << f_arc
+                if state_mask & f_bit:
+                    return TransitionResult(None, None)
+                state_mask |= f_bit
+                next_e = flow_target[f_arc]
+                if element_type[next_e] == task_type:
+                    if state_mask & incoming_mask[next_e] == incoming_mask[next_e]:
+                        enabled_tasks.append(self.element_ids[next_e])
+                elif reordered and element_type[next_e] == inclusive_type \
+                        and state_mask & incoming_mask[next_e] != incoming_mask[next_e]:
+                    return TransitionResult(None, None)
+                elif self._is_enabled(next_e, state_mask):
+                    to_execute.append(next_e)
+            current += 1
+        return TransitionResult(state_mask, tuple(enabled_tasks))
+
+    def _explore_transitions(self):
+        # Breadth-first over the safe markings reachable from the initial one, firing every task enabled in each one
+        # (the engine fires each enabled task once) and taking every choice of the decisions reached, until
+        # max_transitions nodes are cached. The choices left unexplored are walked (and cached) once drawn
+        explored_markings = {0}
+        pending = deque([(0, self._starting_index)])
+        while pending and self._cached_nodes < self._max_transitions:
+            state_mask, e_index = pending.popleft()
+            key = (state_mask, e_index)
+            if key in self._transitions:
+                continue
+            root = self._transitions[key] = self._walk_transition(e_index, state_mask, [])
+            self._transition_nodes[key] = 1
+            self._cached_nodes += 1
+            to_expand = [(root, [])]
+            while to_expand:
+                node, decisions = to_expand.pop()
+                if type(node) is TransitionDecision:
+                    for choice in self.routing[node.gateway].choice_outcomes():
+                        if self._cached_nodes >= self._max_transitions:
+                            break
+                        self._transition_nodes[key] += 1
+                        self._cached_nodes += 1
+                        next_decisions = decisions + [choice]
+                        next_node = node.next_nodes[choice] = self._walk_transition(e_index, state_mask,
+                                                                                    next_decisions)
+                        to_expand.append((next_node, next_decisions))
+                elif node.state_mask is not None and node.state_mask not in explored_markings:
+                    explored_markings.add(node.state_mask)
+                    for t_index in self._task_indexes:
+                        if node.state_mask & self.incoming_mask[t_index] == self.incoming_mask[t_index]:
+                            pending.append((node.state_mask, t_index))
+
+    @staticmethod
+    def _flows_mask(flow_indexes):
+        f_mask = 0
+        for f_index in flow_indexes:
+            f_mask |= 1 << f_index
+        return f_mask
+
+
 def discover_bpmn_from_log(log_path, process_name):
     log = pm4py.read_xes(log_path)
     tree = pm4py.discover_process_tree_inductive(log)
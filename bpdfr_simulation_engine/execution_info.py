@@ -1,9 +1,13 @@
 import datetime
+from array import array
+
+import numpy
 import pytz
 
 
 class TaskEvent:
-    def __init__(self, p_case, task_id, resource_id, resource_available_at=None, enabled_at=None, enabled_datetime=None, bpm_env=None):
+    # Event parsed from an event-log, the simulation engine stores its events in an EventStore instead
+    def __init__(self, p_case, task_id, resource_id, enabled_at=None):
         self.p_case = p_case  # ID of the current trace, i.e., index of the trace in log_info list
         self.task_id = task_id  # Name of the task related to the current event
         self.resource_id = resource_id  # ID of the resource performing to the event
@@ -12,43 +16,12 @@ class TaskEvent:
         self.normalized_waiting = None
         self.normalized_processing = None
 
-        if resource_available_at is not None:
-            # Time moment in seconds from beginning, i.e., first event has time = 0
-            self.enabled_at = enabled_at
-            # Datetime of the time-moment calculated from the starting simulation datetime
-            self.enabled_datetime = enabled_datetime
-
-            # Time moment in seconds from beginning, i.e., first event has time = 0
-            self.started_at = max(resource_available_at, enabled_at)
-            # Datetime of the time-moment calculated from the starting simulation datetime
-            self.started_datetime = bpm_env.simulation_datetime_from(self.started_at)
-
-            # Ideal duration from the distribution-function if allocate resource doesn't rest
-            self.ideal_duration = bpm_env.sim_setup.ideal_task_duration(task_id, resource_id)
-            # Actual duration adding the resource resting-time according to their calendar
-            self.real_duration = bpm_env.sim_setup.real_task_duration(self.ideal_duration, self.resource_id,
-                                                                      self.started_datetime)
-
-            # Time moment in seconds from beginning, i.e., first event has time = 0
-            self.completed_at = self.started_at + self.real_duration
-            # Datetime of the time-moment calculated from the starting simulation datetime
-            self.completed_datetime = bpm_env.simulation_datetime_from(self.completed_at)
-
-            # Time of a resource was resting while performing a task (in seconds)
-            self.idle_time = self.real_duration - self.ideal_duration
-            # Time from an event is enabled until it is started by any resource
-            self.waiting_time = self.started_at - self.enabled_at
-            self.idle_cycle_time = self.completed_at - self.enabled_at
-            self.idle_processing_time = self.completed_at - self.started_at
-            self.cycle_time = self.idle_cycle_time - self.idle_time
-            self.processing_time = self.idle_processing_time - self.idle_time
-        else:
-            self.task_name = None
-            self.enabled_at = enabled_at
-            self.enabled_by = None
-            self.started_at = None
-            self.completed_at = None
-            self.idle_time = None
+        self.task_name = None
+        self.enabled_at = enabled_at
+        self.enabled_by = None
+        self.started_at = None
+        self.completed_at = None
+        self.idle_time = None
 
     def update_enabling_times(self, enabled_at):
         if self.started_at is None or enabled_at > self.started_at:
@@ -73,6 +46,9 @@ class Trace:
         self.started_at = started_at
         self.completed_at = started_at
         self.event_list = list()
+        # Events of a simulated trace, i.e., first and last rows of its chain of events in the EventStore
+        self.first_event = -1
+        self.last_event = -1
 
         self.cycle_time = None
         self.idle_cycle_time = None
@@ -113,15 +89,117 @@ class Trace:
 
 
 
+class EventStore:
+    # Completed events of a simulation as struct-of-arrays columns (array module, with amortized growth), instead of
+    # one TaskEvent object per event. Tasks and resources are stored by their index in task_ids and resource_ids.
+    # The events of a case are chained by next_event (-1 ends the chain) from the first_event of its Trace. The task
+    # KPIs are computed over the columns (see to_numpy), the idle time being the real duration minus the ideal one.
+    def __init__(self, task_ids, resource_ids):
+        self.task_ids = list(task_ids)
+        self.resource_ids = list(resource_ids)
+        self.task_index = dict()
+        for i in range(0, len(self.task_ids)):
+            self.task_index[self.task_ids[i]] = i
+        self.resource_index = dict()
+        for i in range(0, len(self.resource_ids)):
+            self.resource_index[self.resource_ids[i]] = i
+        self.released = 0  # Events of completed cases that are no longer needed, removed by compact()
+        self._init_columns()
+
+    def _init_columns(self):
+        self.p_case = array('q')
+        self.task = array('i')
+        self.resource = array('i')
+        self.enabled_at = array('d')
+        self.started_at = array('d')
+        self.completed_at = array('d')
+        self.idle_time = array('d')
+        self.next_event = array('q')
+
+    def size(self):
+        return len(self.p_case)
+
+    def add_event(self, trace_info: Trace, task_id, resource_id, enabled_at, started_at, completed_at, idle_time):
+        e_index = len(self.p_case)
+        self.p_case.append(trace_info.p_case)
+        self.task.append(self.task_index[task_id])
+        self.resource.append(self.resource_index[resource_id])
+        self.enabled_at.append(enabled_at)
+        self.started_at.append(started_at)
+        self.completed_at.append(completed_at)
+        self.idle_time.append(idle_time)
+        self.next_event.append(-1)
+        if trace_info.last_event < 0:
+            trace_info.first_event = e_index
+        else:
+            self.next_event[trace_info.last_event] = e_index
+        trace_info.last_event = e_index
+        return e_index
+
+    def case_events(self, trace_info: Trace):
+        e_index = trace_info.first_event
+        while e_index >= 0:
+            yield e_index
+            e_index = self.next_event[e_index]
+
+    def resource_id(self, e_index):
+        return self.resource_ids[self.resource[e_index]]
+
+    def release_case(self, trace_info: Trace):
+        for _ in self.case_events(trace_info):
+            self.released += 1
+        trace_info.first_event = trace_info.last_event = -1
+
+    def released_rows(self, live_traces):
+        # Indexes of the events not in the (live) traces, i.e., those dropped by compact()
+        is_live = numpy.zeros(self.size(), dtype=bool)
+        for trace_info in live_traces:
+            for e_index in self.case_events(trace_info):
+                is_live[e_index] = True
+        return numpy.flatnonzero(~is_live)
+
+    def compact(self, live_traces):
+        # Copies the events of the (live) traces into new columns, dropping the released ones
+        task, resource, next_event = self.task, self.resource, self.next_event
+        enabled_at, started_at, completed_at, idle_time = \
+            self.enabled_at, self.started_at, self.completed_at, self.idle_time
+        self._init_columns()
+        self.released = 0
+        for trace_info in live_traces:
+            e_index = trace_info.first_event
+            trace_info.first_event = trace_info.last_event = -1
+            while e_index >= 0:
+                self.add_event(trace_info, self.task_ids[task[e_index]], self.resource_ids[resource[e_index]],
+                               enabled_at[e_index], started_at[e_index], completed_at[e_index], idle_time[e_index])
+                e_index = next_event[e_index]
+
+    def to_numpy(self, column):
+        # Zero-copy view of a column, e.g., for vectorized computations over all the events
+        return numpy.frombuffer(getattr(self, column), dtype={'q': numpy.int64, 'i': numpy.int32,
+                                                              'd': numpy.float64}[getattr(self, column).typecode])
+
+
+class ArrivalEvent:
+    def __init__(self, p_case, enabled_at):
+        self.p_case = p_case
+        self.enabled_at = enabled_at
+
+
 class EnabledEvent:
-    def __init__(self, p_case, p_state, task_id, enabled_at, enabled_datetime):
+    def __init__(self, p_case, p_state, task_id, enabled_at):
         self.p_case = p_case
         self.p_state = p_state
         self.task_id = task_id
-        self.enabled_datetime = enabled_datetime
         self.enabled_at = enabled_at
 
 
+class ReleaseEvent:
+    # A unit of the resource becomes available, i.e., it takes the next task waiting in its work queues (if any)
+    def __init__(self, resource_id, released_at):
+        self.resource_id = resource_id
+        self.released_at = released_at
+
+
 class ProcessInfo:
     def __init__(self):
         self.traces = dict()
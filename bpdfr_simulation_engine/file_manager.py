@@ -1,9 +1,15 @@
+import numpy
+
 
 class FileManager:
-    def __init__(self, chunk_size, file_writter):
+    def __init__(self, chunk_size, file_writter, start_datetime=None, datetime_columns=None):
         self.chunk_size = chunk_size
         self.data_buffer = list()
         self.file_writter = file_writter
+        # The values in datetime_columns are float offsets (in seconds) from start_datetime, which are formatted as
+        # datetimes once per chunk, i.e., no datetime object is created while simulating
+        self.start_datetime = start_datetime
+        self.datetime_columns = datetime_columns if datetime_columns else list()
 
     def add_csv_row(self, csv_row):
         if self.file_writter:
@@ -13,6 +19,30 @@ class FileManager:
 
     def force_write(self):
         if self.file_writter:
+            if self.datetime_columns and self.data_buffer:
+                columns = list(zip(*self.data_buffer))
+                for c_index in self.datetime_columns:
+                    columns[c_index] = format_datetimes(self.start_datetime, columns[c_index])
+                self.data_buffer = zip(*columns)
             self.file_writter.writerows(self.data_buffer)
             self.data_buffer = list()
 
+
+def format_datetimes(start_datetime, offsets):
+    # Same format as str(datetime), e.g., '2022-01-03 08:00:00.250000+00:00', computed on the wall time of
+    # start_datetime with numpy datetime64 (microseconds) plus the UTC offset of start_datetime as suffix
+    start_wall_time = numpy.datetime64(start_datetime.replace(tzinfo=None), 'us')
+    us_offsets = numpy.rint(numpy.asarray(offsets, dtype=numpy.float64) * 1000000).astype('timedelta64[us]')
+    str_datetimes = numpy.datetime_as_string(start_wall_time + us_offsets, unit='us')
+    str_datetimes = numpy.char.replace(numpy.char.replace(str_datetimes, 'T', ' '), '.000000', '')
+    return numpy.char.add(str_datetimes, _utc_offset_suffix(start_datetime)).tolist()
+
+
+def _utc_offset_suffix(date_time):
+    utc_offset = date_time.utcoffset()
+    if utc_offset is None:
+        return ''
+    seconds = int(utc_offset.total_seconds())
+    sign = '-' if seconds < 0 else '+'
+    hours, minutes = divmod(abs(seconds) // 60, 60)
+    return '%s%02d:%02d' % (sign, hours, minutes)
@@ -112,18 +112,19 @@ def check_fix(data_list, delta=5):
     return None
 
 
-def generate_number_from(distribution_name, params):
+def generate_number_from(distribution_name, params, rng=None):
     while True:
-        duration = evaluate_distribution_function(distribution_name, params)
+        duration = evaluate_distribution_function(distribution_name, params, rng)
         if duration >= 0:
             return duration
 
 
-def evaluate_distribution_function(distribution_name, params):
+def evaluate_distribution_function(distribution_name, params, rng=None):
+    # If no generator (rng) is given, the global numpy random state is used
     if distribution_name == "fix":
         return params[0]
     elif distribution_name == 'default':
-        return numpy.random.uniform(params[0], params[1])
+        return (rng if rng is not None else numpy.random).uniform(params[0], params[1])
 
     arg = params[:-4]
     loc = params[-4]
@@ -132,45 +133,98 @@ def evaluate_distribution_function(distribution_name, params):
     d_max = params[-1]
 
     dist = getattr(st, distribution_name)
-    num_param = len(arg)
 
-    f_dist = 0
     while True:
-        if num_param == 0:
-            f_dist = dist.rvs(loc=loc, scale=scale, size=1)[0]
-        elif num_param == 1:
-            f_dist = dist.rvs(arg[0], loc=loc, scale=scale, size=1)[0]
-        elif num_param == 2:
-            f_dist = dist.rvs(arg[0], arg[1], loc=loc, scale=scale, size=1)[0]
-        elif num_param == 3:
-            f_dist = dist.rvs(arg[0], arg[1], arg[2], loc=loc, scale=scale, size=1)[0]
-        elif num_param == 4:
-            f_dist = dist.rvs(arg[0], arg[1], arg[2], arg[3], loc=loc, scale=scale, size=1)[0]
-        elif num_param == 5:
-            f_dist = dist.rvs(arg[0], arg[1], arg[2], arg[3], arg[4], loc=loc, scale=scale, size=1)[0]
-        elif num_param == 6:
-            f_dist = dist.rvs(arg[0], arg[1], arg[2], arg[3], arg[4], arg[5], loc=loc, scale=scale, size=1)[0]
-        elif num_param == 7:
-            f_dist = dist.rvs(arg[0], arg[1], arg[2], arg[3], arg[4], arg[5], arg[6], loc=loc, scale=scale, size=1)[0]
+        f_dist = dist.rvs(*arg, loc=loc, scale=scale, size=1, random_state=rng)[0]
         if d_min <= f_dist <= d_max:
             break
     return f_dist
 
 
+def expected_value_of(distribution_name, params):
+    # Mean of the distribution (without the truncation to [min, max], but clipped to that range)
+    if distribution_name == "fix":
+        return params[0]
+    elif distribution_name == 'default':
+        return (params[0] + params[1]) / 2
+    d_mean = getattr(st, distribution_name).mean(*params[:-4], loc=params[-4], scale=params[-3])
+    return min(max(d_mean, params[-2]), params[-1])
+
+
 class Choice:
     def __init__(self, candidates_list, probability_list):
         self.candidates_list = candidates_list
         self.probability_list = probability_list
 
-    def get_outgoing_flow(self):
-        return random.choice(self.candidates_list, 1, p=self.probability_list)[0]
+    def get_outgoing_flow(self, rng=None):
+        return (rng if rng is not None else random).choice(self.candidates_list, 1, p=self.probability_list)[0]
 
-    def get_multiple_flows(self):
+    def get_multiple_flows(self, rng=None):
+        rng = rng if rng is not None else random
         selected = list()
         for i in range(0, len(self.candidates_list)):
-            if random.choice([True, False], 1, p=[self.probability_list[i], 1 - self.probability_list[i]]):
+            if rng.choice([True, False], 1, p=[self.probability_list[i], 1 - self.probability_list[i]])[0]:
                 selected.append(self.candidates_list[i])
-        return selected if len(selected) > 0 else [self.get_outgoing_flow()]
+        return selected if len(selected) > 0 else [self.get_outgoing_flow(rng)]
+
+
+class UniformBlocks:
+    # Uniform numbers in [0, 1) of a generator (the global random state if None), drawn in blocks, i.e., one numpy call
+    # every block instead of one per routing decision. The blocks double from MIN_BLOCK up to MAX_BLOCK, so short-lived
+    # streams (e.g., the substreams of a case) do not draw far more numbers than they use.
+    MIN_BLOCK = 16
+    MAX_BLOCK = 4096
+
+    def __init__(self, rng=None):
+        self.rng = rng if rng is not None else random
+        self._block = list()
+        self._next = 0
+        self._block_size = self.MIN_BLOCK
+
+    def next(self):
+        if self._next == len(self._block):
+            self._block = self.rng.random(self._block_size).tolist()
+            self._next = 0
+            self._block_size = min(2 * self._block_size, self.MAX_BLOCK)
+        self._next += 1
+        return self._block[self._next - 1]
+
+    def index(self, size):
+        # Uniform integer in [0, size)
+        return int(self.next() * size)
+
+    def shuffle(self, items):
+        # In-place Fisher-Yates shuffle of a list
+        for i in range(len(items) - 1, 0, -1):
+            j = int(self.next() * (i + 1))
+            items[i], items[j] = items[j], items[i]
+
+
+class RandomStreams:
+    # Independent generators for each source of randomness of the simulation (arrivals, durations, branching and
+    # tie-breaking), all derived from a single seed. With case_substreams, the durations, branching decisions and
+    # tie-breaking of each case are drawn from substreams derived from the case index, i.e., two scenarios simulated
+    # with the same seed use common random numbers case by case.
+    CASES_KEY = 4
+
+    def __init__(self, seed=None, case_substreams=False):
+        self.seed_sequence = seed if isinstance(seed, numpy.random.SeedSequence) else numpy.random.SeedSequence(seed)
+        self.case_substreams = case_substreams
+        [arrivals, durations, branching, tie_breaking] = self.seed_sequence.spawn(4)
+        self.arrivals = numpy.random.default_rng(arrivals)
+        self.durations = numpy.random.default_rng(durations)
+        self.branching = numpy.random.default_rng(branching)
+        self.tie_breaking = numpy.random.default_rng(tie_breaking)
+        # The routing of the gateways (and the order of the tasks they enable) draws block-drawn uniforms
+        self.branching_uniforms = UniformBlocks(self.branching)
+        self.tie_breaking_uniforms = UniformBlocks(self.tie_breaking)
+
+    def for_case(self, p_case):
+        if not self.case_substreams:
+            return self
+        return RandomStreams(numpy.random.SeedSequence(self.seed_sequence.entropy,
+                                                       spawn_key=self.seed_sequence.spawn_key + (self.CASES_KEY,
+                                                                                                 p_case)))
 
 
 def random_uniform(start, end):
@@ -0,0 +1,98 @@
+from bpdfr_simulation_engine.probability_distributions import expected_value_of
+
+
+class AllocationPolicy:
+    # Among the idle resources that can perform an enabled task (i.e., available when the task is enabled), the
+    # resource with the lowest priority is allocated. If no resource is idle, the earliest available one is allocated.
+    # The priority of a resource is only requested when it becomes idle, so it must not change while the resource is
+    # idle, i.e., policies depending on the history of a resource update it when the resource is released. If the
+    # priority does not depend on the task (task_independent), the idle resources are indexed by class of resources
+    # instead of by task, and task_id may be None.
+    task_independent = False
+
+    def priority(self, task_id, resource_id):
+        raise NotImplementedError
+
+    def resource_released(self, resource_id, allocated_at, released_at):
+        pass
+
+
+class FastestPolicy(AllocationPolicy):
+    # Resource with the lowest expected duration of the task, from the task-resource distributions
+    def __init__(self, sim_setup):
+        self.expected_durations = expected_task_durations(sim_setup)
+
+    def priority(self, task_id, resource_id):
+        return self.expected_durations[(task_id, resource_id)]
+
+
+class CheapestPolicy(AllocationPolicy):
+    # Resource with the lowest cost per hour
+    task_independent = True
+
+    def __init__(self, sim_setup):
+        self.resources_map = sim_setup.resources_map
+
+    def priority(self, task_id, resource_id):
+        return self.resources_map[resource_id].cost_per_hour
+
+
+class LeastUtilizedPolicy(AllocationPolicy):
+    # Resource with the lowest busy time so far (from its allocation to its release, by all its units)
+    task_independent = True
+
+    def __init__(self, sim_setup):
+        self.busy_time = dict()
+
+    def priority(self, task_id, resource_id):
+        return self.busy_time.get(resource_id, 0)
+
+    def resource_released(self, resource_id, allocated_at, released_at):
+        self.busy_time[resource_id] = self.busy_time.get(resource_id, 0) + released_at - allocated_at
+
+
+class RoundRobinPolicy(AllocationPolicy):
+    # Resource allocated least recently, i.e., the idle resources take turns
+    task_independent = True
+
+    def __init__(self, sim_setup):
+        self.last_allocation = dict()
+        self.allocations = 0
+
+    def priority(self, task_id, resource_id):
+        return self.last_allocation.get(resource_id, 0)
+
+    def resource_released(self, resource_id, allocated_at, released_at):
+        self.allocations += 1
+        self.last_allocation[resource_id] = self.allocations
+
+
+def expected_task_durations(sim_setup):
+    # (task id, resource id) -> mean of the duration distribution, computed once per distinct distribution
+    expected_durations = dict()
+    distribution_means = dict()
+    for task_id in sim_setup.task_resource:
+        for r_id in sim_setup.task_resource[task_id]:
+            dist_info = sim_setup.task_resource[task_id][r_id]
+            dist_key = (dist_info["distribution_name"], tuple(dist_info["distribution_params"]))
+            if dist_key not in distribution_means:
+                distribution_means[dist_key] = expected_value_of(dist_info["distribution_name"],
+                                                                 dist_info["distribution_params"])
+            expected_durations[(task_id, r_id)] = distribution_means[dist_key]
+    return expected_durations
+
+
+allocation_policies = {"fastest": FastestPolicy,
+                       "cheapest": CheapestPolicy,
+                       "least_utilized": LeastUtilizedPolicy,
+                       "round_robin": RoundRobinPolicy}
+
+
+def create_allocation_policy(policy_name, sim_setup):
+    # None for the default policy (earliest available resource), which does not need an index of idle resources
+    if policy_name is None or policy_name == "earliest":
+        return None
+    if policy_name not in allocation_policies:
+        raise ValueError("Unknown allocation policy '%s', expected one of: earliest, %s"
+                         % (policy_name, ", ".join(allocation_policies)))
+    return allocation_policies[policy_name](sim_setup)
@@ -1,8 +1,10 @@
+import bisect
 import datetime
 import math
 from datetime import timedelta
 from dateutil import parser
 
+import numpy
 import pytz
 
 str_week_days = {"MONDAY": 0, "TUESDAY": 1, "WEDNESDAY": 2, "THURSDAY": 3, "FRIDAY": 4, "SATURDAY": 5, "SUNDAY": 6}
@@ -24,15 +26,16 @@ class CalendarItem:
 
 
 class Interval:
+    # Bounded either by datetimes or by float offsets (in seconds), e.g., simulation times
     def __init__(self, start, end):
         self.start = start
         self.end = end
-        self.duration = (end - start).total_seconds()
+        self.duration = seconds_between(start, end)
 
     def merge_interval(self, n_interval):
         self.start = min(n_interval.start, self.start)
         self.end = max(n_interval.end, self.end)
-        self.duration = (self.end - self.start).total_seconds()
+        self.duration = seconds_between(self.start, self.end)
 
     def is_before(self, c_date):
         return self.end <= c_date
@@ -56,48 +59,109 @@ class Interval:
 
 
 class CalendarIterator:
-    def __init__(self, start_date: datetime, calendar_info):
-        self.start_date = start_date
-
-        self.calendar = calendar_info
-
-        self.c_day = start_date.date().weekday()
-
-        c_date = datetime.datetime.combine(calendar_info.default_date, start_date.time())
-        c_interval = calendar_info.work_intervals[self.c_day][0]
-        self.c_index = -1
-        while c_interval.end < c_date and self.c_index < len(calendar_info.work_intervals[self.c_day]) - 1:
-            self.c_index += 1
-            c_interval = calendar_info.work_intervals[self.c_day][self.c_index]
-
-        self.c_interval = Interval(self.start_date,
-                                   self.start_date + timedelta(seconds=(c_interval.end - c_date).total_seconds()))
+    # Iterates the working intervals from start_at (seconds from a reference moment), where week_second is the
+    # second-of-week of start_at. The intervals are returned as float offsets from the same reference moment.
+    def __init__(self, start_at, week_second, calendar_info):
+        self.start_at = start_at
+        self.week_intervals = calendar_info.get_week_intervals()
+        # First interval ending after week_second, and the offset of the beginning of its week
+        self.c_index = bisect.bisect_right(self.week_intervals.ends, week_second)
+        self.week_at = start_at - week_second
+        if self.c_index == len(self.week_intervals.ends):
+            self.c_index = 0
+            self.week_at += 604800
 
     def next_working_interval(self):
-        res_interval = self.c_interval
-        day_intervals = self.calendar.work_intervals[self.c_day]
-        p_duration = 0
-
+        res_interval = Interval(max(self.start_at, self.week_at + self.week_intervals.starts[self.c_index]),
+                                self.week_at + self.week_intervals.ends[self.c_index])
         self.c_index += 1
-        if self.c_index >= len(day_intervals):
-            p_duration += 86400 - (day_intervals[self.c_index - 1].end - self.calendar.new_day).total_seconds()
-            while True:
-                self.c_day = (self.c_day + 1) % 7
-                day_intervals = self.calendar.work_intervals[self.c_day]
-                if len(day_intervals) > 0:
-                    p_duration += (day_intervals[0].start - self.calendar.new_day).total_seconds()
-                    break
-                else:
-                    p_duration += 86400
+        if self.c_index == len(self.week_intervals.ends):
             self.c_index = 0
-        elif self.c_index > 0:
-            p_duration += (day_intervals[self.c_index].start - day_intervals[self.c_index - 1].end).total_seconds()
-        self.c_interval = Interval(res_interval.end + timedelta(seconds=p_duration),
-                                   res_interval.end + timedelta(
-                                       seconds=p_duration + day_intervals[self.c_index].duration))
+            self.week_at += 604800
         return res_interval
 
 
+class WeekIntervals:
+    # Working intervals of a calendar as sorted seconds-of-week (from Monday 00:00), with the working seconds of the
+    # week before each interval (cumulative), i.e., the queries bisect these lists and add the whole weeks in between
+    def __init__(self, r_calendar):
+        self.starts = list()
+        self.ends = list()
+        self.cumulative = [0]
+        for w_day in range(0, 7):
+            for interval in r_calendar.work_intervals[w_day]:
+                self.starts.append(w_day * 86400 + (interval.start - r_calendar.new_day).total_seconds())
+                self.ends.append(w_day * 86400 + (interval.end - r_calendar.new_day).total_seconds())
+                self.cumulative.append(self.cumulative[-1] + self.ends[-1] - self.starts[-1])
+        self.total_work = self.cumulative[-1]
+
+    def worked_until(self, week_second):
+        # Working seconds from the beginning of the week until week_second
+        i = bisect.bisect_right(self.starts, week_second) - 1
+        if i < 0:
+            return 0
+        return self.cumulative[i] + min(week_second, self.ends[i]) - self.starts[i]
+
+    def working_time(self, week_second, duration):
+        weeks, end_second = divmod(week_second + duration, 604800)
+        return weeks * self.total_work + self.worked_until(end_second) - self.worked_until(week_second)
+
+    def idle_time(self, week_second, duration):
+        # Seconds from week_second until duration seconds are worked, i.e., the earliest completion
+        weeks, worked = divmod(self.worked_until(week_second) + duration, self.total_work)
+        if worked == 0:
+            weeks, worked = weeks - 1, self.total_work
+        i = bisect.bisect_left(self.cumulative, worked, 1) - 1
+        return weeks * 604800 + self.starts[i] + worked - self.cumulative[i] - week_second
+
+    def next_available(self, week_second):
+        i = bisect.bisect_right(self.starts, week_second) - 1
+        if i >= 0 and week_second < self.ends[i]:
+            return 0
+        if i + 1 < len(self.starts):
+            return self.starts[i + 1] - week_second
+        if self.starts:
+            return 604800 - week_second + self.starts[0]
+        # Without working intervals, the next 7 days are skipped (as the former scan day by day)
+        return 691200 - week_second % 86400
+
+    # Batch versions of the queries above, on numpy arrays of seconds-of-week and durations (e.g., all the events of a
+    # resource while fitting its durations), returning an array with the result of each position
+
+    def worked_until_all(self, week_seconds):
+        if not self.starts:
+            return numpy.zeros(len(week_seconds))
+        starts, ends, cumulative = numpy.array(self.starts), numpy.array(self.ends), numpy.array(self.cumulative)
+        i = numpy.searchsorted(starts, week_seconds, side='right') - 1
+        i_valid = numpy.maximum(i, 0)
+        worked = cumulative[i_valid] + numpy.minimum(week_seconds, ends[i_valid]) - starts[i_valid]
+        return numpy.where(i >= 0, worked, 0)
+
+    def working_times(self, week_seconds, durations):
+        weeks, end_seconds = numpy.divmod(week_seconds + durations, 604800)
+        return weeks * self.total_work + self.worked_until_all(end_seconds) - self.worked_until_all(week_seconds)
+
+    def idle_times(self, week_seconds, durations):
+        if not self.starts:
+            # Without working intervals, no duration other than 0 is ever completed
+            return numpy.where(durations == 0, 0, math.inf)
+        weeks, worked = numpy.divmod(self.worked_until_all(week_seconds) + durations, self.total_work)
+        weeks = numpy.where(worked == 0, weeks - 1, weeks)
+        worked = numpy.where(worked == 0, self.total_work, worked)
+        cumulative = numpy.array(self.cumulative)
+        i = numpy.searchsorted(cumulative[1:], worked, side='left')
+        idle = weeks * 604800 + numpy.array(self.starts)[i] + worked - cumulative[i] - week_seconds
+        return numpy.where(durations == 0, 0, idle)
+
+    def next_available_all(self, week_seconds):
+        if not self.starts:
+            return 691200 - week_seconds % 86400
+        starts, ends = numpy.array(self.starts + [self.starts[0] + 604800]), numpy.array(self.ends)
+        i = numpy.searchsorted(starts[:-1], week_seconds, side='right') - 1
+        is_working = (i >= 0) & (week_seconds < ends[numpy.maximum(i, 0)])
+        return numpy.where(is_working, 0, starts[i + 1] - week_seconds)
+
+
 class IntervalPoint:
     def __init__(self, date_time, week_day, index, to_start_dist, to_end_dist):
         self.date_time = date_time
@@ -120,6 +184,7 @@ class RCalendar:
         self.work_rest_count = dict()
         self.total_weekly_work = 0
         self.total_weekly_rest = to_seconds(1, 'WEEKS')
+        self.week_intervals = None  # WeekIntervals, built on the first query after the last change of the intervals
         for i in range(0, 7):
             self.work_intervals[i] = list()
             self.cumulative_work_durations[i] = list()
@@ -177,7 +242,7 @@ class RCalendar:
                 d_s = str_week_days[from_day]
                 d_e = str_week_days[to_day]
                 while True:
-                    self._add_interval(d_s % 7, t_interval)
+                    self._add_interval(d_s % 7, Interval(t_interval.start, t_interval.end))
                     if d_s % 7 == d_e:
                         break
                     d_s += 1
@@ -190,8 +255,15 @@ class RCalendar:
             for interval in self.work_intervals[w_day]:
                 cumulative += interval.duration
                 self.cumulative_work_durations[w_day].append(cumulative)
+        self.week_intervals = WeekIntervals(self)
+
+    def get_week_intervals(self):
+        if self.week_intervals is None:
+            self.week_intervals = WeekIntervals(self)
+        return self.week_intervals
 
     def _add_interval(self, w_day, interval):
+        self.week_intervals = None
         i = 0
         for to_merge in self.work_intervals[w_day]:
             if to_merge.end < interval.start:
@@ -227,139 +299,72 @@ class RCalendar:
         self.total_weekly_work += duration
         self.total_weekly_rest -= duration
 
+    # The methods ending with '_at' receive the second-of-week (see week_second_from) instead of a datetime, i.e.,
+    # the simulation engine works with float offsets and never builds datetime objects to query the calendars
+
     def remove_idle_times(self, from_date, to_date, out_intervals: list):
-        calendar_it = CalendarIterator(from_date, self)
+        working_intervals = list()
+        self.remove_idle_times_at(0, (to_date - from_date).total_seconds(), week_second_from(from_date),
+                                  working_intervals)
+        for w_interval in working_intervals:
+            out_intervals.append(Interval(from_date + timedelta(seconds=w_interval.start),
+                                          from_date + timedelta(seconds=w_interval.end)))
+
+    def remove_idle_times_at(self, from_at, to_at, week_second, out_intervals: list):
+        if self.get_week_intervals().total_work == 0:
+            return
+        calendar_it = CalendarIterator(from_at, week_second, self)
         while True:
             c_interval = calendar_it.next_working_interval()
-            if c_interval.end < to_date:
+            if c_interval.end < to_at:
                 out_intervals.append(c_interval)
             else:
-                if c_interval.start <= to_date <= c_interval.end:
-                    out_intervals.append(Interval(c_interval.start, to_date))
+                if c_interval.start <= to_at <= c_interval.end:
+                    out_intervals.append(Interval(c_interval.start, to_at))
                 break
 
     def find_idle_time(self, requested_date, duration):
+        return self.find_idle_time_at(week_second_from(requested_date), duration)
+
+    def find_idle_time_at(self, week_second, duration):
         if duration == 0:
             return 0
-        real_duration = 0
-        pending_duration = duration
-        if duration > self.total_weekly_work:
-            real_duration += to_seconds(int(duration / self.total_weekly_work), 'WEEKS')
-            pending_duration %= self.total_weekly_work
-        # Addressing the first day as an special case
-        c_day = requested_date.date().weekday()
-        c_date = datetime.datetime.combine(self.default_date, requested_date.time())
-
-        worked_time, total_time = self._find_time_starting(pending_duration, c_day, c_date)
-        if worked_time > total_time and worked_time - total_time < 0.001:
-            total_time = worked_time
-        pending_duration -= worked_time
-        real_duration += total_time
-        c_date = self.new_day
-        while pending_duration > 0:
-            c_day += 1
-            r_d = c_day % 7
-            if pending_duration > self.work_rest_count[r_d][0]:
-                pending_duration -= self.work_rest_count[r_d][0]
-                real_duration += 86400
-            else:
-                real_duration += self._find_time_completion(pending_duration, self.work_rest_count[r_d][0], r_d, c_date)
-                break
-        return real_duration
+        return self.get_week_intervals().idle_time(week_second, duration)
 
     def next_available_time(self, requested_date):
-        c_day = requested_date.date().weekday()
-        c_date = datetime.datetime.combine(self.default_date, requested_date.time())
+        return self.next_available_time_at(week_second_from(requested_date))
 
-        for interval in self.work_intervals[c_day]:
-            if interval.end == c_day:
-                continue
-            if interval.is_after(c_date):
-                return (interval.start - c_date).total_seconds()
-            if interval.contains(c_date):
-                return 0
-        duration = 86400 - (c_date - self.new_day).total_seconds()
-        for i in range(c_day + 1, c_day + 8):
-            r_day = i % 7
-            if self.work_rest_count[r_day][0] > 0:
-                return duration + (self.work_intervals[r_day][0].start - self.new_day).total_seconds()
-            duration += 86400
-        return duration
+    def next_available_time_at(self, week_second):
+        return self.get_week_intervals().next_available(week_second)
 
     def find_working_time(self, start_date, end_date):
-        # print("%s -- %s" % (str(start_date), str(end_date)))
-        pending_duration = (end_date - start_date).total_seconds()
-        worked_hours = 0
+        return self.find_working_time_at(week_second_from(start_date), (end_date - start_date).total_seconds())
 
-        c_day = start_date.date().weekday()
-        c_date = datetime.datetime.combine(self.default_date, start_date.time())
+    def find_working_time_at(self, week_second, duration):
+        return self.get_week_intervals().working_time(week_second, duration)
 
-        to_complete_day = 86400 - (c_date - self.new_day).total_seconds()
-        available_work = self._calculate_available_duration(c_day, c_date)
+    # Batch versions, receiving sequences of datetimes (or arrays of seconds-of-week and durations for the '_at' ones)
+    # and returning numpy arrays
 
-        previous_date = c_date
-        while pending_duration > to_complete_day:
-            pending_duration -= to_complete_day
-            worked_hours += available_work
-            c_day = (c_day + 1) % 7
-            available_work = self.work_rest_count[c_day][0]
-            to_complete_day = 86400
-            previous_date = self.new_day
+    def find_idle_times(self, requested_dates, durations):
+        return self.find_idle_times_at(week_seconds_from(requested_dates), durations)
 
-        for interval in self.work_intervals[c_day]:
-            if interval.is_before(previous_date):
-                continue
-            interval_duration = interval.duration
-            if interval.contains(previous_date):
-                interval_duration -= (previous_date - interval.start).total_seconds()
-            else:
-                pending_duration -= (interval.start - previous_date).total_seconds()
-            if pending_duration >= interval_duration:
-                worked_hours += interval_duration
-            elif pending_duration > 0:
-                worked_hours += pending_duration
-            pending_duration -= interval_duration
-            if pending_duration <= 0:
-                break
-            previous_date = interval.end
-        # print("Worked-hours: %s" % worked_hours)
-        # print('-----------------------------------------------------')
-        return worked_hours
-
-    def _find_time_starting(self, pending_duration, c_day, from_date):
-        available_duration = self._calculate_available_duration(c_day, from_date)
-        if available_duration <= pending_duration:
-            return available_duration, 86400 - (from_date - self.new_day).total_seconds()
-        else:
-            return pending_duration, self._find_time_completion(pending_duration, available_duration, c_day, from_date)
+    def find_idle_times_at(self, week_seconds, durations):
+        return self.get_week_intervals().idle_times(numpy.asarray(week_seconds, dtype=float),
+                                                    numpy.asarray(durations, dtype=float))
 
-    def _calculate_available_duration(self, c_day, from_date):
-        i = -1
-        passed_duration = 0
-        for t_interval in self.work_intervals[c_day]:
-            i += 1
-            if t_interval.is_before(from_date):
-                passed_duration += t_interval.duration
-                continue
-            if t_interval.is_after(from_date):
-                break
-            if t_interval.contains(from_date):
-                passed_duration += (from_date - self.work_intervals[c_day][i].start).total_seconds()
-                break
+    def next_available_times(self, requested_dates):
+        return self.next_available_times_at(week_seconds_from(requested_dates))
 
-        return self.work_rest_count[c_day][0] - passed_duration
-
-    def _find_time_completion(self, pending_duration, total_duration, c_day, from_datetime):
-        i = len(self.work_intervals[c_day]) - 1
-        while total_duration > pending_duration:
-            total_duration -= self.work_intervals[c_day][i].duration
-            i -= 1
-        if total_duration < pending_duration:
-            to_datetime = self.work_intervals[c_day][i + 1].start + timedelta(
-                seconds=(pending_duration - total_duration))
-            return (to_datetime - from_datetime).total_seconds()
-        else:
-            return (self.work_intervals[c_day][i].end - from_datetime).total_seconds()
+    def next_available_times_at(self, week_seconds):
+        return self.get_week_intervals().next_available_all(numpy.asarray(week_seconds, dtype=float))
+
+    def find_working_times(self, start_dates, end_dates):
+        return self.find_working_times_at(week_seconds_from(start_dates), seconds_between_all(start_dates, end_dates))
+
+    def find_working_times_at(self, week_seconds, durations):
+        return self.get_week_intervals().working_times(numpy.asarray(week_seconds, dtype=float),
+                                                       numpy.asarray(durations, dtype=float))
 
 
 def parse_datetime(time, has_date):
@@ -387,6 +392,29 @@ def seconds_from_day_beginning(from_date):
     return from_date.hour * 3600 + from_date.minute * 60 + from_date.second
 
 
+def week_second_from(from_date):
+    # Seconds from the beginning of the week (Monday 00:00) in the timezone of from_date, including the microseconds
+    return from_date.weekday() * 86400 + seconds_from_day_beginning(from_date) + from_date.microsecond / 1000000
+
+
+def week_seconds_from(dates):
+    # Array of week_second_from of each date, where a numpy datetime64 array is taken as wall-clock times
+    if isinstance(dates, numpy.ndarray) and dates.dtype.kind == 'M':
+        return ((dates - numpy.datetime64('1970-01-05', 'us')) / numpy.timedelta64(1, 's')) % 604800
+    return numpy.array([c_date.weekday() * 86400 + c_date.hour * 3600 + c_date.minute * 60 + c_date.second
+                        + c_date.microsecond / 1000000 for c_date in dates], dtype=float)
+
+
+def seconds_between(start, end):
+    return (end - start).total_seconds() if isinstance(start, datetime.datetime) else end - start
+
+
+def seconds_between_all(start_dates, end_dates):
+    if isinstance(start_dates, numpy.ndarray) and start_dates.dtype.kind == 'M':
+        return (numpy.asarray(end_dates) - start_dates) / numpy.timedelta64(1, 's')
+    return numpy.array([(end - start).total_seconds() for start, end in zip(start_dates, end_dates)], dtype=float)
+
+
 def convert_time_unit_from_to(value, from_unit, to_unit):
     u_from = from_unit.upper()
     u_to = to_unit.upper()
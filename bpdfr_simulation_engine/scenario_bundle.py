@@ -0,0 +1,132 @@
+import hashlib
+import ntpath
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+import scipy.stats as st
+
+from bpdfr_simulation_engine.control_flow_manager import BPMN
+from bpdfr_simulation_engine.simulation_properties_parser import parse_json_sim_parameters, parse_simulation_model
+from bpdfr_simulation_engine.simulation_setup import SimDiffSetup
+
+# Changes whenever the classes of the simulation setup change, so the bundles of older versions are compiled again
+BUNDLE_FORMAT = "prosimos-bundle-5"
+BUNDLE_SUFFIX = ".bundle"
+
+
+def scenario_hash(bpmn_path, json_path):
+    # Content hash of the scenario, i.e., the same BPMN and JSON files (wherever they are) share the compiled bundle
+    s_hash = hashlib.sha256(BUNDLE_FORMAT.encode())
+    for f_path in [bpmn_path, json_path]:
+        with open(f_path, 'rb') as s_file:
+            s_hash.update(hashlib.sha256(s_file.read()).digest())
+    return s_hash.hexdigest()
+
+
+def scenario_errors(bpmn_graph, resources_map, calendars_map, element_probability, task_resource):
+    # Inconsistencies between the BPMN model and the JSON parameters that would fail (or be ignored) while simulating
+    errors = list()
+    if bpmn_graph.starting_event is None:
+        errors.append("The process model has no start event")
+    if bpmn_graph.end_event is None:
+        errors.append("The process model has no end event")
+    for e_id in bpmn_graph.element_info:
+        e_info = bpmn_graph.element_info[e_id]
+        if e_info.type == BPMN.TASK and not task_resource.get(e_id):
+            errors.append("No resource assigned to task %s" % e_info.name)
+        if e_info.type in [BPMN.EXCLUSIVE_GATEWAY, BPMN.INCLUSIVE_GATEWAY] and e_info.is_split() \
+                and e_id in element_probability:
+            for f_id in element_probability[e_id].candidates_list:
+                if f_id not in e_info.outgoing_flows:
+                    errors.append("Flow %s is not an outgoing flow of gateway %s" % (f_id, e_info.name))
+    for task_id in task_resource:
+        if task_id not in bpmn_graph.element_info:
+            errors.append("Task %s of the task-resource distributions is not in the process model" % task_id)
+        for r_id in task_resource[task_id]:
+            if r_id not in resources_map:
+                errors.append("Resource %s of task %s is not in the resource profiles" % (r_id, task_id))
+            errors.extend(_distribution_errors(task_resource[task_id][r_id], "task %s" % task_id))
+    for r_id in resources_map:
+        if resources_map[r_id].calendar_id not in calendars_map:
+            errors.append("Calendar %s of resource %s is not in the resource calendars"
+                          % (resources_map[r_id].calendar_id, r_id))
+    errors.extend(_distribution_errors(element_probability['arrivalTime'], "the arrival time"))
+    return errors
+
+
+def _distribution_errors(dist_info, dist_owner):
+    d_name = dist_info["distribution_name"]
+    if d_name in ["fix", "default"]:
+        return []
+    if not hasattr(st, d_name):
+        return ["Unknown distribution %s of %s" % (d_name, dist_owner)]
+    if len(dist_info["distribution_params"]) < 4:
+        return ["Distribution %s of %s expects loc, scale, min and max" % (d_name, dist_owner)]
+    return []
+
+
+def compile_scenario(bpmn_path, json_path, bundle_path):
+    # Parses and validates the BPMN and JSON files, then saves the simulation setup (BPMN graph and its compiled copy,
+    # calendars with their cumulative durations, resources and distributions) in a single binary bundle
+    try:
+        sim_setup = SimDiffSetup(bpmn_path, json_path)
+        errors = scenario_errors(sim_setup.bpmn_graph, sim_setup.resources_map, sim_setup.calendars_map,
+                                 sim_setup.element_probability, sim_setup.task_resource)
+    except KeyError:
+        # The setup could not be built (e.g., a resource is missing), then the errors are found in the parsed files
+        resources_map, calendars_map, element_probability, task_resource, _ = parse_json_sim_parameters(json_path)
+        errors = scenario_errors(parse_simulation_model(bpmn_path), resources_map, calendars_map,
+                                 element_probability, task_resource)
+        if not errors:
+            raise
+    if errors:
+        raise ValueError("Invalid simulation scenario:\n  %s" % "\n  ".join(errors))
+    save_bundle(sim_setup, scenario_hash(bpmn_path, json_path), bundle_path)
+    return sim_setup
+
+
+def save_bundle(sim_setup: SimDiffSetup, s_hash, bundle_path):
+    # Written to a temporary file and then renamed, i.e., processes sharing a cache never read a partial bundle
+    bundle_dir = os.path.dirname(os.path.abspath(bundle_path))
+    os.makedirs(bundle_dir, exist_ok=True)
+    file_descriptor, tmp_path = tempfile.mkstemp(dir=bundle_dir, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, 'wb') as bundle_file:
+            pickle.dump((BUNDLE_FORMAT, s_hash), bundle_file, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(sim_setup, bundle_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, bundle_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_bundle(bundle_path, s_hash=None):
+    # Simulation setup of the bundle, None if it has another format or (given s_hash) was compiled from other files.
+    # Also None if it cannot be read, e.g., truncated by a killed process or pickled from classes that changed without
+    # a new BUNDLE_FORMAT, then it is compiled again
+    try:
+        with open(bundle_path, 'rb') as bundle_file:
+            b_format, b_hash = pickle.load(bundle_file)
+            if b_format != BUNDLE_FORMAT or (s_hash is not None and b_hash != s_hash):
+                return None
+            return pickle.load(bundle_file)
+    except (EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError, TypeError):
+        return None
+
+
+def load_scenario(bpmn_path, json_path, cache_dir=None):
+    # Simulation setup of the scenario from the bundle with its content hash in cache_dir, compiling it if missing.
+    # Without cache_dir, the files are parsed (and not validated) as before
+    if cache_dir is None:
+        return SimDiffSetup(bpmn_path, json_path)
+    s_hash = scenario_hash(bpmn_path, json_path)
+    bundle_path = Path(cache_dir, "%s%s" % (s_hash, BUNDLE_SUFFIX))
+    sim_setup = load_bundle(bundle_path, s_hash) if bundle_path.exists() else None
+    if sim_setup is None:
+        return compile_scenario(bpmn_path, json_path, bundle_path)
+    # The bundle may have been compiled from a copy of the files with another name
+    sim_setup.process_name = ntpath.basename(bpmn_path).split(".")[0]
+    return sim_setup
@@ -1,5 +1,7 @@
 import csv
+import math
 import os
+import time
 from pathlib import Path
 
 import pytz
@@ -7,10 +9,14 @@ import datetime
 from datetime import timedelta
 
 from bpdfr_simulation_engine.file_manager import FileManager
-from bpdfr_simulation_engine.execution_info import Trace, TaskEvent, EnabledEvent
-from bpdfr_simulation_engine.simulation_queues_ds import PriorityQueue, DiffResourceQueue, EventQueue
+from bpdfr_simulation_engine.execution_info import Trace, EnabledEvent, ArrivalEvent, ReleaseEvent
+from bpdfr_simulation_engine.resource_allocation import create_allocation_policy, expected_task_durations
+from bpdfr_simulation_engine.scenario_bundle import load_scenario
+from bpdfr_simulation_engine.simulation_queues_ds import PriorityQueue, DiffResourceQueue, EventQueue, \
+    PolicyResourceQueue, WorkQueues
+from bpdfr_simulation_engine.simulation_profiler import PhaseProfiler
 from bpdfr_simulation_engine.simulation_setup import SimDiffSetup
-from bpdfr_simulation_engine.simulation_stats_calculator import LogInfo
+from bpdfr_simulation_engine.simulation_stats_calculator import LogInfo, BatchMeansDetector
 
 
 class SimResource:
@@ -22,68 +28,203 @@ class SimResource:
         self.last_released = 0
 
 
+class StoppingCriteria:
+    # Besides total_cases, once any criterion is met no more cases arrive, and the simulation ends after completing the
+    # cases in progress:
+    #  - ending_at: datetime after which no case arrives
+    #  - steady_state_precision: relative half-width of the batch-means confidence interval of steady_state_kpis
+    # The cases arriving (and the events enabled) during the first 'warmup' seconds are excluded from the KPIs.
+    def __init__(self, ending_at=None, warmup=0, steady_state_precision=None, steady_state_kpis=None, batch_size=50,
+                 min_batches=10, confidence=0.95):
+        self.ending_at = ending_at
+        self.warmup = warmup
+        self.steady_state_precision = steady_state_precision
+        self.steady_state_kpis = steady_state_kpis if steady_state_kpis else ["cycle_time"]
+        self.batch_size = batch_size
+        self.min_batches = min_batches
+        self.confidence = confidence
+
+    def is_bounded(self):
+        return self.ending_at is not None or self.steady_state_precision is not None
+
+    def steady_state_detector(self):
+        if self.steady_state_precision is None:
+            return None
+        return BatchMeansDetector(self.steady_state_kpis, self.steady_state_precision, self.batch_size,
+                                  self.min_batches, self.confidence)
+
+
 class SimBPMEnv:
-    def __init__(self, sim_setup: SimDiffSetup, stat_fwriter, log_fwriter):
+    def __init__(self, sim_setup: SimDiffSetup, stat_fwriter, log_fwriter, stream_stats=False,
+                 stop_criteria: StoppingCriteria = None, allocation_policy=None, queue_discipline=None):
         self.sim_setup = sim_setup
         self.sim_resources = dict()
         self.stat_fwriter = stat_fwriter
-        self.log_writer = FileManager(10000, log_fwriter)
-        self.log_info = LogInfo(sim_setup)
+        # Columns 2-4 of the event-log (enabled, start and end times) are float offsets formatted as datetimes in chunks
+        self.log_writer = FileManager(10000, log_fwriter, sim_setup.start_datetime, [2, 3, 4])
+        self.stop_criteria = stop_criteria if stop_criteria is not None else StoppingCriteria()
+        self.log_info = LogInfo(sim_setup, stream_stats, self.stop_criteria.warmup,
+                                self.stop_criteria.steady_state_detector())
         self.executed_events = 0
-        self.time_update_process_state = 0
+        self.total_cases = 0
+        self.ending_at = math.inf  # Simulation time (in seconds) after which no more cases arrive
+        if self.stop_criteria.ending_at is not None:
+            self.ending_at = (self.stop_criteria.ending_at - sim_setup.start_datetime).total_seconds()
+        self.pending_events = dict()  # p_case -> number of enabled events not executed yet (only cases in progress)
+        self.case_streams = dict()  # p_case -> random streams of the case (only cases in progress)
+        self.profiler = None  # PhaseProfiler measuring the phases of the simulation loop, None if not profiling
 
         r_first_available = dict()
+        r_amounts = dict()
         for r_id in sim_setup.resources_map:
             self.sim_resources[r_id] = SimResource()
-            r_first_available[r_id] = self.sim_setup.next_resting_time(r_id, self.sim_setup.start_datetime)
+            r_first_available[r_id] = self.sim_setup.next_resting_time(r_id, 0)
+            r_amounts[r_id] = sim_setup.resources_map[r_id].resource_amount
 
-        self.resource_queue = DiffResourceQueue(self.sim_setup.task_resource, r_first_available)
+        # A resource with an amount > 1 is a counted capacity of identical units, i.e., it performs that many tasks at
+        # the same time sharing its id, calendar, durations and statistics
+        # The allocation_policy (by name) chooses among the idle resources, by default the earliest available is allocated
+        policy = create_allocation_policy(allocation_policy, sim_setup)
+        if policy is None:
+            self.resource_queue = DiffResourceQueue(self.sim_setup.task_resource, r_first_available, r_amounts)
+        else:
+            self.resource_queue = PolicyResourceQueue(self.sim_setup.task_resource, r_first_available, r_amounts,
+                                                      policy)
         self.events_queue = EventQueue()
 
-    def generate_all_arrival_events(self, total_cases):
+        # With a queue_discipline, a task enabled while no resource can perform it waits in a work queue, and each
+        # resource takes the next task (by discipline) when released. Otherwise, the task claims the earliest resource
+        self.work_queues = None
+        if queue_discipline is not None:
+            self.work_queues = WorkQueues(self.sim_setup.task_resource, queue_discipline,
+                                          expected_task_durations(sim_setup) if queue_discipline == "sept" else None)
+            for r_id in self.work_queues.resource_queues:
+                self.events_queue.append_release_event(ReleaseEvent(r_id, r_first_available[r_id]))
+
+    def start_arrival_process(self, total_cases):
+        self.total_cases = total_cases if total_cases is not None else math.inf
+        if self.total_cases > 0 and self.ending_at >= 0:
+            self.schedule_arrival_event(0, 0)
+
+    def schedule_arrival_event(self, p_case, arrival_time):
+        self.events_queue.append_arrival_event(ArrivalEvent(p_case, arrival_time))
+
+    def execute_arrival_event(self, a_event: ArrivalEvent):
         sim_setup = self.sim_setup
-        arrival_time = 0
-        for p_case in range(0, total_cases):
-            p_state = sim_setup.initial_state()
-            enabled_tasks = sim_setup.update_process_state(sim_setup.bpmn_graph.starting_event, p_state)
-            enabled_datetime = self.simulation_datetime_from(arrival_time)
-            self.log_info.trace_list.append(Trace(p_case, enabled_datetime))
-            for task_id in enabled_tasks:
-                self.events_queue.append_arrival_event(EnabledEvent(p_case, p_state, task_id, arrival_time,
-                                                                    enabled_datetime))
-            arrival_time += sim_setup.next_arrival_time(enabled_datetime)
+        p_state = sim_setup.initial_state()
+        self.case_streams[a_event.p_case] = sim_setup.random_streams.for_case(a_event.p_case)
+        enabled_tasks = sim_setup.update_process_state(sim_setup.bpmn_graph.starting_event, p_state,
+                                                       self.case_streams[a_event.p_case])
+        self.log_info.add_trace(Trace(a_event.p_case, a_event.enabled_at))
+        if self.profiler:
+            self.profiler.count("arrived_cases")
+        self.pending_events[a_event.p_case] = 0
+        self.update_pending_events(a_event.p_case, len(enabled_tasks))
+        for task_id in enabled_tasks:
+            self.events_queue.append_enabled_event(EnabledEvent(a_event.p_case, p_state, task_id, a_event.enabled_at))
+        # Only the next arrival is scheduled, i.e., the cases are created on demand as the simulation clock advances
+        if a_event.p_case + 1 < self.total_cases and not self.log_info.steady_state_reached():
+            next_arrival = a_event.enabled_at + sim_setup.next_arrival_time(a_event.enabled_at)
+            if next_arrival <= self.ending_at:
+                self.schedule_arrival_event(a_event.p_case + 1, next_arrival)
 
     def execute_enabled_event(self, c_event: EnabledEvent):
+        profiler = self.profiler
+        if profiler:
+            prof_at = time.perf_counter()
+        resource_id, r_available_at = self.resource_queue.pop_resource_for(c_event.task_id, c_event.enabled_at)
+        # If no resource is idle, the task waits until one of its resources is released
+        queued = self.work_queues is not None and r_available_at > c_event.enabled_at
+        if queued:
+            self.work_queues.push(c_event, c_event.enabled_at)
+        if profiler:
+            profiler.add_phase_time("resource_pop", prof_at)
+        if not queued:
+            self.start_task(c_event, resource_id, max(r_available_at, c_event.enabled_at))
+
+    def execute_release_event(self, r_event: ReleaseEvent):
+        # The idle units of the resource take the next tasks of its work queues. The event is outdated if the unit
+        # released was allocated before (e.g., to a task enabled at the same time)
+        profiler = self.profiler
+        resource_id, released_at = r_event.resource_id, r_event.released_at
+        while self.resource_queue.available_at(resource_id) <= released_at:
+            if profiler:
+                prof_at = time.perf_counter()
+            c_event = self.work_queues.pop_for(resource_id, released_at)
+            if c_event is not None:
+                self.resource_queue.claim_resource(resource_id, released_at)
+            if profiler:
+                profiler.add_phase_time("resource_pop", prof_at)
+            if c_event is None:
+                break
+            self.start_task(c_event, resource_id, released_at)
+
+    def start_task(self, c_event: EnabledEvent, resource_id, started_at):
+        # If profiling, prof_at is the perf_counter at which the current phase started
+        profiler = self.profiler
+        if profiler:
+            prof_at = time.perf_counter()
         self.executed_events += 1
-        resource_id, r_available_at = self.resource_queue.pop_resource_for(c_event.task_id)
-        self.sim_resources[resource_id].allocated_tasks += 1
-        full_evt = TaskEvent(c_event.p_case, c_event.task_id, resource_id, r_available_at,
-                             c_event.enabled_at, c_event.enabled_datetime, self)
-        self.log_info.add_event_info(c_event.p_case, full_evt, self.sim_setup.resources_map[resource_id].cost_per_hour)
 
-        r_next_available = full_evt.completed_at
+        # Ideal duration from the distribution-function if allocate resource doesn't rest, and the actual duration
+        # adding the resource resting-time according to their calendar
+        ideal_duration = self.sim_setup.ideal_task_duration(c_event.task_id, resource_id,
+                                                            self.case_streams[c_event.p_case])
+        if profiler:
+            prof_at = profiler.add_phase_time("duration_sampling", prof_at)
+        real_duration = self.sim_setup.real_task_duration(ideal_duration, resource_id, started_at)
+        completed_at = started_at + real_duration
+
+        r_next_available = completed_at
         if self.sim_resources[resource_id].switching_time > 0:
-            r_next_available += self.sim_setup.next_resting_time(resource_id, full_evt.completed_datetime)
+            r_next_available += self.sim_setup.next_resting_time(resource_id, completed_at)
+        if profiler:
+            prof_at = profiler.add_phase_time("calendar_adjustment", prof_at)
 
         self.resource_queue.upddate_resource_availability(resource_id, r_next_available)
-        self.sim_resources[resource_id].worked_time += full_evt.ideal_duration
+        if self.work_queues is not None:
+            self.events_queue.append_release_event(ReleaseEvent(resource_id, r_next_available))
+        if profiler:
+            prof_at = profiler.add_phase_time("resource_pop", prof_at, 0)
+
+        in_warmup = self.log_info.is_warmup_event(c_event.enabled_at)
+        if not in_warmup:
+            self.sim_resources[resource_id].allocated_tasks += 1
+            self.sim_resources[resource_id].worked_time += ideal_duration
+        self.log_info.add_event_info(c_event.p_case, c_event.task_id, resource_id, c_event.enabled_at, started_at,
+                                     real_duration, ideal_duration)
+        if profiler:
+            prof_at = profiler.add_phase_time("stats_update", prof_at)
 
         self.log_writer.add_csv_row([c_event.p_case,
                                      self.sim_setup.bpmn_graph.element_info[c_event.task_id].name,
-                                     full_evt.enabled_datetime,
-                                     full_evt.started_datetime,
-                                     full_evt.completed_datetime,
-                                     self.sim_setup.resources_map[full_evt.resource_id].resource_name])
+                                     c_event.enabled_at,
+                                     started_at,
+                                     completed_at,
+                                     self.sim_setup.resources_map[resource_id].resource_name])
+        if profiler:
+            prof_at = profiler.add_phase_time("log_writing", prof_at)
 
         # Updating the process state. Retrieving/enqueuing enabled tasks, it also schedules the corresponding event
-        # s_t = datetime.datetime.now()
-        enabled_tasks = self.sim_setup.update_process_state(c_event.task_id, c_event.p_state)
-        # self.time_update_process_state += (datetime.datetime.now() - s_t).total_seconds()
+        enabled_tasks = self.sim_setup.update_process_state(c_event.task_id, c_event.p_state,
+                                                            self.case_streams[c_event.p_case])
+        if profiler:
+            prof_at = profiler.add_phase_time("process_state_update", prof_at)
+        self.update_pending_events(c_event.p_case, len(enabled_tasks) - 1)
+        if profiler:
+            profiler.add_phase_time("stats_update", prof_at, 0)
 
         for next_task in enabled_tasks:
             self.events_queue.append_enabled_event(
-                EnabledEvent(c_event.p_case, c_event.p_state, next_task, full_evt.completed_at,
-                             full_evt.completed_datetime))
+                EnabledEvent(c_event.p_case, c_event.p_state, next_task, completed_at))
+
+    def update_pending_events(self, p_case, delta):
+        # A case is completed once none of its tokens can enable more tasks, i.e., all reached the end event
+        self.pending_events[p_case] += delta
+        if self.pending_events[p_case] == 0:
+            del self.pending_events[p_case]
+            del self.case_streams[p_case]
+            self.log_info.complete_trace(p_case)
 
     def _datetime_from(self, in_seconds):
         return self.simulation_datetime_from(in_seconds) if in_seconds is not None else None
@@ -107,38 +248,55 @@ class SimBPMEnv:
                 break
             else:
                 if prev_event.completed_at < current_end:
-                    duration += resource_calendar.find_working_time(prev_event.completed_at, current_end)
+                    duration += resource_calendar.find_working_time_at(
+                        self.sim_setup.week_second(prev_event.completed_at), current_end - prev_event.completed_at)
                 if event_info.started_at < prev_event.started_at:
                     current_end = prev_event.started_at
                 else:
                     return duration
             i -= 1
-        return duration + resource_calendar.find_working_time(event_info.started_at, current_end)
+        return duration + resource_calendar.find_working_time_at(self.sim_setup.week_second(event_info.started_at),
+                                                                 current_end - event_info.started_at)
 
 
 def execute_full_process(bpm_env: SimBPMEnv, total_cases):
-    # Initialize event queue with the arrival times of all the cases to simulate,
-    # i.e., all the initial events are enqueued and sorted by their arrival times
-    # s_t = datetime.datetime.now()
-    bpm_env.generate_all_arrival_events(total_cases)
-    # print("Generation of all cases: %s" %
-    #       str(datetime.timedelta(seconds=(datetime.datetime.now() - s_t).total_seconds())))
+    # Initialize the event queue with the arrival of the first case. Each arrival event schedules the next one when it
+    # is executed, so the events in the queue depend on the work-in-progress instead of on the total cases to simulate
+    bpm_env.start_arrival_process(total_cases)
     current_event = bpm_env.events_queue.pop_next_event()
     while current_event is not None:
-        bpm_env.execute_enabled_event(current_event)
+        if isinstance(current_event, EnabledEvent):
+            bpm_env.execute_enabled_event(current_event)
+        elif isinstance(current_event, ReleaseEvent):
+            bpm_env.execute_release_event(current_event)
+        else:
+            bpm_env.execute_arrival_event(current_event)
         current_event = bpm_env.events_queue.pop_next_event()
 
 
-def run_simulation(bpmn_path, json_path, total_cases, stat_out_path=None, log_out_path=None, starting_at=None):
-    diffsim_info = SimDiffSetup(bpmn_path, json_path)
+def run_simulation(bpmn_path, json_path, total_cases, stat_out_path=None, log_out_path=None, starting_at=None,
+                   stream_stats=False, seed=None, case_substreams=False, stop_criteria=None, profile=False,
+                   allocation_policy=None, queue_discipline=None, transition_cache=None, bundle_cache=None):
+    if total_cases is None and (stop_criteria is None or not stop_criteria.is_bounded()):
+        raise ValueError("The total cases, the ending datetime or the steady-state precision must be provided")
+    # With bundle_cache, the scenario is loaded from its compiled bundle in that folder (compiled on the first run)
+    diffsim_info = load_scenario(bpmn_path, json_path, bundle_cache)
 
     if not diffsim_info:
         return None
+    if transition_cache:
+        diffsim_info.compiled_graph.memoize_transitions(transition_cache)
 
     diffsim_info.set_starting_satetime(starting_at if starting_at else pytz.utc.localize(datetime.datetime.now()))
+    diffsim_info.set_random_streams(seed, case_substreams)
 
     if not stat_out_path and not log_out_path:
         stat_out_path = os.path.join(os.path.dirname(__file__), Path("%s.csv" % diffsim_info.process_name))
+    # The profile is saved next to the statistics file (or the event-log), e.g., 'stats.csv' -> 'stats_profile.json'
+    profile_path = None
+    if profile:
+        out_path = Path(stat_out_path if stat_out_path else log_out_path)
+        profile_path = str(out_path.with_name("%s_profile.json" % out_path.stem))
     if stat_out_path:
         with open(stat_out_path, mode='w', newline='', encoding='utf-8') as stat_csv_file:
             if log_out_path:
@@ -147,28 +305,42 @@ def run_simulation(bpmn_path, json_path, total_cases, stat_out_path=None, log_ou
                                          csv.writer(stat_csv_file, delimiter=',', quotechar='"',
                                                     quoting=csv.QUOTE_MINIMAL),
                                          csv.writer(log_csv_file, delimiter=',', quotechar='"',
-                                                    quoting=csv.QUOTE_MINIMAL))
+                                                    quoting=csv.QUOTE_MINIMAL), stream_stats,
+                                         stop_criteria, profile_path, allocation_policy, queue_discipline)
             else:
                 run_simpy_simulation(diffsim_info, total_cases,
                                      csv.writer(stat_csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL),
-                                     None)
+                                     None, stream_stats, stop_criteria, profile_path, allocation_policy,
+                                     queue_discipline)
     else:
         with open(log_out_path, mode='w', newline='', encoding='utf-8') as log_csv_file:
             run_simpy_simulation(diffsim_info, total_cases,
                                  None,
-                                 csv.writer(log_csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL))
+                                 csv.writer(log_csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL),
+                                 stream_stats, stop_criteria, profile_path, allocation_policy, queue_discipline)
 
 
-def run_simpy_simulation(diffsim_info, total_cases, stat_fwriter, log_fwriter):
-    bpm_env = SimBPMEnv(diffsim_info, stat_fwriter, log_fwriter)
+def run_simpy_simulation(diffsim_info, total_cases, stat_fwriter, log_fwriter, stream_stats=False,
+                         stop_criteria=None, profile_path=None, allocation_policy=None, queue_discipline=None):
+    bpm_env = SimBPMEnv(diffsim_info, stat_fwriter, log_fwriter, stream_stats, stop_criteria, allocation_policy,
+                        queue_discipline)
+    profiler = bpm_env.profiler = PhaseProfiler() if profile_path else None
     add_simulation_event_log_header(log_fwriter)
     execute_full_process(bpm_env, total_cases)
-    # print("DiffSim state update   : %s" %
-    #       str(datetime.timedelta(seconds=bpm_env.time_update_process_state)))
     if log_fwriter:
+        prof_at = time.perf_counter()
         bpm_env.log_writer.force_write()
+        if profiler:
+            profiler.add_phase_time("log_writing", prof_at)
     if stat_fwriter:
+        prof_at = time.perf_counter()
         bpm_env.log_info.save_joint_statistics(bpm_env)
+        if profiler:
+            profiler.add_phase_time("stats_update", prof_at)
+    if profiler:
+        profiler.stop()
+        profiler.count("executed_events", bpm_env.executed_events)
+        profiler.save(profile_path)
     # print("Total Task Instances: %d" % bpm_env.executed_events)
 
 
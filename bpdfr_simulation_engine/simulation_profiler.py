@@ -0,0 +1,51 @@
+import json
+import time
+
+profiled_phases = ["resource_pop", "duration_sampling", "calendar_adjustment", "process_state_update",
+                   "log_writing", "stats_update"]
+
+
+class PhaseProfiler:
+    # Cumulative time (perf_counter seconds) and number of calls of each phase of the simulation loop. The engine
+    # only measures the phases if it has a profiler (SimBPMEnv.profiler), i.e., disabled profiling costs one check.
+    def __init__(self):
+        self.phase_times = dict()
+        self.phase_calls = dict()
+        for phase in profiled_phases:
+            self.phase_times[phase] = 0.0
+            self.phase_calls[phase] = 0
+        self.counters = dict()
+        self.started_at = time.perf_counter()
+        self.completed_at = None
+
+    def add_phase_time(self, phase, started_at, calls=1):
+        # Adds the time elapsed since started_at (from perf_counter) to the phase, returns the current perf_counter.
+        # A phase measured in several segments of the same call only counts it once (i.e., calls=0 for the others)
+        now = time.perf_counter()
+        self.phase_times[phase] += now - started_at
+        self.phase_calls[phase] += calls
+        return now
+
+    def count(self, counter, increment=1):
+        self.counters[counter] = self.counters.get(counter, 0) + increment
+
+    def stop(self):
+        self.completed_at = time.perf_counter()
+
+    def to_dict(self):
+        total_time = (self.completed_at if self.completed_at else time.perf_counter()) - self.started_at
+        phases = dict()
+        for phase in self.phase_times:
+            phases[phase] = {"total_seconds": self.phase_times[phase],
+                             "calls": self.phase_calls[phase],
+                             "share": self.phase_times[phase] / total_time if total_time > 0 else 0}
+        executed_events = self.counters.get("executed_events", 0)
+        return {"total_seconds": total_time,
+                "unprofiled_seconds": total_time - sum(self.phase_times.values()),
+                "events_per_second": executed_events / total_time if total_time > 0 else 0,
+                "counters": self.counters,
+                "phases": phases}
+
+    def save(self, json_path):
+        with open(json_path, 'w') as json_file:
+            json.dump(self.to_dict(), json_file, indent=4)
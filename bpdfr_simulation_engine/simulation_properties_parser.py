@@ -55,7 +55,7 @@ def parse_resource_profiles(json_data):
             r_id = r_info["id"]
             resources_map[r_id] = ResourceProfile(r_id, r_info["name"], r_info["calendar"],
                                                   float(r_info["cost_per_hour"]))
-            resources_map[r_id].resource_amount = int(r_info["amount"])
+            resources_map[r_id].resource_amount = int(r_info["amount"]) if "amount" in r_info else 1
             resources_map[r_id].pool_info = PoolInfo(pool_entry["id"], pool_entry["name"])
     return resources_map
 
@@ -204,16 +204,16 @@ def parse_qbp_simulation_process(qbp_bpmn_path, out_file):
         pools_json[resource.attrib["id"]] = {"name": resource.attrib["name"], "resource_list": list()}
         resource_pools[resource.attrib["id"]] = list()
         calendar_id = resource.attrib["timetableId"]
-        for i in range(1, int(resource.attrib["totalAmount"]) + 1):
-            nr_id = "%s_%d" % (resource.attrib["id"], i)
-            pools_json[resource.attrib["id"]]["resource_list"].append({
-                "id": nr_id,
-                "name": "%s_%d" % (resource.attrib["name"], i),
-                "cost_per_hour": resource.attrib["costPerHour"],
-                "amount": 1
-            })
-            resource_pools[resource.attrib["id"]].append(nr_id)
-            resource_calendars[nr_id] = calendars_map[calendar_id]
+        # The totalAmount identical units of the pool are a single resource with that amount (i.e., capacity)
+        nr_id = "%s_1" % resource.attrib["id"]
+        pools_json[resource.attrib["id"]]["resource_list"].append({
+            "id": nr_id,
+            "name": resource.attrib["name"],
+            "cost_per_hour": resource.attrib["costPerHour"],
+            "amount": int(resource.attrib["totalAmount"])
+        })
+        resource_pools[resource.attrib["id"]].append(nr_id)
+        resource_calendars[nr_id] = calendars_map[calendar_id]
 
     task_resource_dist = dict()
     for e_inf in simod_elements:
@@ -1,14 +1,18 @@
 import itertools
-from collections import deque
+import math
 from heapq import heappush
 from heapq import heappop
+from heapq import heapreplace
+from heapq import heapify
 
 
 class PriorityQueue:
+    # Indexed binary heap, i.e., each entry [priority, count, element, index] keeps its position in the heap, so updating
+    # the priority of an element moves its entry in place (O(log n)) instead of leaving a removed entry behind. Then, the
+    # heap size is the number of elements. The count breaks ties, i.e., FIFO order of insertion (or last update).
     def __init__(self):
         self.pq = []  # list of entries arranged in a heap
-        self.entry_finder = {}  # mapping of tasks to entries
-        self.REMOVED = '<removed-task>'  # placeholder for a removed task
+        self.entry_finder = {}  # mapping of elements to entries
         self.counter = itertools.count()  # unique sequence count
 
     def is_empty(self):
@@ -26,101 +30,493 @@ class PriorityQueue:
         return None
 
     def insert(self, element, priority=0):
-        """ Add a new task or update the priority of an existing task """
+        """ Add a new element or update the priority of an existing element """
         if element in self.entry_finder:
-            self.remove_element(element)
-        count = next(self.counter)
-        entry = [priority, count, element]
-        self.entry_finder[element] = entry
-        heappush(self.pq, entry)
+            entry = self.entry_finder[element]
+            entry[0], entry[1] = priority, next(self.counter)
+            self._sift_down(self._sift_up(entry[3]))
+        else:
+            entry = [priority, next(self.counter), element, len(self.pq)]
+            self.entry_finder[element] = entry
+            self.pq.append(entry)
+            self._sift_up(entry[3])
 
     def pop_min(self):
-        """ Remove and return the lowest priority task. Raise KeyError if empty. """
-        while self.pq:
-            priority, count, task = heappop(self.pq)
-            if task is not self.REMOVED:
-                del self.entry_finder[task]
-                return task, priority
-        return None, None
+        """ Remove and return the element with the lowest priority, and its priority. (None, None) if empty. """
+        if not self.pq:
+            return None, None
+        entry = self.pq[0]
+        self._remove_at(0)
+        del self.entry_finder[entry[2]]
+        return entry[2], entry[0]
 
     def remove_element(self, element):
-        """ Mark an existing task as REMOVED.  Raise KeyError if not found. """
+        """ Remove an existing element. Raise KeyError if not found. """
         entry = self.entry_finder.pop(element)
-        entry[-1] = self.REMOVED
+        self._remove_at(entry[3])
+
+    def _remove_at(self, index):
+        last_entry = self.pq.pop()
+        if index < len(self.pq):
+            last_entry[3] = index
+            self.pq[index] = last_entry
+            self._sift_down(self._sift_up(index))
+
+    def _sift_up(self, index):
+        # Moves the entry at index towards the root while it is lower than its parent, returns its final index
+        pq = self.pq
+        entry = pq[index]
+        while index > 0:
+            p_index = (index - 1) >> 1
+            parent = pq[p_index]
+            if not entry < parent:
+                break
+            parent[3] = index
+            pq[index] = parent
+            index = p_index
+        entry[3] = index
+        pq[index] = entry
+        return index
+
+    def _sift_down(self, index):
+        pq = self.pq
+        entry = pq[index]
+        size = len(pq)
+        c_index = 2 * index + 1
+        while c_index < size:
+            if c_index + 1 < size and pq[c_index + 1] < pq[c_index]:
+                c_index += 1
+            child = pq[c_index]
+            if not child < entry:
+                break
+            child[3] = index
+            pq[index] = child
+            index = c_index
+            c_index = 2 * index + 1
+        entry[3] = index
+        pq[index] = entry
+        return index
 
 
 class DiffResourceQueue:
-    # Two tasks share a resource queue iff the share all the resources. If the two tasks share only a set of resources,
-    # then they will point to different resource queues. Therefore, a resource may be repeated in many queues.
-    def __init__(self, task_resource_map, r_initial_availability):
-        self._resource_queues = list()  # List of (shared) resource queues, i.e., many tasks may share a resource queue
-        self._resource_queue_map = dict()  # Map relating the indexes of the queues where a resource r_id is contained
-        self._task_queue_map = dict()  # Map with the index of the resource queue that can perform a task r_id
+    # Global availability index of the resources. The resources performing the same set of tasks (e.g., a resource
+    # profile) form a class, and each class keeps its resources in one heap of entries (available_at, sequence, index),
+    # i.e., a resource is updated in a single heap when released. The earliest available resource for a task is the
+    # earliest head of the heaps of its classes. If a task is performed by many classes (more than SCAN_LIMIT), it is
+    # found in O(log R) with a tournament tree over the classes, in which each node keeps the winner entry of its
+    # subtree and the bitmask of the tasks performed by some class of the subtree. Ties are broken by the sequence
+    # number, i.e., the resource released first is allocated first. The resources not released yet are tied as in the
+    # former per-task-group queues, i.e., in the order listed for the tasks performed by the same resources.
+    # A resource with an amount of N identical units keeps a heap with the availability of its units, and its entry in
+    # the class heap is the availability of its earliest unit, i.e., the unit allocated by pop_resource_for.
+    SCAN_LIMIT = 512
+
+    def __init__(self, task_resource_map, r_initial_availability, r_amounts=None):
+        self._resource_ids = list()  # Index -> resource id
+        self._resource_index = dict()  # Resource id -> index
+        self._resource_class = list()  # Index -> class of the resource
+        self._resource_entries = list()  # Index -> current entry of the resource (older entries in its heap are stale)
+        self._resource_masks = list()  # Index -> bitmask of the tasks the resource performs
+        self._resource_units = list()  # Index -> heap with the availability of each unit of the resource
+        self._class_heaps = list()  # Class -> heap of entries of the resources in the class
+        self._task_heaps = dict()  # Task id -> heaps of the classes performing the task, if at most SCAN_LIMIT
+        self._task_masks = dict()  # Task id -> bit of the task in the bitmasks
+        self._task_orders = dict()  # Task id -> indexes of its resources in the order they are listed
+        self._initial_entries = 0  # The entries inserted at the start (not released yet) have a lower sequence
+        self._counter = itertools.count()
+
+        self._use_tree = False
+        self._leaves = 1
+        self._winners = list()  # Binary tree as a list, node i has children 2i, 2i+1, and the leaves start at _leaves
+        self._masks = list()  # Node -> bitmask of the tasks performed by the classes in the subtree
+
+        self._init_resource_classes(task_resource_map, r_initial_availability, r_amounts if r_amounts else dict())
 
-        self._init_simulation_queues(task_resource_map, r_initial_availability)
+    def pop_resource_for(self, task_id, ready_at=None):
+        # The resource is not removed from the index, the engine updates its availability (upddate_resource_availability)
+        # right after allocating it, before the next pop. The time the task is ready (ready_at) is only used by policies
+        t_heaps = self._task_heaps.get(task_id)
+        if t_heaps:
+            best = min([c_heap[0] for c_heap in t_heaps])
+        elif self._use_tree:
+            best = self._tree_winner_for(self._task_masks.get(task_id, 0))
+        else:
+            best = None
+        if best is None:
+            return None, None
+        if best[1] < self._initial_entries:
+            best = self._initial_tie_winner(task_id, best)
+        return self._resource_ids[best[2]], best[0]
+
+    def available_at(self, resource_id):
+        # Availability of the earliest unit of the resource, None if the resource performs no task
+        r_index = self._resource_index.get(resource_id)
+        return self._resource_units[r_index][0] if r_index is not None else None
 
-    def pop_resource_for(self, task_id):
-        return self._resource_queues[self._task_queue_map[task_id]].pop_min()
+    def claim_resource(self, resource_id, claimed_at):
+        # The resource is allocated by its id (e.g., to a queued task) instead of by pop_resource_for, as before its
+        # availability is updated right after
+        return self.available_at(resource_id)
 
     def upddate_resource_availability(self, resource_id, released_at):
-        for q_index in self._resource_queue_map[resource_id]:
-            self._resource_queues[q_index].insert(resource_id, released_at)
-
-    def _init_simulation_queues(self, task_resource_map, r_initial_availability):
-        joint_sets = list()
-        taken = set()
-        # Grouping the tasks that share all the resources
-        for task_id_1 in task_resource_map:
-            if task_id_1 not in taken:
-                joint_tasks = set()
-                for task_id_2 in task_resource_map:
-                    is_joint = True
-                    if len(task_resource_map[task_id_2]) != len(task_resource_map[task_id_1]):
-                        continue
-                    for r_id in task_resource_map[task_id_2]:
-                        if r_id not in task_resource_map[task_id_1]:
-                            is_joint = False
-                            break
-                    if is_joint:
-                        taken.add(task_id_2)
-                        joint_tasks.add(task_id_2)
-                joint_sets.append(joint_tasks)
-
-        index = 0
-        for j_set in joint_sets:
-            resource_queue = PriorityQueue()
-            for task_id in j_set:
-                self._task_queue_map[task_id] = index
-                if resource_queue.is_empty():
-                    for r_id in task_resource_map[task_id]:
-                        if r_id not in self._resource_queue_map:
-                            self._resource_queue_map[r_id] = list()
-                        resource_queue.insert(r_id, r_initial_availability[r_id])
-                        self._resource_queue_map[r_id].append(index)
-            self._resource_queues.append(resource_queue)
-            index += 1
+        # The earliest unit of the resource, i.e., the one allocated, is released at released_at
+        r_index = self._resource_index[resource_id]
+        r_units = self._resource_units[r_index]
+        heapreplace(r_units, released_at)
+        r_entry = (r_units[0], next(self._counter), r_index)
+        self._resource_entries[r_index] = r_entry
+        c_index = self._resource_class[r_index]
+        c_heap = self._class_heaps[c_index]
+        heappush(c_heap, r_entry)
+        while c_heap[0] is not self._resource_entries[c_heap[0][2]]:
+            heappop(c_heap)
+
+        if self._use_tree:
+            winners = self._winners
+            node = c_index + self._leaves
+            if winners[node] is not c_heap[0]:
+                winners[node] = c_heap[0]
+                node >>= 1
+                while node > 0:
+                    l_entry, r_entry = winners[2 * node], winners[2 * node + 1]
+                    winners[node] = l_entry if l_entry < r_entry else r_entry
+                    node >>= 1
+
+    def _initial_tie_winner(self, task_id, best):
+        # First resource listed for the task among those not released yet and available at the same time as best. Each
+        # resource is the winner at most once before being released, so this scan is not repeated along the simulation
+        resource_entries = self._resource_entries
+        for r_index in self._task_orders[task_id]:
+            r_entry = resource_entries[r_index]
+            if r_entry[1] < self._initial_entries and r_entry[0] == best[0]:
+                return r_entry
+        return best
+
+    def _tree_winner_for(self, task_mask):
+        # Branch-and-bound descent, skipping the subtrees without classes performing the task, or whose winner is not
+        # earlier than the best eligible resource found so far
+        winners, masks, r_masks = self._winners, self._masks, self._resource_masks
+        best = None
+        pending_nodes = [1]
+        while pending_nodes:
+            node = pending_nodes.pop()
+            n_winner = winners[node]
+            if not masks[node] & task_mask or (best is not None and not n_winner < best):
+                continue
+            # The winner is the earliest resource of the subtree, if it performs the task there's no better one
+            if r_masks[n_winner[2]] & task_mask:
+                best = n_winner
+                continue
+            # The child with the earliest winner is explored first, i.e., it is the last one added to the stack
+            if winners[2 * node] < winners[2 * node + 1]:
+                pending_nodes.append(2 * node + 1)
+                pending_nodes.append(2 * node)
+            else:
+                pending_nodes.append(2 * node)
+                pending_nodes.append(2 * node + 1)
+        return best
+
+    def _init_resource_classes(self, task_resource_map, r_initial_availability, r_amounts):
+        resource_tasks = dict()
+        for task_id in task_resource_map:
+            self._task_masks[task_id] = 1 << len(self._task_masks)
+            for r_id in task_resource_map[task_id]:
+                if r_id not in resource_tasks:
+                    resource_tasks[r_id] = list()
+                resource_tasks[r_id].append(len(self._task_masks) - 1)
+
+        # The classes are sorted by their set of tasks, so the classes sharing most of their tasks are close in the tree
+        class_index = dict()
+        for task_set in sorted(set([tuple(r_tasks) for r_tasks in resource_tasks.values()])):
+            class_index[task_set] = len(class_index)
+            self._class_heaps.append(list())
+        for r_id in resource_tasks:
+            r_index = len(self._resource_ids)
+            c_index = class_index[tuple(resource_tasks[r_id])]
+            r_entry = (r_initial_availability[r_id], next(self._counter), r_index)
+            self._resource_index[r_id] = r_index
+            self._resource_ids.append(r_id)
+            self._resource_class.append(c_index)
+            self._resource_entries.append(r_entry)
+            self._resource_units.append([r_initial_availability[r_id]] * max(1, r_amounts.get(r_id, 1)))
+            heappush(self._class_heaps[c_index], r_entry)
+            r_mask = 0
+            for t_index in resource_tasks[r_id]:
+                r_mask |= 1 << t_index
+            self._resource_masks.append(r_mask)
+        self._initial_entries = len(self._resource_ids)
+
+        # The tasks with the same resources shared a queue, with the resources listed as for the first task iterated in
+        # the set of those tasks (built in the same order as the former queues, so the same task is taken)
+        group_tasks = dict()
+        for task_id in task_resource_map:
+            r_set = frozenset(task_resource_map[task_id])
+            if r_set not in group_tasks:
+                group_tasks[r_set] = set()
+            group_tasks[r_set].add(task_id)
+        for r_set in group_tasks:
+            g_order = [self._resource_index[r_id] for r_id in task_resource_map[next(iter(group_tasks[r_set]))]]
+            for task_id in group_tasks[r_set]:
+                self._task_orders[task_id] = g_order
+
+        task_classes = [list() for _ in range(0, len(self._task_masks))]
+        for task_set in class_index:
+            for t_index in task_set:
+                task_classes[t_index].append(class_index[task_set])
+        for task_id in self._task_masks:
+            t_classes = task_classes[self._task_masks[task_id].bit_length() - 1]
+            if len(t_classes) <= self.SCAN_LIMIT:
+                self._task_heaps[task_id] = [self._class_heaps[c_index] for c_index in t_classes]
+            else:
+                self._use_tree = True
+        if self._use_tree:
+            self._init_tournament_tree()
+
+    def _init_tournament_tree(self):
+        while self._leaves < len(self._class_heaps):
+            self._leaves *= 2
+        # Empty leaves never win (infinite availability) and have no tasks, their index is after the last resource
+        self._resource_masks.append(0)
+        self._winners = [(math.inf, -1, len(self._resource_ids))] * (2 * self._leaves)
+        self._masks = [0] * (2 * self._leaves)
+        for c_index in range(0, len(self._class_heaps)):
+            c_head = self._class_heaps[c_index][0]
+            self._winners[self._leaves + c_index] = c_head
+            self._masks[self._leaves + c_index] = self._resource_masks[c_head[2]]
+        for node in range(self._leaves - 1, 0, -1):
+            l_entry, r_entry = self._winners[2 * node], self._winners[2 * node + 1]
+            self._winners[node] = l_entry if l_entry < r_entry else r_entry
+            self._masks[node] = self._masks[2 * node] | self._masks[2 * node + 1]
+
+
+class PolicyResourceQueue(DiffResourceQueue):
+    # Resource queue allocating, among the idle resources that can perform a task, the one with the lowest priority of
+    # an AllocationPolicy, or the earliest available resource if none is idle. The busy resources are kept in a heap of
+    # their availability entries, and as the clock advances (ready_at) they become idle, i.e., they are added to the
+    # idle heaps with entries (priority, sequence, index, availability entry). If the priority does not depend on the
+    # task, there is an idle heap per class of resources, otherwise (or if the task is performed by many classes) one
+    # per task. Entries are discarded (lazily) when the resource is allocated, i.e., when its availability entry changes.
+    # The ready_at times of the successive pops must not decrease.
+    def __init__(self, task_resource_map, r_initial_availability, r_amounts=None, allocation_policy=None):
+        super().__init__(task_resource_map, r_initial_availability, r_amounts)
+        self._policy = allocation_policy
+        self._idle_heaps = list()  # Heaps of entries of idle resources, one per class or per task
+        self._idle_tasks = list()  # Idle heap -> task of the priorities of its entries (None if task independent)
+        self._idle_limits = list()  # Idle heap -> heap size after which the discarded entries are removed
+        self._task_idle_heaps = dict()  # Task id -> idle heaps with the resources that can perform the task
+        self._resource_idle_heaps = [list() for _ in range(0, len(self._resource_ids))]  # Index -> its idle heaps
+        self._busy_heap = list(self._resource_entries)
+        self._allocated_at = dict()  # Resource index -> time at which it was allocated (by the last pop)
+        heapify(self._busy_heap)
+        self._init_idle_heaps(task_resource_map)
+
+    def pop_resource_for(self, task_id, ready_at=None):
+        if ready_at is None:
+            return super().pop_resource_for(task_id)
+        self._release_idle_resources(ready_at)
+        resource_entries = self._resource_entries
+        best = None
+        for idle_heap in self._task_idle_heaps.get(task_id, []):
+            while idle_heap and idle_heap[0][3] is not resource_entries[idle_heap[0][2]]:
+                heappop(idle_heap)
+            if idle_heap and (best is None or idle_heap[0] < best):
+                best = idle_heap[0]
+        if best is not None:
+            resource_id, available_at = self._resource_ids[best[2]], best[3][0]
+        else:
+            resource_id, available_at = super().pop_resource_for(task_id)
+            if resource_id is None:
+                return None, None
+        self._allocated_at[self._resource_index[resource_id]] = max(available_at, ready_at)
+        return resource_id, available_at
+
+    def claim_resource(self, resource_id, claimed_at):
+        self._allocated_at[self._resource_index[resource_id]] = claimed_at
+        return super().claim_resource(resource_id, claimed_at)
+
+    def upddate_resource_availability(self, resource_id, released_at):
+        super().upddate_resource_availability(resource_id, released_at)
+        r_index = self._resource_index[resource_id]
+        heappush(self._busy_heap, self._resource_entries[r_index])
+        if r_index in self._allocated_at:
+            self._policy.resource_released(resource_id, self._allocated_at.pop(r_index), released_at)
+
+    def _release_idle_resources(self, ready_at):
+        busy_heap, resource_entries = self._busy_heap, self._resource_entries
+        while busy_heap and busy_heap[0][0] <= ready_at:
+            r_entry = heappop(busy_heap)
+            r_index = r_entry[2]
+            if r_entry is not resource_entries[r_index]:
+                continue
+            resource_id = self._resource_ids[r_index]
+            for i_index in self._resource_idle_heaps[r_index]:
+                idle_heap = self._idle_heaps[i_index]
+                heappush(idle_heap, (self._policy.priority(self._idle_tasks[i_index], resource_id),
+                                     next(self._counter), r_index, r_entry))
+                if len(idle_heap) > self._idle_limits[i_index]:
+                    # Heaps rarely queried would keep the discarded entries of resources that are idle many times
+                    idle_heap[:] = [i_entry for i_entry in idle_heap if i_entry[3] is resource_entries[i_entry[2]]]
+                    heapify(idle_heap)
+
+    def _init_idle_heaps(self, task_resource_map):
+        class_idle_heap = dict()  # Class -> its idle heap (only classes of tasks using them)
+        for task_id in task_resource_map:
+            t_indexes = set([self._resource_index[r_id] for r_id in task_resource_map[task_id]])
+            t_classes = set([self._resource_class[r_index] for r_index in t_indexes])
+            self._task_idle_heaps[task_id] = list()
+            if self._policy.task_independent and len(t_classes) <= self.SCAN_LIMIT:
+                for c_index in t_classes:
+                    if c_index not in class_idle_heap:
+                        class_idle_heap[c_index] = self._add_idle_heap(None)
+                    self._task_idle_heaps[task_id].append(self._idle_heaps[class_idle_heap[c_index]])
+            else:
+                i_index = self._add_idle_heap(task_id)
+                self._task_idle_heaps[task_id].append(self._idle_heaps[i_index])
+                for r_index in t_indexes:
+                    self._resource_idle_heaps[r_index].append(i_index)
+        for r_index in range(0, len(self._resource_ids)):
+            if self._resource_class[r_index] in class_idle_heap:
+                self._resource_idle_heaps[r_index].append(class_idle_heap[self._resource_class[r_index]])
+        heap_resources = [0] * len(self._idle_heaps)
+        for r_idle_heaps in self._resource_idle_heaps:
+            for i_index in r_idle_heaps:
+                heap_resources[i_index] += 1
+        self._idle_limits = [2 * r_count + 16 for r_count in heap_resources]
+
+    def _add_idle_heap(self, task_id):
+        self._idle_heaps.append(list())
+        self._idle_tasks.append(task_id)
+        return len(self._idle_heaps) - 1
+
+
+class WorkQueues:
+    # Queues of the enabled tasks waiting for a resource. The tasks performed by the same set of resources (e.g., the
+    # tasks of a pool) share a queue, and a released resource takes the next task of the queues it serves, according to
+    # the discipline:
+    #  - fifo: the task enabled first
+    #  - lifo: the task enabled last
+    #  - sept: the task with the shortest expected processing time (average over the resources performing it)
+    #  - case_priority: the task of the case that arrived first (FIFO among the tasks of the same case)
+    # Each queue is a heap of entries (key, sequence, enabled event), i.e., queuing and dispatching a task is O(log n)
+    # regardless of the length of the queue, plus a scan of the heads of the (few) queues served by the resource.
+    DISCIPLINES = ["fifo", "lifo", "sept", "case_priority"]
+
+    def __init__(self, task_resource_map, discipline, expected_durations=None):
+        if discipline not in self.DISCIPLINES:
+            raise ValueError("Unknown queue discipline '%s', expected one of: %s"
+                             % (discipline, ", ".join(self.DISCIPLINES)))
+        self.discipline = discipline
+        self.queue_tasks = list()  # Queue -> ids of the tasks in the queue
+        self.resource_queues = dict()  # Resource id -> heaps of the queues it serves
+        self._task_queue = dict()  # Task id -> its queue
+        self._heaps = list()  # Queue -> heap of entries of the waiting tasks
+        self._task_keys = dict()  # Task id -> expected processing time (sept)
+        self._counter = itertools.count()
+
+        # Statistics of each queue, the average length is the area under the length over time divided by the time
+        self.queued_tasks = list()
+        self.max_length = list()
+        self.length_area = list()
+        self.total_wait = list()
+        self.max_wait = list()
+        self._last_change = list()
+
+        queue_index = dict()
+        for task_id in task_resource_map:
+            r_set = frozenset(task_resource_map[task_id])
+            if r_set not in queue_index:
+                queue_index[r_set] = len(self._heaps)
+                self._heaps.append(list())
+                self.queue_tasks.append(list())
+                for r_id in r_set:
+                    self.resource_queues.setdefault(r_id, list()).append(self._heaps[-1])
+            self._task_queue[task_id] = queue_index[r_set]
+            self.queue_tasks[queue_index[r_set]].append(task_id)
+            if discipline == "sept" and len(r_set) > 0:
+                self._task_keys[task_id] = sum([expected_durations[(task_id, r_id)] for r_id in r_set]) / len(r_set)
+        for stat_list in [self.queued_tasks, self.max_length, self.length_area, self.total_wait, self.max_wait,
+                          self._last_change]:
+            stat_list.extend([0] * len(self._heaps))
+
+    def push(self, enabled_event, queued_at):
+        q_index = self._task_queue[enabled_event.task_id]
+        self._update_length_area(q_index, queued_at)
+        if self.discipline == "fifo":
+            key = enabled_event.enabled_at
+        elif self.discipline == "lifo":
+            key = -enabled_event.enabled_at
+        elif self.discipline == "sept":
+            key = (self._task_keys[enabled_event.task_id], enabled_event.enabled_at)
+        else:
+            key = (enabled_event.p_case, enabled_event.enabled_at)
+        # LIFO also reverses the order of the tasks enabled at the same time
+        sequence = next(self._counter)
+        heappush(self._heaps[q_index], (key, -sequence if self.discipline == "lifo" else sequence, q_index,
+                                        enabled_event))
+        self.queued_tasks[q_index] += 1
+        self.max_length[q_index] = max(self.max_length[q_index], len(self._heaps[q_index]))
+
+    def pop_for(self, resource_id, dispatched_at):
+        # Next enabled event to be performed by the resource, None if no task is waiting for it
+        best = None
+        for q_heap in self.resource_queues.get(resource_id, []):
+            if q_heap and (best is None or q_heap[0] < best):
+                best = q_heap[0]
+        if best is None:
+            return None
+        q_index, enabled_event = best[2], best[3]
+        self._update_length_area(q_index, dispatched_at)
+        heappop(self._heaps[q_index])
+        waited = dispatched_at - enabled_event.enabled_at
+        self.total_wait[q_index] += waited
+        self.max_wait[q_index] = max(self.max_wait[q_index], waited)
+        return enabled_event
+
+    def length(self, q_index):
+        return len(self._heaps[q_index])
+
+    def average_length(self, q_index, started_at, ended_at):
+        if ended_at <= started_at:
+            return 0
+        self._update_length_area(q_index, ended_at)
+        return self.length_area[q_index] / (ended_at - started_at)
+
+    def _update_length_area(self, q_index, at):
+        self.length_area[q_index] += len(self._heaps[q_index]) * (at - self._last_change[q_index])
+        self._last_change[q_index] = at
 
 
 class EventQueue:
+    # Future event list, i.e., binary heap of entries [time, kind, sequence, event] (O(log n) insert and pop).
+    # At the same time, release events (resources taking a queued task) are returned first, then the enabled events and
+    # then the arrival events, and the sequence number keeps FIFO order among the events of the same kind.
+    RELEASE = 0
+    ENABLED = 1
+    ARRIVAL = 2
+
     def __init__(self):
-        self.arrival_events = deque()
-        self.enabled_events = deque()
+        self.future_events = list()
+        self.counter = itertools.count()
+
+    def is_empty(self):
+        return len(self.future_events) == 0
+
+    def size(self):
+        return len(self.future_events)
 
     def append_arrival_event(self, event_info):
-        self.arrival_events.append(event_info)
+        heappush(self.future_events, (event_info.enabled_at, self.ARRIVAL, next(self.counter), event_info))
 
     def append_enabled_event(self, event_info):
-        self.enabled_events.append(event_info)
+        heappush(self.future_events, (event_info.enabled_at, self.ENABLED, next(self.counter), event_info))
+
+    def append_release_event(self, event_info):
+        heappush(self.future_events, (event_info.released_at, self.RELEASE, next(self.counter), event_info))
+
+    def peek_next_time(self):
+        return self.future_events[0][0] if self.future_events else None
 
     def pop_next_event(self):
-        if self.arrival_events and self.enabled_events:
-            if self.arrival_events[0].enabled_at < self.enabled_events[0].enabled_at:
-                return self.arrival_events.popleft()
-            else:
-                return self.enabled_events.popleft()
-        elif self.enabled_events:
-            return self.enabled_events.popleft()
-        elif self.arrival_events:
-            return self.arrival_events.popleft()
-        else:
-            return None
+        if self.future_events:
+            return heappop(self.future_events)[-1]
+        return None
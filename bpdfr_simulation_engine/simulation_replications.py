@@ -0,0 +1,126 @@
+import csv
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+import pytz
+
+from bpdfr_simulation_engine.scenario_bundle import load_scenario
+from bpdfr_simulation_engine.simulation_engine import SimBPMEnv, execute_full_process, StoppingCriteria
+from bpdfr_simulation_engine.simulation_setup import SimDiffSetup
+from bpdfr_simulation_engine.simulation_stats_calculator import KPIConfidenceInterval
+
+process_kpi_names = ["cycle_time", "processing_time", "idle_cycle_time", "idle_processing_time", "waiting_time",
+                     "idle_time"]
+
+_worker_setup = None  # Simulation setup parsed once by the parent process and shared by each worker of the pool
+
+
+class ReplicationsResult:
+    def __init__(self, confidence=0.95):
+        self.kpi_intervals = dict()
+        for kpi_name in process_kpi_names:
+            self.kpi_intervals[kpi_name] = KPIConfidenceInterval(kpi_name, confidence)
+        self.total_replications = 0
+
+    def add_replication(self, kpi_averages: dict):
+        self.total_replications += 1
+        for kpi_name in kpi_averages:
+            self.kpi_intervals[kpi_name].add_value(kpi_averages[kpi_name])
+
+    def half_width(self, kpi_name):
+        return self.kpi_intervals[kpi_name].half_width()
+
+    def needs_replications(self, ci_kpi, ci_half_width, max_replications):
+        # True while the confidence interval of ci_kpi is wider than ci_half_width (up to max_replications)
+        return ci_half_width is not None and self.total_replications < max_replications \
+            and self.half_width(ci_kpi) > ci_half_width
+
+    def save_statistics(self, stat_fwriter):
+        stat_fwriter.writerow(["replications", self.total_replications])
+        stat_fwriter.writerow([""])
+        stat_fwriter.writerow(['Replications Statistics'])
+        stat_fwriter.writerow(['KPI', 'Mean', 'Std', 'CI Lower', 'CI Upper', 'CI Half Width', 'Confidence',
+                               'Replications'])
+        for kpi_name in self.kpi_intervals:
+            kpi_ci = self.kpi_intervals[kpi_name]
+            mean, half_width = kpi_ci.mean(), kpi_ci.half_width()
+            stat_fwriter.writerow([kpi_name, mean, kpi_ci.std(), mean - half_width, mean + half_width, half_width,
+                                   kpi_ci.confidence, kpi_ci.count()])
+
+
+def run_replications(bpmn_path, json_path, total_cases, replications=1, workers=1, stat_out_path=None,
+                     starting_at=None, seed=None, ci_half_width=None, ci_kpi="cycle_time", max_replications=100,
+                     confidence=0.95, case_substreams=False, stop_criteria=None, allocation_policy=None,
+                     queue_discipline=None, transition_cache=None, bundle_cache=None):
+    # Runs independent replications in a pool of processes, parsing the BPMN and JSON files only once, and aggregates
+    # the average process KPIs of each replication into their mean, std and confidence interval. If ci_half_width is
+    # given, replications are added until the confidence interval of ci_kpi is narrower than that half-width (in
+    # seconds), or max_replications is reached. The random streams of each replication are spawned from the seed in
+    # order, and the half-width is checked after each replication in that order (discarding the rest of a batch of
+    # 'workers' replications once it is reached), so the result does not depend on the number of workers.
+    if total_cases is None and (stop_criteria is None or not stop_criteria.is_bounded()):
+        raise ValueError("The total cases, the ending datetime or the steady-state precision must be provided")
+    diffsim_info = load_scenario(bpmn_path, json_path, bundle_cache)
+    diffsim_info.set_starting_satetime(starting_at if starting_at else pytz.utc.localize(datetime.datetime.now()))
+    if transition_cache:
+        # Explored once, then each worker keeps caching its own transitions
+        diffsim_info.compiled_graph.memoize_transitions(transition_cache)
+
+    result = ReplicationsResult(confidence)
+    seed_sequence = numpy.random.SeedSequence(seed)
+    workers = max(1, workers)
+
+    if workers == 1:
+        _init_worker(diffsim_info)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(diffsim_info,))
+    try:
+        pending_reps = replications
+        while pending_reps > 0:
+            rep_seeds = seed_sequence.spawn(pending_reps)
+            if executor is None:
+                kpi_list = [_run_replication(total_cases, rep_seed, case_substreams, stop_criteria, allocation_policy,
+                                             queue_discipline) for rep_seed in rep_seeds]
+            else:
+                kpi_list = executor.map(_run_replication, [total_cases] * pending_reps, rep_seeds,
+                                        [case_substreams] * pending_reps, [stop_criteria] * pending_reps,
+                                        [allocation_policy] * pending_reps, [queue_discipline] * pending_reps)
+            for kpi_averages in kpi_list:
+                if result.total_replications >= replications \
+                        and not result.needs_replications(ci_kpi, ci_half_width, max_replications):
+                    break
+                result.add_replication(kpi_averages)
+
+            pending_reps = 0
+            if result.needs_replications(ci_kpi, ci_half_width, max_replications):
+                pending_reps = min(workers, max_replications - result.total_replications)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if stat_out_path:
+        with open(stat_out_path, mode='w', newline='', encoding='utf-8') as stat_csv_file:
+            result.save_statistics(csv.writer(stat_csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL))
+    return result
+
+
+def _init_worker(sim_setup: SimDiffSetup):
+    global _worker_setup
+    _worker_setup = sim_setup
+
+
+def _run_replication(total_cases, rep_seed, case_substreams=False, stop_criteria: StoppingCriteria = None,
+                     allocation_policy=None, queue_discipline=None):
+    # Each replication draws from its own streams, otherwise forked workers would share the same random state
+    _worker_setup.set_random_streams(rep_seed, case_substreams)
+
+    bpm_env = SimBPMEnv(_worker_setup, None, None, True, stop_criteria, allocation_policy, queue_discipline)
+    execute_full_process(bpm_env, total_cases)
+    process_kpi = bpm_env.log_info.compute_process_kpi()
+
+    kpi_averages = dict()
+    for kpi_name in process_kpi_names:
+        kpi_averages[kpi_name] = getattr(process_kpi, kpi_name).avg
+    return kpi_averages
@@ -1,11 +1,10 @@
 import pytz
 import datetime
-from datetime import timedelta
 import ntpath
 
-from bpdfr_simulation_engine.control_flow_manager import ProcessState, ElementInfo, BPMN
-from bpdfr_simulation_engine.probability_distributions import generate_number_from
-from bpdfr_simulation_engine.resource_calendar import RCalendar
+from bpdfr_simulation_engine.control_flow_manager import ElementInfo, BPMN, CompiledBPMNGraph
+from bpdfr_simulation_engine.probability_distributions import generate_number_from, RandomStreams
+from bpdfr_simulation_engine.resource_calendar import RCalendar, week_second_from
 from bpdfr_simulation_engine.simulation_properties_parser import parse_simulation_model, parse_json_sim_parameters
 
 
@@ -13,12 +12,16 @@ class SimDiffSetup:
     def __init__(self, bpmn_path, json_path):
         self.process_name = ntpath.basename(bpmn_path).split(".")[0]
         self.start_datetime = datetime.datetime.now(pytz.utc)
+        self.start_week_second = week_second_from(self.start_datetime)
+        self.random_streams = RandomStreams()
 
         self.resources_map, self.calendars_map, self.element_probability, self.task_resource, self.arrival_calendar \
             = parse_json_sim_parameters(json_path)
 
         self.bpmn_graph = parse_simulation_model(bpmn_path)
         self.bpmn_graph.set_element_probabilities(self.element_probability, self.task_resource)
+        # The token game of the simulation runs on the integer-indexed copy of the graph
+        self.compiled_graph = CompiledBPMNGraph(self.bpmn_graph)
         if not self.arrival_calendar:
             self.arrival_calendar = self.find_arrival_calendar()
 
@@ -39,33 +42,43 @@ class SimDiffSetup:
             return self.calendars_map[self.resources_map[resource_id].calendar_id]
         return None
 
+    def week_second(self, sim_time):
+        # Second-of-week of a simulation time, i.e., seconds from start_datetime, as expected by the calendars
+        return (self.start_week_second + sim_time) % 604800
+
     def next_resting_time(self, resource_id, starting_from):
+        # starting_from is the simulation time (in seconds)
         if resource_id in self.resources_map:
-            return self.calendars_map[self.resources_map[resource_id].calendar_id].next_available_time(starting_from)
+            return self.calendars_map[self.resources_map[resource_id].calendar_id].next_available_time_at(
+                self.week_second(starting_from))
         return 0
 
     def next_arrival_time(self, starting_from):
         val = generate_number_from(self.element_probability['arrivalTime']['distribution_name'],
-                                   self.element_probability['arrivalTime']['distribution_params'])
+                                   self.element_probability['arrivalTime']['distribution_params'],
+                                   self.random_streams.arrivals)
         # if val > 100000:
         #     print('arrival')
         #     print('--------------------------------------')
-        return val + self.arrival_calendar.next_available_time(starting_from + timedelta(seconds=val))
+        return val + self.arrival_calendar.next_available_time_at(self.week_second(starting_from + val))
 
     def initial_state(self):
-        return ProcessState(self.bpmn_graph)
+        return self.compiled_graph.initial_state()
 
     def is_enabled(self, e_id, p_state):
-        return self.bpmn_graph.is_enabled(e_id, p_state)
+        return self.compiled_graph.is_enabled(e_id, p_state)
 
-    def update_process_state(self, e_id, p_state):
-        return self.bpmn_graph.update_process_state(e_id, p_state)
+    def update_process_state(self, e_id, p_state, r_streams=None):
+        r_streams = r_streams if r_streams is not None else self.random_streams
+        return self.compiled_graph.update_process_state(e_id, p_state, r_streams.branching_uniforms,
+                                                         r_streams.tie_breaking_uniforms)
 
     def find_arrival_calendar(self):
-        enabled_tasks = self.update_process_state(self.bpmn_graph.starting_event, self.initial_state())
+        # Calendar of the resources of the tasks the start event may enable, through every outgoing flow of the
+        # gateways in between. It is derived before the streams are seeded, so it must not draw any random number.
         starter_resources = set()
         arrival_calendar = RCalendar("arrival_calendar")
-        for task_id in enabled_tasks:
+        for task_id in self.find_starting_tasks():
             for r_id in self.task_resource[task_id]:
                 if r_id in starter_resources:
                     continue
@@ -73,9 +86,29 @@ class SimDiffSetup:
                 starter_resources.add(r_id)
         return arrival_calendar
 
-    def ideal_task_duration(self, task_id, resource_id):
+    def find_starting_tasks(self):
+        starting_tasks = list()
+        visited = {self.bpmn_graph.starting_event}
+        to_visit = [self.bpmn_graph.starting_event]
+        while to_visit:
+            e_info = self.bpmn_graph.element_info[to_visit.pop()]
+            for flow_id in e_info.outgoing_flows:
+                next_id = self.bpmn_graph.flow_arcs[flow_id][1]
+                if next_id in visited:
+                    continue
+                visited.add(next_id)
+                if self.bpmn_graph.element_info[next_id].type is BPMN.TASK:
+                    if next_id in self.task_resource:
+                        starting_tasks.append(next_id)
+                else:
+                    to_visit.append(next_id)
+        return starting_tasks
+
+    def ideal_task_duration(self, task_id, resource_id, r_streams=None):
+        r_streams = r_streams if r_streams is not None else self.random_streams
         val = generate_number_from(self.task_resource[task_id][resource_id]['distribution_name'],
-                                   self.task_resource[task_id][resource_id]['distribution_params'])
+                                   self.task_resource[task_id][resource_id]['distribution_params'],
+                                   r_streams.durations)
         # if val > 100000:
         #     print(task_id)
         #     print(resource_id)
@@ -83,7 +116,13 @@ class SimDiffSetup:
         return val
 
     def real_task_duration(self, task_duration, resource_id, enabled_at):
-        return self.calendars_map[self.resources_map[resource_id].calendar_id].find_idle_time(enabled_at, task_duration)
+        return self.calendars_map[self.resources_map[resource_id].calendar_id].find_idle_time_at(
+            self.week_second(enabled_at), task_duration)
 
     def set_starting_satetime(self, new_datetime):
         self.start_datetime = new_datetime
+        self.start_week_second = week_second_from(new_datetime)
+
+    def set_random_streams(self, seed=None, case_substreams=False):
+        # seed can be an int or a numpy SeedSequence (e.g., spawned for an independent replication)
+        self.random_streams = RandomStreams(seed, case_substreams)
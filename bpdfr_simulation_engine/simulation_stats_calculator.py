@@ -1,10 +1,12 @@
+import math
 import sys
 import datetime
-import pytz
+import numpy
+import scipy.stats as st
 
 from bpdfr_simulation_engine.resource_calendar import Interval
 
-from bpdfr_simulation_engine.execution_info import TaskEvent, Trace
+from bpdfr_simulation_engine.execution_info import Trace, EventStore
 from bpdfr_simulation_engine.simulation_setup import SimDiffSetup
 
 
@@ -33,6 +35,16 @@ class KPIInfo:
         self.count += 1
         self.avg = self.total / self.count
 
+    def add_values(self, values):
+        # add_value of each value of a numpy array, accumulating the total in the same order
+        if len(values) == 0:
+            return
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.total = float(numpy.add.accumulate(numpy.concatenate(([self.total], values)))[-1])
+        self.count += len(values)
+        self.avg = self.total / self.count
+
 
 class KPIMap:
     def __init__(self):
@@ -48,49 +60,179 @@ class KPIMap:
         self.cost = KPIInfo()
 
 
+class KPIConfidenceInterval:
+    def __init__(self, kpi_name, confidence=0.95):
+        self.kpi_name = kpi_name
+        self.confidence = confidence
+        self.values = list()  # Average value of the KPI in each replication
+
+    def add_value(self, new_value):
+        self.values.append(new_value)
+
+    def count(self):
+        return len(self.values)
+
+    def mean(self):
+        return sum(self.values) / len(self.values) if self.values else 0
+
+    def std(self):
+        if len(self.values) < 2:
+            return 0
+        mean = self.mean()
+        return math.sqrt(sum([(x - mean) ** 2 for x in self.values]) / (len(self.values) - 1))
+
+    def half_width(self):
+        # Student-t confidence interval, undefined (infinite) with less than two replications
+        if len(self.values) < 2:
+            return math.inf
+        t_value = st.t.ppf((1 + self.confidence) / 2, len(self.values) - 1)
+        return t_value * self.std() / math.sqrt(len(self.values))
+
+
+class BatchMeansDetector:
+    # Steady-state detector based on the method of batch means, i.e., the values of the completed cases are grouped
+    # in batches of batch_size cases, and the steady state is reached once the confidence interval of the mean of the
+    # batch means is narrower than rel_precision * mean for all the KPIs (requiring at least min_batches batches)
+    def __init__(self, kpi_names, rel_precision=0.05, batch_size=50, min_batches=10, confidence=0.95):
+        self.rel_precision = rel_precision
+        self.batch_size = batch_size
+        self.min_batches = min_batches
+        self.batch_means = dict()
+        self.batch_totals = dict()
+        for kpi_name in kpi_names:
+            self.batch_means[kpi_name] = KPIConfidenceInterval(kpi_name, confidence)
+            self.batch_totals[kpi_name] = 0
+        self.batch_count = 0
+        self.steady_state = False
+
+    def add_case(self, case_kpi: dict):
+        for kpi_name in self.batch_totals:
+            self.batch_totals[kpi_name] += case_kpi[kpi_name]
+        self.batch_count += 1
+        if self.batch_count == self.batch_size:
+            for kpi_name in self.batch_totals:
+                self.batch_means[kpi_name].add_value(self.batch_totals[kpi_name] / self.batch_size)
+                self.batch_totals[kpi_name] = 0
+            self.batch_count = 0
+            self.steady_state = self._is_converged()
+
+    def _is_converged(self):
+        for kpi_name in self.batch_means:
+            kpi_ci = self.batch_means[kpi_name]
+            if kpi_ci.count() < self.min_batches or kpi_ci.half_width() > self.rel_precision * abs(kpi_ci.mean()):
+                return False
+        return True
+
+
 class LogInfo:
-    def __init__(self, sim_setup: SimDiffSetup):
-        self.started_at = pytz.UTC.localize(datetime.datetime.max)
-        self.ended_at = pytz.UTC.localize(datetime.datetime.min)
+    def __init__(self, sim_setup: SimDiffSetup, stream_stats=False, warmup=0, steady_state_detector=None):
+        # Simulation times (in seconds from the start datetime) of the first started and last completed events
+        self.started_at = math.inf
+        self.ended_at = -math.inf
         self.trace_list = list()
         self.task_exec_info = dict()
         self.sim_setup = sim_setup
+        self.event_store = EventStore(sim_setup.task_resource.keys(), sim_setup.resources_map.keys())
+        # The task KPIs are computed from the columns of the event store, before the events are released (in streaming
+        # mode) or once the simulation ends. The tasks are added to task_exec_info in the order of their first event.
+        self.cost_per_hour = numpy.array([sim_setup.resources_map[r_id].cost_per_hour
+                                          for r_id in self.event_store.resource_ids], dtype=numpy.float64)
+        self.task_stats_completed = False
+
+        # Streaming mode: the KPIs of a case are computed as soon as it completes, then its events are released.
+        # Only the traces in progress are kept (active_traces), so the memory doesn't depend on the total cases.
+        # The event store is compacted once at least half of its events (and min_compact_events) were released.
+        self.stream_stats = stream_stats
+        self.active_traces = dict()
+        self.process_kpi = KPIMap()
+        self.min_compact_events = 100000
+
+        # Cases started, and events enabled, during the warm-up period (in seconds) are excluded from the KPIs
+        self.warmup = warmup
+        self.steady_state_detector = steady_state_detector
+
+    def add_trace(self, trace_info: Trace):
+        if self.stream_stats:
+            self.active_traces[trace_info.p_case] = trace_info
+        else:
+            self.trace_list.append(trace_info)
+
+    def complete_trace(self, p_case: int):
+        trace_info = self.active_traces.pop(p_case) if self.stream_stats else self.trace_list[p_case]
+        if self.is_warmup_trace(trace_info):
+            case_kpi = None
+        elif self.stream_stats:
+            case_kpi = self.compute_execution_times(trace_info, self.process_kpi)
+        elif self.steady_state_detector is not None:
+            case_kpi = self.compute_execution_times(trace_info)
+        else:
+            case_kpi = None
+        if case_kpi is not None and self.steady_state_detector is not None:
+            self.steady_state_detector.add_case(case_kpi)
+        if self.stream_stats:
+            self._release_events(trace_info)
+
+    def _release_events(self, trace_info: Trace):
+        event_store = self.event_store
+        event_store.release_case(trace_info)
+        if event_store.released >= self.min_compact_events and 2 * event_store.released >= event_store.size():
+            self._add_task_stats(event_store.released_rows(self.active_traces.values()))
+            event_store.compact(self.active_traces.values())
+
+    def is_warmup_trace(self, trace_info: Trace):
+        return trace_info.started_at < self.warmup
+
+    def is_warmup_event(self, enabled_at: float):
+        return enabled_at < self.warmup
+
+    def steady_state_reached(self):
+        return self.steady_state_detector is not None and self.steady_state_detector.steady_state
 
     def trace_info(self, p_case: int):
-        return self.trace_list[p_case]
-
-    def event_info(self, p_case: int, event_index: int):
-        return self.trace_list[p_case].event_list[event_index]
-
-    def add_event_info(self, p_case: int, event_info: TaskEvent, task_cost: float):
-        trace_info = self.trace_list[p_case]
-        trace_info.completed_at = max(trace_info.completed_at, event_info.completed_datetime)
-        trace_info.event_list.append(event_info)
-        self._update_global_task_stats(event_info, task_cost)
-
-    def compute_execution_times(self, trace_info: Trace, process_kpi: KPIMap):
+        return self.active_traces[p_case] if self.stream_stats else self.trace_list[p_case]
+
+    def add_event_info(self, p_case: int, task_id, resource_id, enabled_at: float, started_at: float,
+                       real_duration: float, ideal_duration: float):
+        trace_info = self.trace_info(p_case)
+        completed_at = started_at + real_duration
+        trace_info.completed_at = max(trace_info.completed_at, completed_at)
+        # Time the resource was resting while performing the task (in seconds)
+        self.event_store.add_event(trace_info, task_id, resource_id, enabled_at, started_at, completed_at,
+                                   real_duration - ideal_duration)
+        if task_id not in self.task_exec_info and not self.is_warmup_event(enabled_at):
+            self.task_exec_info[task_id] = KPIMap()
+
+    def compute_execution_times(self, trace_info: Trace, process_kpi: KPIMap = None):
+        # Returns the KPIs of the trace, also added to process_kpi (if given)
         processing_intervals = list()
         waiting_intervals = list()
         real_work_intervals = list()
-        for event_info in trace_info.event_list:
-            r_calendar = self.sim_setup.calendars_map[self.sim_setup.resources_map[event_info.resource_id].calendar_id]
-            r_calendar.remove_idle_times(event_info.started_datetime, event_info.completed_datetime,
-                                         real_work_intervals)
-            processing_intervals.append(Interval(event_info.started_datetime, event_info.completed_datetime))
-            waiting_intervals.append(Interval(event_info.enabled_datetime, event_info.started_datetime))
-
-        idle_cycle_time = (trace_info.completed_at - trace_info.started_at).total_seconds()
+        event_store = self.event_store
+        for e_index in event_store.case_events(trace_info):
+            enabled_at = event_store.enabled_at[e_index]
+            started_at = event_store.started_at[e_index]
+            completed_at = event_store.completed_at[e_index]
+            r_calendar = self.sim_setup.get_resource_calendar(event_store.resource_id(e_index))
+            r_calendar.remove_idle_times_at(started_at, completed_at, self.sim_setup.week_second(started_at),
+                                            real_work_intervals)
+            processing_intervals.append(Interval(started_at, completed_at))
+            waiting_intervals.append(Interval(enabled_at, started_at))
+
+        idle_cycle_time = trace_info.completed_at - trace_info.started_at
         idle_processing_time = sum_interval_union(processing_intervals)
         processing_time = sum_interval_union(real_work_intervals)
         waiting_time = sum_interval_union(waiting_intervals)
         idle_time = round(idle_processing_time - processing_time, 6)
 
-        process_kpi.idle_cycle_time.add_value(idle_cycle_time)
-        process_kpi.idle_processing_time.add_value(idle_processing_time)
-        process_kpi.processing_time.add_value(processing_time)
-        process_kpi.waiting_time.add_value(waiting_time)
-        process_kpi.idle_time.add_value(idle_time)
-        process_kpi.cycle_time.add_value(idle_cycle_time - idle_time)
+        case_kpi = {"cycle_time": idle_cycle_time - idle_time,
+                    "processing_time": processing_time,
+                    "idle_cycle_time": idle_cycle_time,
+                    "idle_processing_time": idle_processing_time,
+                    "waiting_time": waiting_time,
+                    "idle_time": idle_time}
+        if process_kpi is not None:
+            for kpi_name in case_kpi:
+                getattr(process_kpi, kpi_name).add_value(case_kpi[kpi_name])
 
         # These conditional are for debugging, remove after testing all the models
         # if idle_time < 0:
@@ -101,36 +243,78 @@ class LogInfo:
         # if idle_cycle_time != round(idle_processing_time + waiting_time, 6):
         #     calc = idle_processing_time + waiting_time
         #     print('trace_duration %s - %s idle_cycle_time (calculated)' % (idle_cycle_time, calc))
-
-    def _update_global_task_stats(self, event_info: TaskEvent, cost_per_hour: float):
-        self.started_at = min(self.started_at, event_info.started_datetime)
-        self.ended_at = max(self.ended_at, event_info.completed_datetime)
-        task_cost = cost_per_hour * event_info.processing_time / 3600
-        t_id = event_info.task_id
-
-        if t_id not in self.task_exec_info:
-            self.task_exec_info[t_id] = KPIMap()
-
-        self.task_exec_info[t_id].waiting_time.add_value(event_info.waiting_time)
-        self.task_exec_info[t_id].processing_time.add_value(event_info.processing_time)
-        self.task_exec_info[t_id].idle_time.add_value(event_info.idle_time)
-        self.task_exec_info[t_id].cycle_time.add_value(event_info.cycle_time)
-        self.task_exec_info[t_id].idle_processing_time.add_value(event_info.idle_processing_time)
-        self.task_exec_info[t_id].idle_cycle_time.add_value(event_info.idle_cycle_time)
-        self.task_exec_info[t_id].cost.add_value(task_cost)
+        return case_kpi
+
+    def _add_task_stats(self, rows):
+        # Adds the events in rows (indexes in the event store, in the order they were added), except those enabled
+        # during the warm-up, to the KPIs of their tasks, computed column-wise over the events of each task
+        event_store = self.event_store
+        enabled_at = event_store.to_numpy('enabled_at')
+        rows = rows[enabled_at[rows] >= self.warmup]
+        if len(rows) == 0:
+            return
+        task = event_store.to_numpy('task')[rows]
+        enabled_at = enabled_at[rows]
+        started_at = event_store.to_numpy('started_at')[rows]
+        completed_at = event_store.to_numpy('completed_at')[rows]
+        idle_time = event_store.to_numpy('idle_time')[rows]
+        cost_per_hour = self.cost_per_hour[event_store.to_numpy('resource')[rows]]
+        self.started_at = min(self.started_at, float(started_at.min()))
+        self.ended_at = max(self.ended_at, float(completed_at.max()))
+
+        idle_cycle_time = completed_at - enabled_at
+        idle_processing_time = completed_at - started_at
+        processing_time = idle_processing_time - idle_time
+        task_kpis = {"waiting_time": started_at - enabled_at,
+                     "processing_time": processing_time,
+                     "idle_time": idle_time,
+                     "cycle_time": idle_cycle_time - idle_time,
+                     "idle_processing_time": idle_processing_time,
+                     "idle_cycle_time": idle_cycle_time,
+                     "cost": cost_per_hour * processing_time / 3600}
+
+        # The stable sort keeps the events of each task in their order
+        by_task = numpy.argsort(task, kind='stable')
+        task_starts = numpy.flatnonzero(numpy.diff(task[by_task], prepend=-1))
+        for t_events in numpy.split(by_task, task_starts[1:]):
+            t_info: KPIMap = self.task_exec_info[event_store.task_ids[task[t_events[0]]]]
+            for kpi_name in task_kpis:
+                getattr(t_info, kpi_name).add_values(task_kpis[kpi_name][t_events])
+
+    def complete_task_stats(self):
+        # Adds the events still in the event store to the task KPIs, once all the cases are completed
+        if self.task_stats_completed:
+            return
+        self.task_stats_completed = True
+        if self.stream_stats:
+            # Completes the cases in progress, i.e., their events are released too
+            self.compute_process_kpi()
+        self._add_task_stats(numpy.arange(self.event_store.size()))
 
     def save_joint_statistics(self, bpm_env):
+        self.complete_task_stats()
         self.save_start_end_dates(bpm_env.stat_fwriter)
         compute_resource_utilization(bpm_env)
+        if bpm_env.work_queues is not None:
+            compute_work_queue_stats(bpm_env)
         self.compute_individual_task_stats(bpm_env.stat_fwriter)
         bpm_env.stat_fwriter.writerow([""])
         self.compute_full_simulation_statistics(bpm_env.stat_fwriter)
 
     def save_start_end_dates(self, stat_fwriter):
-        stat_fwriter.writerow(["started_at", str(self.started_at)])
-        stat_fwriter.writerow(["completed_at", str(self.ended_at)])
+        stat_fwriter.writerow(["started_at", str(self.simulation_datetime_from(self.started_at))])
+        stat_fwriter.writerow(["completed_at", str(self.simulation_datetime_from(self.ended_at))])
+        if self.warmup > 0:
+            stat_fwriter.writerow(["warmup_until", str(self.simulation_datetime_from(self.warmup))])
+        if self.steady_state_detector is not None:
+            stat_fwriter.writerow(["steady_state_reached", self.steady_state_detector.steady_state])
         stat_fwriter.writerow([""])
 
+    def simulation_datetime_from(self, sim_time):
+        if math.isinf(sim_time):
+            return None
+        return self.sim_setup.start_datetime + datetime.timedelta(seconds=sim_time)
+
     def compute_individual_task_stats(self, stat_fwriter):
         stat_fwriter.writerow(['Individual Task Statistics'])
         stat_fwriter.writerow(['Name', 'Count', 'Min Duration', 'Max Duration', 'Avg Duration', 'Total Duration',
@@ -158,11 +342,20 @@ class LogInfo:
                                    t_info.idle_processing_time.total, t_info.cost.min, t_info.cost.max,
                                    t_info.cost.avg, t_info.cost.total])
 
-    def compute_full_simulation_statistics(self, stat_fwriter):
+    def compute_process_kpi(self):
+        if self.stream_stats:
+            # The KPIs of the completed cases were already computed, only the unfinished ones are pending
+            for p_case in list(self.active_traces):
+                self.complete_trace(p_case)
+            return self.process_kpi
         process_kpi = KPIMap()
         for trace_info in self.trace_list:
-            self.compute_execution_times(trace_info, process_kpi)
+            if not self.is_warmup_trace(trace_info):
+                self.compute_execution_times(trace_info, process_kpi)
+        return process_kpi
 
+    def compute_full_simulation_statistics(self, stat_fwriter):
+        process_kpi = self.compute_process_kpi()
         kpi_map = {"cycle_time": process_kpi.cycle_time,
                    "processing_time": process_kpi.processing_time,
                    "idle_cycle_time": process_kpi.idle_cycle_time,
@@ -178,7 +371,7 @@ class LogInfo:
                                    kpi_map[kpi_name].max,
                                    kpi_map[kpi_name].avg,
                                    kpi_map[kpi_name].total,
-                                   len(self.trace_list)])
+                                   kpi_map[kpi_name].count])
 
 
 def compute_resource_utilization(bpm_env):
@@ -193,8 +386,11 @@ def compute_resource_utilization(bpm_env):
     for r_id in bpm_env.sim_setup.resources_map:
         calendar_info = bpm_env.sim_setup.get_resource_calendar(r_id)
         if calendar_info.calendar_id not in available_time:
-            available_time[calendar_info.calendar_id] = calendar_info.find_working_time(started_at, completed_at)
-        bpm_env.sim_resources[r_id].available_time = available_time[calendar_info.calendar_id]
+            available_time[calendar_info.calendar_id] = 0 if math.isinf(started_at) else \
+                calendar_info.find_working_time_at(bpm_env.sim_setup.week_second(started_at), completed_at - started_at)
+        # The units of a resource share its calendar, i.e., its available time is that of the calendar times the amount
+        bpm_env.sim_resources[r_id].available_time = available_time[calendar_info.calendar_id] * \
+            bpm_env.sim_setup.resources_map[r_id].resource_amount
 
     for r_id in bpm_env.sim_resources:
         r_utilization = bpm_env.get_utilization_for(r_id)
@@ -217,6 +413,27 @@ def compute_resource_utilization(bpm_env):
     stat_fwriter.writerow([""])
 
 
+def compute_work_queue_stats(bpm_env):
+    # Each work queue is identified by the names of its tasks, the wait is the time from enabling to dispatching, and the
+    # average length is over the simulation time, i.e., from the first arrival to the last completed task
+    work_queues = bpm_env.work_queues
+    stat_fwriter = bpm_env.stat_fwriter
+    stat_fwriter.writerow(['Work Queues (%s)' % work_queues.discipline])
+    stat_fwriter.writerow(['Tasks', 'Queued Tasks', 'Max Length', 'Avg Length', 'Pending Tasks', 'Avg Wait (seconds)',
+                           'Max Wait (seconds)'])
+    element_info = bpm_env.sim_setup.bpmn_graph.element_info
+    for q_index in range(0, len(work_queues.queue_tasks)):
+        dispatched = work_queues.queued_tasks[q_index] - work_queues.length(q_index)
+        stat_fwriter.writerow([" | ".join([element_info[t_id].name for t_id in work_queues.queue_tasks[q_index]]),
+                               work_queues.queued_tasks[q_index],
+                               work_queues.max_length[q_index],
+                               work_queues.average_length(q_index, 0, bpm_env.log_info.ended_at),
+                               work_queues.length(q_index),
+                               work_queues.total_wait[q_index] / dispatched if dispatched > 0 else 0,
+                               work_queues.max_wait[q_index]])
+    stat_fwriter.writerow([""])
+
+
 def update_min_max(trace_info, duration_array, case_duration):
     duration_array[0] = case_duration
     duration_array[1] = trace_info.started_at
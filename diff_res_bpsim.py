@@ -3,8 +3,12 @@ import os
 from pathlib import Path
 
 import click
+import pytz
 
-from bpdfr_simulation_engine.simulation_engine import run_simulation
+from bpdfr_simulation_engine.resource_calendar import parse_datetime
+from bpdfr_simulation_engine.scenario_bundle import load_scenario, scenario_hash, BUNDLE_SUFFIX
+from bpdfr_simulation_engine.simulation_engine import run_simulation, StoppingCriteria
+from bpdfr_simulation_engine.simulation_replications import run_replications
 from bpdfr_simulation_engine.simulation_setup import SimDiffSetup
 
 
@@ -18,8 +22,9 @@ def cli():
               help='Path to the BPMN file with the process model')
 @click.option('--json_path', required=True,
               help='Path to the JSON file with the differentiated simulation parameters')
-@click.option('--total_cases', required=True, type=click.INT,
-              help='Number of process instances to simulate')
+@click.option('--total_cases', required=False, type=click.INT,
+              help='Number of process instances to simulate. Optional if --ending_at or --steady_state_precision '
+                   'are given, then it is the maximum number of process instances.')
 @click.option('--stat_out_path', required=False,
               help='Path to the CSV file to produce with the statistics/metrics after running the simulations.'
                    'If this file path is not provided, one is created by default in the current directory.')
@@ -29,9 +34,103 @@ def cli():
 @click.option('--starting_at', required=False,
               help='Date-time of the first process case in the simulation.'
                    'If this parameter is not provided, the current date-time is assigned.')
+@click.option('--stream_stats', is_flag=True, default=False,
+              help='Computes the KPIs of each case as soon as it completes and releases its events afterwards, '
+                   'i.e., the memory used for the statistics does not depend on the number of cases simulated.')
+@click.option('--replications', required=False, type=click.INT, default=1,
+              help='Number of independent replications to run. With more than one replication, the statistics file '
+                   'reports the mean, std and confidence interval of each process KPI, and no event-log is produced.')
+@click.option('--workers', required=False, type=click.INT, default=1,
+              help='Number of processes running replications in parallel.')
+@click.option('--ci_half_width', required=False, type=click.FLOAT,
+              help='Keeps adding replications until the 95% confidence interval of the average cycle time has this '
+                   'half-width (in seconds), or 100 replications are reached.')
+@click.option('--seed', required=False, type=click.INT,
+              help='Seed from which the random streams (arrivals, durations, branching and tie-breaking) are derived, '
+                   'i.e., two runs with the same seed and inputs produce the same results.')
+@click.option('--case_substreams', is_flag=True, default=False,
+              help='Draws the durations and decisions of each case from its own substreams, i.e., scenarios simulated '
+                   'with the same seed are compared on common random numbers.')
+@click.option('--ending_at', required=False,
+              help='Date-time after which no more process instances arrive. The simulation ends once the instances '
+                   'in progress are completed.')
+@click.option('--warmup', required=False, type=click.FLOAT, default=0,
+              help='Warm-up period (in seconds). The instances arriving during the warm-up are excluded from the KPIs.')
+@click.option('--steady_state_precision', required=False, type=click.FLOAT,
+              help='Stops the arrival of new instances once the batch-means 95% confidence interval of the steady-state '
+                   'KPIs is narrower than this fraction of their mean, e.g., 0.05.')
+@click.option('--steady_state_kpi', required=False, multiple=True, default=["cycle_time"],
+              type=click.Choice(["cycle_time", "processing_time", "idle_cycle_time", "idle_processing_time",
+                                 "waiting_time", "idle_time"]),
+              help='Process KPI checked by the steady-state detector (the option can be repeated).')
+@click.option('--batch_size', required=False, type=click.INT, default=50,
+              help='Number of completed instances in each batch of the steady-state detector.')
+@click.option('--profile', is_flag=True, default=False,
+              help='Measures the time spent in each phase of the simulation loop, saved as JSON next to the '
+                   'statistics file, e.g., stats.csv -> stats_profile.json (single runs only).')
+@click.option('--allocation_policy', required=False, default="earliest",
+              type=click.Choice(["earliest", "fastest", "cheapest", "least_utilized", "round_robin"]),
+              help='Resource allocated among the idle ones that can perform a task: earliest available (default), '
+                   'fastest expected duration, cheapest cost per hour, least busy time so far, or least recently '
+                   'allocated (round-robin).')
+@click.option('--queue_discipline', required=False, default=None,
+              type=click.Choice(["fifo", "lifo", "sept", "case_priority"]),
+              help='Enabled tasks wait in work queues (per set of resources able to perform them), and a released '
+                   'resource takes the next one: first enabled (fifo), last enabled (lifo), shortest expected '
+                   'processing time (sept), or of the case that arrived first (case_priority). By default, each '
+                   'task claims the earliest available resource when enabled.')
+@click.option('--transition_cache', required=False, type=click.INT,
+              help='Caches control-flow transitions (marking, fired element) up to this number of nodes (branching '
+                   'decisions and results), exploring the reachable markings first, so each case step is a table '
+                   'lookup instead of a walk of the model.')
+@click.option('--bundle_cache', required=False,
+              help='Folder of the compiled scenarios (see compile-scenario). The scenario is loaded from the bundle '
+                   'of its BPMN and JSON files, which is compiled and saved there on the first run.')
 @click.pass_context
-def start_simulation(ctx, bpmn_path, json_path, total_cases, stat_out_path=None, log_out_path=None, starting_at=None):
-    run_simulation(bpmn_path, json_path, total_cases, stat_out_path, log_out_path, starting_at)
+def start_simulation(ctx, bpmn_path, json_path, total_cases=None, stat_out_path=None, log_out_path=None,
+                     starting_at=None, stream_stats=False, replications=1, workers=1, ci_half_width=None, seed=None,
+                     case_substreams=False, ending_at=None, warmup=0, steady_state_precision=None,
+                     steady_state_kpi=("cycle_time",), batch_size=50, profile=False, allocation_policy="earliest",
+                     queue_discipline=None, transition_cache=None, bundle_cache=None):
+    starting_at = _parse_simulation_datetime(starting_at)
+    stop_criteria = StoppingCriteria(_parse_simulation_datetime(ending_at), warmup, steady_state_precision,
+                                     list(steady_state_kpi), batch_size)
+    if total_cases is None and not stop_criteria.is_bounded():
+        raise click.UsageError("One of --total_cases, --ending_at or --steady_state_precision is required")
+    if replications > 1 or ci_half_width is not None:
+        if not stat_out_path:
+            stat_out_path = "%s_replications.csv" % Path(bpmn_path).stem
+        run_replications(bpmn_path, json_path, total_cases, replications, workers, stat_out_path, starting_at, seed,
+                         ci_half_width, case_substreams=case_substreams, stop_criteria=stop_criteria,
+                         allocation_policy=allocation_policy, queue_discipline=queue_discipline,
+                         transition_cache=transition_cache, bundle_cache=bundle_cache)
+    else:
+        run_simulation(bpmn_path, json_path, total_cases, stat_out_path, log_out_path, starting_at, stream_stats,
+                       seed, case_substreams, stop_criteria, profile, allocation_policy, queue_discipline,
+                       transition_cache, bundle_cache)
+
+
+@cli.command()
+@click.option('--bpmn_path', required=True,
+              help='Path to the BPMN file with the process model')
+@click.option('--json_path', required=True,
+              help='Path to the JSON file with the differentiated simulation parameters')
+@click.option('--bundle_cache', required=True,
+              help='Folder where the compiled scenario is saved, named after the content hash of both files.')
+@click.pass_context
+def compile_scenario(ctx, bpmn_path, json_path, bundle_cache):
+    try:
+        load_scenario(bpmn_path, json_path, bundle_cache)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(os.path.join(bundle_cache, "%s%s" % (scenario_hash(bpmn_path, json_path), BUNDLE_SUFFIX)))
+
+
+def _parse_simulation_datetime(str_datetime):
+    if not str_datetime:
+        return None
+    sim_datetime = parse_datetime(str_datetime, True)
+    return pytz.utc.localize(sim_datetime) if sim_datetime.tzinfo is None else sim_datetime
 
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+import time
+
+import click
+import numpy
+
+from bpdfr_simulation_engine.resource_allocation import create_allocation_policy
+from bpdfr_simulation_engine.simulation_queues_ds import DiffResourceQueue, PolicyResourceQueue
+from bpdfr_simulation_engine.simulation_setup import SimDiffSetup
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_scenario_generator import ScenarioParams, generate_scenario
+
+policy_names = ["earliest", "fastest", "cheapest", "least_utilized", "round_robin"]
+
+
+def run_allocations(sim_setup, policy_name, allocations, utilization, seed):
+    # Same pattern as the engine, i.e., tasks enabled at increasing times, each allocated resource is released after
+    # the duration, drawn with a mean such that the pool works at the given utilization
+    policy = create_allocation_policy(policy_name, sim_setup)
+    r_available = dict()
+    for r_id in sim_setup.resources_map:
+        r_available[r_id] = 0.0
+    if policy is None:
+        resource_queue = DiffResourceQueue(sim_setup.task_resource, r_available)
+    else:
+        resource_queue = PolicyResourceQueue(sim_setup.task_resource, r_available, None, policy)
+
+    rng = numpy.random.default_rng(seed)
+    task_ids = list(sim_setup.task_resource.keys())
+    enabled_tasks = rng.integers(0, len(task_ids), allocations).tolist()
+    durations = rng.exponential(600, allocations).tolist()
+    inter_enabling = 600 / (len(sim_setup.resources_map) * utilization)
+    enabled_at, waiting_time = 0.0, 0.0
+    s_t = time.perf_counter()
+    for t_index, duration in zip(enabled_tasks, durations):
+        enabled_at += inter_enabling
+        resource_id, available_at = resource_queue.pop_resource_for(task_ids[t_index], enabled_at)
+        started_at = max(available_at, enabled_at)
+        waiting_time += started_at - enabled_at
+        resource_queue.upddate_resource_availability(resource_id, started_at + duration)
+    return time.perf_counter() - s_t, waiting_time / allocations
+
+
+@click.command()
+@click.option('--pool_size', '-r', multiple=True, type=click.INT, default=[100, 1000, 5000],
+              help='Number of resources per pool (the option can be repeated)')
+@click.option('--pools', default=4, type=click.INT, help='Number of resource pools')
+@click.option('--tasks', default=40, type=click.INT, help='Number of tasks of the synthetic model')
+@click.option('--shared_ratio', default=0.3, type=click.FLOAT,
+              help='Probability of a task to be also allocated to a resource of another pool')
+@click.option('--allocations', default=200000, type=click.INT, help='Number of allocations (pop + release) per run')
+@click.option('--utilization', default=0.9, type=click.FLOAT, help='Target utilization of the resources')
+@click.option('--seed', default=42, type=click.INT, help='Seed of the model and of the allocations')
+def main(pool_size, pools, tasks, shared_ratio, allocations, utilization, seed):
+    print('| %s | %s | %s | %s |' % ('Resources'.ljust(9), 'Policy'.ljust(14), 'Allocation (us)'.ljust(15),
+                                     'Avg waiting (s)'.ljust(15)))
+    with tempfile.TemporaryDirectory() as scenario_dir:
+        for r_count in pool_size:
+            params = ScenarioParams(tasks=tasks, xor_gateways=2, and_gateways=2, or_gateways=1, loops=1,
+                                    resources_per_task=r_count, pools=pools, pool_size=r_count,
+                                    shared_ratio=shared_ratio, calendars=1, calendar_intervals=0, seed=seed)
+            bpmn_path, json_path = generate_scenario(scenario_dir, "pools_%d" % r_count, params)
+            sim_setup = SimDiffSetup(bpmn_path, json_path)
+            for policy_name in policy_names:
+                run_time, avg_waiting = run_allocations(sim_setup, policy_name, allocations, utilization, seed)
+                print('| %s | %s | %s | %s |' % (str(len(sim_setup.resources_map)).ljust(9), policy_name.ljust(14),
+                                                 ('%.3f' % (run_time / allocations * 1e6)).ljust(15),
+                                                 ('%.1f' % avg_waiting).ljust(15)))
+
+
+if __name__ == "__main__":
+    main()
@@ -65,7 +65,7 @@ def discover_simulation_parameters(model_name, log_path, bpmn_path, out_f_path):
                     completed_events.append(c_event)
         trace_info.filter_incomplete_events()
         task_sequence = sort_by_completion_times(trace_info)
-        bpmn_graph.reply_trace(task_sequence, flow_arcs_frequency, True, trace_info.event_list)
+        bpmn_graph.reply_trace_variant(task_sequence, flow_arcs_frequency)
 
     [[best_granule, best_conf, best_supp, best_part, adj_c],
      [best_granule_t, best_conf_t, best_supp_t, best_part_t, adj_c_t]] = find_best_parameters(model_name,
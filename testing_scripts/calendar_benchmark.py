@@ -0,0 +1,213 @@
+import datetime
+import os
+import sys
+import time
+from datetime import timedelta
+
+import click
+import numpy
+import pytz
+
+from bpdfr_simulation_engine.resource_calendar import week_second_from
+from bpdfr_simulation_engine.simulation_properties_parser import parse_resource_calendars
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_scenario_generator import ScenarioParams, build_calendars
+
+
+class DatetimeCalendarQueries:
+    # Queries used before the WeekIntervals of RCalendar, i.e., datetimes on the default date of the calendar and
+    # linear scans of the intervals of each day. Kept here as the baseline.
+    def __init__(self, r_calendar):
+        self.calendar = r_calendar
+
+    def week_point(self, week_second):
+        return int(week_second // 86400) % 7, self.calendar.new_day + timedelta(seconds=week_second % 86400)
+
+    def find_idle_time_at(self, week_second, duration):
+        if duration == 0:
+            return 0
+        real_duration = 0
+        pending_duration = duration
+        if duration > self.calendar.total_weekly_work:
+            real_duration += 604800 * int(duration / self.calendar.total_weekly_work)
+            pending_duration %= self.calendar.total_weekly_work
+        c_day, c_date = self.week_point(week_second)
+        worked_time, total_time = self._find_time_starting(pending_duration, c_day, c_date)
+        if worked_time > total_time and worked_time - total_time < 0.001:
+            total_time = worked_time
+        pending_duration -= worked_time
+        real_duration += total_time
+        c_date = self.calendar.new_day
+        while pending_duration > 0:
+            c_day += 1
+            r_d = c_day % 7
+            if pending_duration > self.calendar.work_rest_count[r_d][0]:
+                pending_duration -= self.calendar.work_rest_count[r_d][0]
+                real_duration += 86400
+            else:
+                real_duration += self._find_time_completion(pending_duration,
+                                                            self.calendar.work_rest_count[r_d][0], r_d, c_date)
+                break
+        return real_duration
+
+    def next_available_time_at(self, week_second):
+        c_day, c_date = self.week_point(week_second)
+        for interval in self.calendar.work_intervals[c_day]:
+            if interval.is_after(c_date):
+                return (interval.start - c_date).total_seconds()
+            if interval.contains(c_date):
+                return 0
+        duration = 86400 - (c_date - self.calendar.new_day).total_seconds()
+        for i in range(c_day + 1, c_day + 8):
+            r_day = i % 7
+            if self.calendar.work_rest_count[r_day][0] > 0:
+                return duration + (self.calendar.work_intervals[r_day][0].start - self.calendar.new_day).total_seconds()
+            duration += 86400
+        return duration
+
+    def find_working_time_at(self, week_second, duration):
+        pending_duration = duration
+        worked_hours = 0
+        c_day, c_date = self.week_point(week_second)
+        to_complete_day = 86400 - (c_date - self.calendar.new_day).total_seconds()
+        available_work = self._calculate_available_duration(c_day, c_date)
+        previous_date = c_date
+        while pending_duration > to_complete_day:
+            pending_duration -= to_complete_day
+            worked_hours += available_work
+            c_day = (c_day + 1) % 7
+            available_work = self.calendar.work_rest_count[c_day][0]
+            to_complete_day = 86400
+            previous_date = self.calendar.new_day
+        for interval in self.calendar.work_intervals[c_day]:
+            if interval.is_before(previous_date):
+                continue
+            interval_duration = interval.duration
+            if interval.contains(previous_date):
+                interval_duration -= (previous_date - interval.start).total_seconds()
+            else:
+                pending_duration -= (interval.start - previous_date).total_seconds()
+            if pending_duration >= interval_duration:
+                worked_hours += interval_duration
+            elif pending_duration > 0:
+                worked_hours += pending_duration
+            pending_duration -= interval_duration
+            if pending_duration <= 0:
+                break
+            previous_date = interval.end
+        return worked_hours
+
+    def _find_time_starting(self, pending_duration, c_day, from_date):
+        available_duration = self._calculate_available_duration(c_day, from_date)
+        if available_duration <= pending_duration:
+            return available_duration, 86400 - (from_date - self.calendar.new_day).total_seconds()
+        else:
+            return pending_duration, self._find_time_completion(pending_duration, available_duration, c_day, from_date)
+
+    def _calculate_available_duration(self, c_day, from_date):
+        passed_duration = 0
+        for t_interval in self.calendar.work_intervals[c_day]:
+            if t_interval.is_before(from_date):
+                passed_duration += t_interval.duration
+                continue
+            if t_interval.is_after(from_date):
+                break
+            if t_interval.contains(from_date):
+                passed_duration += (from_date - t_interval.start).total_seconds()
+                break
+        return self.calendar.work_rest_count[c_day][0] - passed_duration
+
+    def _find_time_completion(self, pending_duration, total_duration, c_day, from_datetime):
+        i = len(self.calendar.work_intervals[c_day]) - 1
+        while total_duration > pending_duration:
+            total_duration -= self.calendar.work_intervals[c_day][i].duration
+            i -= 1
+        if total_duration < pending_duration:
+            to_datetime = self.calendar.work_intervals[c_day][i + 1].start + timedelta(
+                seconds=(pending_duration - total_duration))
+            return (to_datetime - from_datetime).total_seconds()
+        else:
+            return (self.calendar.work_intervals[c_day][i].end - from_datetime).total_seconds()
+
+
+def time_queries(calendar_queries, week_seconds, durations):
+    # Time per query of each of the three calendar queries, and the results (to compare the implementations)
+    times, results = list(), list()
+    for query in [lambda w_s, d: calendar_queries.find_idle_time_at(w_s, d),
+                  lambda w_s, d: calendar_queries.next_available_time_at(w_s),
+                  lambda w_s, d: calendar_queries.find_working_time_at(w_s, d)]:
+        s_t = time.perf_counter()
+        results.append([query(week_seconds[i], durations[i]) for i in range(0, len(week_seconds))])
+        times.append((time.perf_counter() - s_t) / len(week_seconds))
+    return times, results
+
+
+def time_working_times(r_calendar, total_events, rng):
+    # Working time of each event of a log (as when fitting the durations with fit_c), event by event with the former
+    # datetime scan and with the week intervals, and in a single batch
+    start_datetime = pytz.timezone('Europe/Tallinn').localize(datetime.datetime(2022, 1, 3))
+    start_dates = [start_datetime + timedelta(seconds=offset)
+                   for offset in rng.uniform(0, 52 * 604800, total_events).tolist()]
+    end_dates = [start_dates[i] + timedelta(seconds=duration)
+                 for i, duration in enumerate(rng.exponential(7200, total_events).tolist())]
+    baseline_queries = DatetimeCalendarQueries(r_calendar)
+    durations = [(end_dates[i] - start_dates[i]).total_seconds() for i in range(0, total_events)]
+    times, results = list(), list()
+    for working_times in [lambda: [baseline_queries.find_working_time_at(week_second_from(start_dates[i]), durations[i])
+                                   for i in range(0, total_events)],
+                          lambda: [r_calendar.find_working_time(start_dates[i], end_dates[i])
+                                   for i in range(0, total_events)],
+                          lambda: r_calendar.find_working_times(start_dates, end_dates).tolist()]:
+        s_t = time.perf_counter()
+        results.append(working_times())
+        times.append(time.perf_counter() - s_t)
+    for i in range(1, len(results)):
+        if max([abs(x - y) for x, y in zip(results[0], results[i])]) > 0.001:
+            raise RuntimeError("The working times of the events differ from the datetime scan")
+    return times
+
+
+@click.command()
+@click.option('--intervals', '-i', multiple=True, type=click.INT, default=[1, 4, 16],
+              help='Working intervals per day of the calendar (the option can be repeated)')
+@click.option('--queries', default=100000, type=click.INT, help='Number of queries of each kind')
+@click.option('--events', default=1000000, type=click.INT,
+              help='Number of events whose working time is computed one by one and in a batch')
+@click.option('--seed', default=42, type=click.INT, help='Seed of the query times and durations')
+def main(intervals, queries, events, seed):
+    rng = numpy.random.default_rng(seed)
+    week_seconds = rng.uniform(0, 604800, queries).tolist()
+    # Task durations from minutes up to a few working weeks
+    durations = rng.exponential(3600, queries).tolist()
+    durations[::100] = rng.uniform(0, 3 * 604800, len(durations[::100])).tolist()
+    print('| %s | %s | %s | %s |' % ('Intervals'.ljust(9), 'Query'.ljust(20), 'Datetime scan (us)'.ljust(18),
+                                     'Week intervals (us)'.ljust(19)))
+    for i_count in intervals:
+        r_calendar = list(parse_resource_calendars(
+            build_calendars(ScenarioParams(calendars=1, calendar_intervals=i_count))).values())[0]
+        baseline_times, baseline_results = time_queries(DatetimeCalendarQueries(r_calendar), week_seconds, durations)
+        week_times, week_results = time_queries(r_calendar, week_seconds, durations)
+        for q_index, q_name in enumerate(['find_idle_time', 'next_available_time', 'find_working_time']):
+            differences = [abs(x - y) for x, y in zip(baseline_results[q_index], week_results[q_index])]
+            if max(differences) > 0.001:
+                raise RuntimeError("The %s of the week intervals differs from the datetime scan (%d intervals)"
+                                   % (q_name, i_count))
+            print('| %s | %s | %s | %s |' % (str(i_count).ljust(9), q_name.ljust(20),
+                                             ('%.3f' % (baseline_times[q_index] * 1e6)).ljust(18),
+                                             ('%.3f' % (week_times[q_index] * 1e6)).ljust(19)))
+    print()
+    print('| %s | %s | %s | %s | %s |' % ('Intervals'.ljust(9), 'Events'.ljust(7), 'Datetime scan (s)'.ljust(17),
+                                          'Week intervals (s)'.ljust(18), 'Batch (s)'.ljust(9)))
+    for i_count in intervals:
+        r_calendar = list(parse_resource_calendars(
+            build_calendars(ScenarioParams(calendars=1, calendar_intervals=i_count))).values())[0]
+        event_times = time_working_times(r_calendar, events, rng)
+        print('| %s | %s | %s | %s | %s |' % (str(i_count).ljust(9), str(events).ljust(7),
+                                              ('%.3f' % event_times[0]).ljust(17), ('%.3f' % event_times[1]).ljust(18),
+                                              ('%.3f' % event_times[2]).ljust(9)))
+
+
+if __name__ == "__main__":
+    main()
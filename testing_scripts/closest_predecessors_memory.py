@@ -0,0 +1,98 @@
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+
+import click
+
+from bpdfr_simulation_engine.control_flow_manager import BPMN
+from bpdfr_simulation_engine.simulation_properties_parser import parse_simulation_model
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_scenario_generator import ScenarioParams, generate_scenario
+
+
+def full_predecessor_tables(bpmn_graph):
+    # Tables built before the lazy ClosestPredecessors, i.e., the distance and the decision flows of the shortest path
+    # for every pair of elements. Kept here as the baseline.
+    closest_distance = dict()
+    decision_flows_sortest_path = dict()
+    for e_id in bpmn_graph.element_info:
+        closest_distance[e_id] = dict()
+        pred_seq = dict()
+        distance_map = {e_id: 0}
+        pred_queue = deque([bpmn_graph.element_info[e_id]])
+        while pred_queue:
+            e_info = pred_queue.popleft()
+            for flow_id in e_info.incoming_flows:
+                pred_info = bpmn_graph.element_info[bpmn_graph.flow_arcs[flow_id][0]]
+                if pred_info.id not in distance_map:
+                    pred_seq[pred_info.id] = flow_id
+                    dist = distance_map[e_info.id]
+                    if pred_info.type in [BPMN.TASK, BPMN.START_EVENT]:
+                        dist += 1
+                        closest_distance[e_id][pred_info.id] = dist
+                    distance_map[pred_info.id] = dist
+                    pred_queue.append(pred_info)
+        decision_flows_sortest_path[e_id] = dict()
+        for p_id in bpmn_graph.element_info:
+            decision_flows_sortest_path[e_id][p_id] = list()
+            if p_id is not e_id and p_id in closest_distance[e_id]:
+                p_info = bpmn_graph.element_info[p_id]
+                while p_info.id is not e_id:
+                    if p_info.type in [BPMN.INCLUSIVE_GATEWAY, BPMN.EXCLUSIVE_GATEWAY] and p_info.is_split():
+                        decision_flows_sortest_path[e_id][p_id].append(pred_seq[p_info.id])
+                    p_info = bpmn_graph.element_info[bpmn_graph.flow_arcs[pred_seq[p_info.id]][1]]
+    return closest_distance, decision_flows_sortest_path
+
+
+def lazy_predecessor_tables(bpmn_graph, unfired_tasks):
+    # Searches of the unfired tasks and the decision flows from the start event, as done by postprocess_unfired_tasks
+    for e_id in unfired_tasks:
+        bpmn_graph._closest_predecessors(e_id).decision_flows_from(bpmn_graph, bpmn_graph.starting_event)
+    return bpmn_graph.closest_predecessors
+
+
+def measure(build_tables):
+    tracemalloc.start()
+    s_t = time.perf_counter()
+    tables = build_tables()
+    e_t = time.perf_counter() - s_t
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return allocated, e_t, tables
+
+
+@click.command()
+@click.option('--tasks', '-t', multiple=True, type=click.INT, default=[100, 300],
+              help='Number of tasks of the synthetic model (the option can be repeated)')
+@click.option('--unfired_tasks', default=200, type=click.INT,
+              help='Distinct tasks left unfired by the replayed traces')
+@click.option('--seed', default=42, type=click.INT, help='Seed of the models')
+def main(tasks, unfired_tasks, seed):
+    print('| %s | %s | %s | %s | %s | %s |' % ('Tasks'.ljust(5), 'Nodes'.ljust(5), 'Full (MB)'.ljust(9),
+                                               'Full (s)'.ljust(8), 'Lazy (MB)'.ljust(9), 'Lazy (s)'.ljust(8)))
+    with tempfile.TemporaryDirectory() as scenario_dir:
+        for t_count in tasks:
+            gateways = max(1, t_count // 10)
+            params = ScenarioParams(tasks=t_count, xor_gateways=gateways, and_gateways=gateways,
+                                    or_gateways=max(1, gateways // 2), loops=max(1, gateways // 2),
+                                    resources_per_task=2, pools=4, pool_size=5, shared_ratio=0.1, calendars=1,
+                                    calendar_intervals=0, seed=seed)
+            bpmn_path, _ = generate_scenario(scenario_dir, "model_%d" % t_count, params)
+            bpmn_graph = parse_simulation_model(bpmn_path)
+            task_ids = [e_id for e_id in bpmn_graph.element_info if bpmn_graph.element_info[e_id].type == BPMN.TASK]
+            full_bytes, full_time, _ = measure(lambda: full_predecessor_tables(bpmn_graph))
+            lazy_bytes, lazy_time, _ = measure(lambda: lazy_predecessor_tables(bpmn_graph,
+                                                                                task_ids[:unfired_tasks]))
+            print('| %s | %s | %s | %s | %s | %s |'
+                  % (str(t_count).ljust(5), str(len(bpmn_graph.element_info)).ljust(5),
+                     ('%.1f' % (full_bytes / 2 ** 20)).ljust(9), ('%.3f' % full_time).ljust(8),
+                     ('%.1f' % (lazy_bytes / 2 ** 20)).ljust(9), ('%.3f' % lazy_time).ljust(8)))
+
+
+if __name__ == "__main__":
+    main()
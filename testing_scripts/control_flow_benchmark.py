@@ -0,0 +1,153 @@
+import os
+import sys
+import tempfile
+import time
+from collections import deque, Counter
+
+import click
+import numpy
+from scipy.stats import chi2_contingency
+
+from bpdfr_simulation_engine.control_flow_manager import ProcessState, BPMNGraph, ElementInfo, BPMN, \
+    CompiledBPMNGraph
+from bpdfr_simulation_engine.probability_distributions import UniformBlocks, Choice
+from bpdfr_simulation_engine.simulation_setup import SimDiffSetup
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_scenario_generator import ScenarioParams, generate_scenario
+
+
+def run_token_game(bpmn_graph, initial_state, total_cases, seed):
+    # Plays the cases one after the other, firing the enabled tasks in FIFO order, and returns the time per transition
+    # (i.e., per update_process_state) and the sequence of enabled tasks (to check that both graphs are equivalent)
+    branching = UniformBlocks(numpy.random.default_rng(seed))
+    tie_breaking = UniformBlocks(numpy.random.default_rng(seed + 1))
+    enabled_sequence = list()
+    transitions = 0
+    s_t = time.perf_counter()
+    for _ in range(0, total_cases):
+        p_state = initial_state()
+        pending = deque(bpmn_graph.update_process_state(bpmn_graph.starting_event, p_state, branching,
+                                                        tie_breaking))
+        transitions += 1
+        while pending:
+            enabled_tasks = bpmn_graph.update_process_state(pending.popleft(), p_state, branching,
+                                                            tie_breaking)
+            enabled_sequence.extend(enabled_tasks)
+            pending.extend(enabled_tasks)
+            transitions += 1
+    return (time.perf_counter() - s_t) / transitions, transitions, enabled_sequence
+
+
+def case_outcomes(compiled_graph, total_cases, seed):
+    # Frequency of the tasks enabled by each case (sorted), playing the cases as run_token_game
+    branching = UniformBlocks(numpy.random.default_rng(seed))
+    tie_breaking = UniformBlocks(numpy.random.default_rng(seed + 1))
+    outcomes = Counter()
+    for _ in range(0, total_cases):
+        p_state = compiled_graph.initial_state()
+        pending = deque(compiled_graph.update_process_state(compiled_graph.starting_event, p_state, branching,
+                                                            tie_breaking))
+        case_tasks = list(pending)
+        while pending:
+            enabled_tasks = compiled_graph.update_process_state(pending.popleft(), p_state, branching, tie_breaking)
+            case_tasks.extend(enabled_tasks)
+            pending.extend(enabled_tasks)
+        outcomes[tuple(sorted(case_tasks))] += 1
+    return outcomes
+
+
+def check_memoized_distribution(bpmn_graph, total_cases, transition_cache, seed, model_name):
+    # The memoized transitions do not draw the same random numbers as the token game, so the outcomes of the cases are
+    # compared by a chi-squared test (the outcomes expected less than 5 times are merged) instead of case by case
+    token_outcomes = case_outcomes(CompiledBPMNGraph(bpmn_graph), total_cases, seed)
+    memoized_graph = CompiledBPMNGraph(bpmn_graph)
+    memoized_graph.memoize_transitions(transition_cache)
+    memoized_outcomes = case_outcomes(memoized_graph, total_cases, seed + 2)
+    frequent, rare = [list(), list()], [0, 0]
+    for outcome in set(token_outcomes) | set(memoized_outcomes):
+        counts = [token_outcomes[outcome], memoized_outcomes[outcome]]
+        if sum(counts) >= 10:
+            frequent[0].append(counts[0])
+            frequent[1].append(counts[1])
+        else:
+            rare[0] += counts[0]
+            rare[1] += counts[1]
+    if sum(rare) >= 10:
+        frequent[0].append(rare[0])
+        frequent[1].append(rare[1])
+    if len(frequent[0]) > 1:
+        p_value = chi2_contingency(frequent)[1]
+        if p_value < 0.001:
+            raise RuntimeError("The memoized transitions of %s follow a different distribution (p-value %.2e)"
+                               % (model_name, p_value))
+
+
+def or_join_after_split(inner_first):
+    # S -> A -> XOR D, taking (0.3) the parallel split P, whose flows reach the OR join J directly and through the XOR
+    # gateway X, or (0.7) the task K. Whether J fires once or twice depends on the order the flows of P are fired, and
+    # the order of the flows of P in the model (inner_first) is the order of the walk of the memoized transitions
+    bpmn_graph = BPMNGraph()
+    for e_id, e_type in [('S', BPMN.START_EVENT), ('A', BPMN.TASK), ('D', BPMN.EXCLUSIVE_GATEWAY),
+                         ('P', BPMN.PARALLEL_GATEWAY), ('X', BPMN.EXCLUSIVE_GATEWAY), ('J', BPMN.INCLUSIVE_GATEWAY),
+                         ('T', BPMN.TASK), ('U', BPMN.TASK), ('K', BPMN.TASK), ('E', BPMN.END_EVENT)]:
+        bpmn_graph.add_bpmn_element(e_id, ElementInfo(e_type, e_id, e_id))
+    p_flows = [('P_X', 'P', 'X'), ('P_J', 'P', 'J')]
+    for f_id, source_id, target_id in [('S_A', 'S', 'A'), ('A_D', 'A', 'D'), ('D_P', 'D', 'P'), ('D_K', 'D', 'K')] \
+            + (p_flows if inner_first else p_flows[::-1]) \
+            + [('X_J', 'X', 'J'), ('J_T', 'J', 'T'), ('T_U', 'T', 'U'), ('U_E', 'U', 'E'), ('K_E', 'K', 'E')]:
+        bpmn_graph.add_flow_arc(f_id, source_id, target_id)
+    bpmn_graph.encode_or_join_predecesors()
+    bpmn_graph.set_element_probabilities({'D': Choice(['D_P', 'D_K'], [0.3, 0.7])}, dict())
+    return bpmn_graph
+
+
+@click.command()
+@click.option('--tasks', '-t', multiple=True, type=click.INT, default=[50, 200, 500],
+              help='Number of tasks of the synthetic model (the option can be repeated)')
+@click.option('--total_cases', default=2000, type=click.INT, help='Number of cases played on each model')
+@click.option('--transition_cache', default=100000, type=click.INT,
+              help='Maximum nodes (decisions and results) of the transitions cached by the memoized compiled graph')
+@click.option('--seed', default=42, type=click.INT, help='Seed of the models and of the branching decisions')
+def main(tasks, total_cases, transition_cache, seed):
+    for inner_first in [True, False]:
+        check_memoized_distribution(or_join_after_split(inner_first), 4000, transition_cache, seed,
+                                    "the OR join after a parallel split (inner flow %s)"
+                                    % ('first' if inner_first else 'last'))
+    print('| %s | %s | %s | %s | %s | %s | %s | %s | %s |'
+          % ('Tasks'.ljust(5), 'Nodes'.ljust(5), 'Transitions'.ljust(11), 'BPMNGraph (us)'.ljust(14),
+             'Compiled (us)'.ljust(13), 'Speedup'.ljust(7), 'Memoized (us)'.ljust(13), 'Cached nodes'.ljust(12),
+             'Explore (s)'.ljust(11)))
+    with tempfile.TemporaryDirectory() as scenario_dir:
+        for t_count in tasks:
+            gateways = max(1, t_count // 10)
+            params = ScenarioParams(tasks=t_count, xor_gateways=gateways, and_gateways=gateways,
+                                    or_gateways=max(1, gateways // 2), loops=max(1, gateways // 2),
+                                    resources_per_task=2, pools=4, pool_size=5, shared_ratio=0.1, calendars=1,
+                                    calendar_intervals=0, seed=seed)
+            sim_setup = SimDiffSetup(*generate_scenario(scenario_dir, "model_%d" % t_count, params))
+            bpmn_graph = sim_setup.bpmn_graph
+            graph_time, transitions, graph_sequence = run_token_game(bpmn_graph, lambda: ProcessState(bpmn_graph),
+                                                                     total_cases, seed)
+            compiled_time, _, compiled_sequence = run_token_game(sim_setup.compiled_graph,
+                                                                 sim_setup.compiled_graph.initial_state,
+                                                                 total_cases, seed)
+            if graph_sequence != compiled_sequence:
+                raise RuntimeError("The compiled graph enabled different tasks on the model with %d tasks" % t_count)
+            check_memoized_distribution(bpmn_graph, total_cases, transition_cache, seed,
+                                        "the model with %d tasks" % t_count)
+            s_t = time.perf_counter()
+            sim_setup.compiled_graph.memoize_transitions(transition_cache)
+            explore_time = time.perf_counter() - s_t
+            memoized_time, _, _ = run_token_game(sim_setup.compiled_graph, sim_setup.compiled_graph.initial_state,
+                                                 total_cases, seed)
+            print('| %s | %s | %s | %s | %s | %s | %s | %s | %s |'
+                  % (str(t_count).ljust(5), str(len(bpmn_graph.element_info)).ljust(5), str(transitions).ljust(11),
+                     ('%.3f' % (graph_time * 1e6)).ljust(14), ('%.3f' % (compiled_time * 1e6)).ljust(13),
+                     ('%.2fx' % (graph_time / compiled_time)).ljust(7), ('%.3f' % (memoized_time * 1e6)).ljust(13),
+                     str(sim_setup.compiled_graph.cached_nodes()).ljust(12), ('%.3f' % explore_time).ljust(11)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import datetime
+from collections import deque
+
+import click
+import pytz
+
+from bpdfr_simulation_engine.simulation_engine import SimBPMEnv, execute_full_process
+from bpdfr_simulation_engine.simulation_setup import SimDiffSetup
+
+
+class TwoDequeEventQueue:
+    # Scheduler used by the engine before the heap-based future event list, i.e., it merges the heads of two deques
+    # and is only correct if the enabled events are appended in timestamp order. Kept here as the baseline.
+    def __init__(self):
+        self.arrival_events = deque()
+        self.enabled_events = deque()
+
+    def append_arrival_event(self, event_info):
+        self.arrival_events.append(event_info)
+
+    def append_enabled_event(self, event_info):
+        self.enabled_events.append(event_info)
+
+    def pop_next_event(self):
+        if self.arrival_events and self.enabled_events:
+            if self.arrival_events[0].enabled_at < self.enabled_events[0].enabled_at:
+                return self.arrival_events.popleft()
+            else:
+                return self.enabled_events.popleft()
+        elif self.enabled_events:
+            return self.enabled_events.popleft()
+        elif self.arrival_events:
+            return self.arrival_events.popleft()
+        else:
+            return None
+
+
+def run_engine(diffsim_info, total_cases, legacy_queue):
+    bpm_env = SimBPMEnv(diffsim_info, None, None)
+    if legacy_queue:
+        bpm_env.events_queue = TwoDequeEventQueue()
+    s_t = datetime.datetime.now()
+    execute_full_process(bpm_env, total_cases)
+    sim_time = (datetime.datetime.now() - s_t).total_seconds()
+    return bpm_env.executed_events, sim_time
+
+
+@click.command()
+@click.option('--bpmn_path', required=True, help='Path to the BPMN file with the process model')
+@click.option('--json_path', required=True, help='Path to the JSON file with the simulation parameters')
+@click.option('--total_cases', '-n', multiple=True, type=click.INT, default=[100000, 250000, 500000, 1000000],
+              help='Number of process instances to simulate (the option can be repeated)')
+def main(bpmn_path, json_path, total_cases):
+    print('| %s | %s | %s | %s | %s |' % ('Cases'.ljust(9), 'Events'.ljust(10), 'Two-Deque (ev/s)'.ljust(17),
+                                         'Heap FEL (ev/s)'.ljust(17), 'Speedup'.ljust(7)))
+    for p_cases in total_cases:
+        results = list()
+        for legacy_queue in [True, False]:
+            diffsim_info = SimDiffSetup(bpmn_path, json_path)
+            diffsim_info.set_starting_satetime(pytz.utc.localize(datetime.datetime(2022, 1, 3, 8)))
+            results.append(run_engine(diffsim_info, p_cases, legacy_queue))
+        [(_, legacy_time), (events, heap_time)] = results
+        legacy_rate = results[0][0] / legacy_time
+        heap_rate = events / heap_time
+        print('| %s | %s | %s | %s | %s |' % (str(p_cases).ljust(9), str(events).ljust(10),
+                                             ('%.1f' % legacy_rate).ljust(17), ('%.1f' % heap_rate).ljust(17),
+                                             ('%.2f' % (heap_rate / legacy_rate)).ljust(7)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+
+import click
+import pytz
+
+from bpdfr_discovery.log_parser import sort_by_completion_times
+from bpdfr_simulation_engine.control_flow_manager import BPMN, BPMNGraph, ElementInfo
+from bpdfr_simulation_engine.simulation_engine import run_simulation
+from bpdfr_simulation_engine.simulation_properties_parser import parse_simulation_model
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from replay_benchmark import read_simulated_log
+from synthetic_scenario_generator import ScenarioParams, generate_scenario
+
+
+def recursive_closer_enabled_predecessors(self, e_info, flow_id, enabled_pred, or_firing, path_split, visited,
+                                          p_state, dist, min_dist):
+    # Search used before the explicit-stack closer_enabled_predecessors. Kept here as the baseline.
+    if self.is_enabled(e_info.id, p_state):
+        if dist not in enabled_pred:
+            enabled_pred[dist] = list()
+        enabled_pred[dist].append([e_info, flow_id])
+        min_dist[0] = max(min_dist[0], dist)
+        return dist, enabled_pred, or_firing, path_split
+    elif e_info.type is BPMN.INCLUSIVE_GATEWAY and e_info.is_join():
+        for in_or in e_info.incoming_flows:
+            if p_state.has_token(in_or):
+                or_firing[e_info.id] = dist
+                break
+    if e_info.type in [BPMN.INCLUSIVE_GATEWAY, BPMN.EXCLUSIVE_GATEWAY]:
+        path_split[e_info.id] = flow_id
+    visited.add(e_info.id)
+    if e_info.is_gateway():
+        if e_info.type is BPMN.EXCLUSIVE_GATEWAY and e_info.is_join():
+            closer_pred, temp_path, or_f = dict(), dict(), dict()
+            c_min = sys.maxsize
+            for in_flow in e_info.incoming_flows:
+                pr_info = self._get_predecessor(in_flow)
+                if pr_info.id not in visited:
+                    d, e_p, o_f, t_path = self.closer_enabled_predecessors(pr_info, in_flow, dict(), dict(), dict(),
+                                                                           visited, p_state, dist + 1, min_dist)
+                    if d < c_min:
+                        c_min, closer_pred, or_f, temp_path = d, e_p, o_f, t_path
+            for e_id in closer_pred:
+                enabled_pred[e_id] = closer_pred[e_id]
+            for e_id in temp_path:
+                path_split[e_id] = temp_path[e_id]
+            for e_id in or_f:
+                or_firing[e_id] = dist
+            return c_min, enabled_pred, or_firing, path_split
+        else:
+            c_min = dist if e_info.id in or_firing else sys.maxsize
+            for in_flow in e_info.incoming_flows:
+                pred_info = self._get_predecessor(in_flow)
+                if pred_info.id not in visited and pred_info.is_gateway():
+                    res = self.closer_enabled_predecessors(pred_info, in_flow, enabled_pred, or_firing, path_split,
+                                                           visited, p_state, dist + 1, min_dist)
+                    c_min = min(res[0], c_min)
+            return c_min, enabled_pred, or_firing, path_split
+    return sys.maxsize, enabled_pred, or_firing, path_split
+
+
+def new_graph(bpmn_path, recursive):
+    bpmn_graph = parse_simulation_model(bpmn_path)
+    if recursive:
+        bpmn_graph.closer_enabled_predecessors = types.MethodType(recursive_closer_enabled_predecessors, bpmn_graph)
+    return bpmn_graph
+
+
+def noisy_task_sequences(trace_list, seed):
+    # Task sequences of the traces with up to 3 events removed or with swapped completion times, i.e., most traces do
+    # not fit the model and their replay searches the enabled predecessors of the tasks without a token
+    rng = random.Random(seed)
+    sequences = list()
+    for trace_info in trace_list:
+        event_list = list(trace_info.event_list)
+        for _ in range(0, rng.randint(0, 3)):
+            if len(event_list) > 2:
+                i, j = rng.randrange(len(event_list)), rng.randrange(len(event_list))
+                if rng.random() < 0.5:
+                    del event_list[i]
+                else:
+                    event_list[i].completed_at, event_list[j].completed_at = \
+                        event_list[j].completed_at, event_list[i].completed_at
+        trace_info.event_list = event_list
+        sequences.append((sort_by_completion_times(trace_info), event_list))
+    return sequences
+
+
+def replay_traces(bpmn_graph, task_sequences):
+    flow_arcs_frequency = dict()
+    results = list()
+    s_t = time.perf_counter()
+    for task_sequence, event_list in task_sequences:
+        results.append(bpmn_graph.reply_trace(task_sequence, flow_arcs_frequency, True, event_list))
+    return time.perf_counter() - s_t, flow_arcs_frequency, results
+
+
+def gateway_cascade(length):
+    # Start -> A -> length gateways -> B -> End, i.e., replaying the task sequence [B] searches back to A through all
+    # the gateways
+    bpmn_graph = BPMNGraph()
+    e_types = [BPMN.START_EVENT, BPMN.TASK] + [BPMN.EXCLUSIVE_GATEWAY] * length + [BPMN.TASK, BPMN.END_EVENT]
+    e_names = ["Start", "A"] + ["G%d" % i for i in range(0, length)] + ["B", "End"]
+    for i in range(0, len(e_types)):
+        bpmn_graph.add_bpmn_element(e_names[i], ElementInfo(e_types[i], e_names[i], e_names[i]))
+        if i > 0:
+            bpmn_graph.add_flow_arc("F%d" % i, e_names[i - 1], e_names[i])
+    bpmn_graph.encode_or_join_predecesors()
+    return bpmn_graph
+
+
+def replay_cascade(length, recursive):
+    bpmn_graph = gateway_cascade(length)
+    if recursive:
+        bpmn_graph.closer_enabled_predecessors = types.MethodType(recursive_closer_enabled_predecessors, bpmn_graph)
+    try:
+        bpmn_graph.reply_trace(["B"], dict(), False)
+        return "ok"
+    except RecursionError:
+        return "RecursionError"
+
+
+@click.command()
+@click.option('--tasks', '-t', multiple=True, type=click.INT, default=[20, 50, 100],
+              help='Number of tasks of the synthetic model (the option can be repeated)')
+@click.option('--total_cases', default=1000, type=click.INT, help='Number of cases of the simulated log')
+@click.option('--cascade', default=5000, type=click.INT, help='Gateways in a row of the cascade replayed at the end')
+@click.option('--seed', default=42, type=click.INT, help='Seed of the models, of the simulation and of the noise')
+def main(tasks, total_cases, cascade, seed):
+    print('| %s | %s | %s | %s | %s |' % ('Tasks'.ljust(5), 'Traces'.ljust(6), 'Recursive (s)'.ljust(13),
+                                          'Explicit stack (s)'.ljust(18), 'Speedup'.ljust(7)))
+    with tempfile.TemporaryDirectory() as scenario_dir:
+        for t_count in tasks:
+            gateways = max(1, t_count // 10)
+            params = ScenarioParams(tasks=t_count, xor_gateways=gateways, and_gateways=gateways,
+                                    or_gateways=max(1, gateways // 2), loops=max(1, gateways // 2),
+                                    resources_per_task=2, pools=4, pool_size=5, shared_ratio=0.1, calendars=1,
+                                    calendar_intervals=0, seed=seed)
+            bpmn_path, json_path = generate_scenario(scenario_dir, "model_%d" % t_count, params)
+            log_path = os.path.join(scenario_dir, "model_%d_log.csv" % t_count)
+            run_simulation(bpmn_path, json_path, total_cases, None, log_path,
+                           pytz.utc.localize(datetime.datetime(2022, 1, 3, 8)), seed=seed)
+            task_sequences = noisy_task_sequences(read_simulated_log(log_path), seed)
+
+            recursive_time, recursive_frequency, recursive_results = replay_traces(new_graph(bpmn_path, True),
+                                                                                   task_sequences)
+            stack_time, stack_frequency, stack_results = replay_traces(new_graph(bpmn_path, False), task_sequences)
+            if recursive_frequency != stack_frequency or recursive_results != stack_results:
+                raise RuntimeError("The explicit-stack search differs from the recursive one on the model with %d tasks"
+                                   % t_count)
+            print('| %s | %s | %s | %s | %s |'
+                  % (str(t_count).ljust(5), str(len(task_sequences)).ljust(6), ('%.3f' % recursive_time).ljust(13),
+                     ('%.3f' % stack_time).ljust(18), ('%.2fx' % (recursive_time / stack_time)).ljust(7)))
+    print('Cascade of %d gateways: recursive %s, explicit stack %s'
+          % (cascade, replay_cascade(cascade, True), replay_cascade(cascade, False)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import itertools
+import time
+from heapq import heappush
+from heapq import heappop
+
+import click
+import numpy
+
+from bpdfr_simulation_engine.simulation_queues_ds import PriorityQueue
+
+
+class LazyPriorityQueue:
+    # PriorityQueue used before the indexed heap, i.e., updating the priority of an element marks its entry as removed
+    # and pushes a new one, so the heap keeps the stale entries until they are popped. Kept here as the baseline.
+    def __init__(self):
+        self.pq = []
+        self.entry_finder = {}
+        self.REMOVED = '<removed-task>'
+        self.counter = itertools.count()
+
+    def insert(self, element, priority=0):
+        if element in self.entry_finder:
+            self.entry_finder.pop(element)[-1] = self.REMOVED
+        entry = [priority, next(self.counter), element]
+        self.entry_finder[element] = entry
+        heappush(self.pq, entry)
+
+    def pop_min(self):
+        while self.pq:
+            priority, count, element = heappop(self.pq)
+            if element is not self.REMOVED:
+                del self.entry_finder[element]
+                return element, priority
+        return None, None
+
+
+def run_benchmark(queue, elements, updates, checkpoints, pops, seed):
+    # Each update moves a random element forward in time (as the release of a resource), and at each checkpoint the
+    # latency of 'pops' pop_min (each element popped is inserted back) is measured
+    rng = numpy.random.default_rng(seed)
+    priorities = numpy.zeros(elements)
+    for element in range(0, elements):
+        queue.insert(element, 0.0)
+    results = list()
+    chunk = updates // checkpoints
+    for checkpoint in range(1, checkpoints + 1):
+        updated = rng.integers(0, elements, chunk)
+        increments = rng.exponential(600, chunk)
+        s_t = time.perf_counter()
+        for element, increment in zip(updated.tolist(), increments.tolist()):
+            priorities[element] += increment
+            queue.insert(element, priorities[element])
+        update_time = time.perf_counter() - s_t
+
+        pop_latencies = list()
+        for _ in range(0, pops):
+            s_t = time.perf_counter()
+            element, priority = queue.pop_min()
+            pop_latencies.append(time.perf_counter() - s_t)
+            queue.insert(element, priority)
+        results.append((checkpoint * chunk, len(queue.pq), update_time / chunk,
+                        numpy.mean(pop_latencies), numpy.percentile(pop_latencies, 99), max(pop_latencies)))
+    return results
+
+
+@click.command()
+@click.option('--elements', default=1000, type=click.INT, help='Number of elements (e.g., resources) in the queue')
+@click.option('--updates', default=10000000, type=click.INT, help='Total priority updates')
+@click.option('--checkpoints', default=10, type=click.INT, help='Number of measurements along the updates')
+@click.option('--pops', default=1000, type=click.INT, help='Number of pop_min measured at each checkpoint')
+@click.option('--baseline/--no_baseline', default=True,
+              help='Also runs the lazy-deletion queue (its heap keeps one entry per update)')
+@click.option('--seed', default=42, type=click.INT, help='Seed of the updates')
+def main(elements, updates, checkpoints, pops, baseline, seed):
+    queues = [('Indexed heap', PriorityQueue)]
+    if baseline:
+        queues.append(('Lazy deletion', LazyPriorityQueue))
+    for queue_name, queue_class in queues:
+        print(queue_name)
+        print('| %s | %s | %s | %s | %s | %s |' % ('Updates'.ljust(10), 'Heap entries'.ljust(12),
+                                                  'Update (us)'.ljust(11), 'Pop mean (us)'.ljust(13),
+                                                  'Pop p99 (us)'.ljust(12), 'Pop max (us)'.ljust(12)))
+        for total_updates, heap_size, update_time, pop_mean, pop_p99, pop_max in \
+                run_benchmark(queue_class(), elements, updates, checkpoints, pops, seed):
+            print('| %s | %s | %s | %s | %s | %s |' % (str(total_updates).ljust(10), str(heap_size).ljust(12),
+                                                      ('%.3f' % (update_time * 1e6)).ljust(11),
+                                                      ('%.3f' % (pop_mean * 1e6)).ljust(13),
+                                                      ('%.3f' % (pop_p99 * 1e6)).ljust(12),
+                                                      ('%.3f' % (pop_max * 1e6)).ljust(12)))
+
+
+if __name__ == "__main__":
+    main()
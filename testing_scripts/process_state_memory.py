@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+import tracemalloc
+from collections import deque
+
+import click
+import numpy
+
+from bpdfr_simulation_engine.probability_distributions import UniformBlocks
+from bpdfr_simulation_engine.simulation_setup import SimDiffSetup
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_scenario_generator import ScenarioParams, generate_scenario
+
+
+class DenseProcessState:
+    # Case marking used before the sparse CompiledProcessState, i.e., the tokens of every flow of the model and the
+    # bitmask of the marked flows. Kept here as the baseline.
+    def __init__(self, p_state, total_flows):
+        self.tokens = [p_state.tokens_of(f_index) for f_index in range(0, total_flows)]
+        self.state_mask = p_state.state_mask
+
+
+def in_flight_states(compiled_graph, total_cases, seed):
+    # Cases stopped after a random number of steps of the token game, i.e., the markings of the work in progress
+    branching = UniformBlocks(numpy.random.default_rng(seed))
+    tie_breaking = UniformBlocks(numpy.random.default_rng(seed + 1))
+    p_states = list()
+    for steps in numpy.random.default_rng(seed + 2).integers(1, 20, total_cases).tolist():
+        p_state = compiled_graph.initial_state()
+        pending = deque(compiled_graph.update_process_state(compiled_graph.starting_event, p_state, branching,
+                                                            tie_breaking))
+        while pending and steps > 0:
+            pending.extend(compiled_graph.update_process_state(pending.popleft(), p_state, branching,
+                                                               tie_breaking))
+            steps -= 1
+        p_states.append(p_state)
+    return p_states
+
+
+def measure_bytes(build_states):
+    tracemalloc.start()
+    states = build_states()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return allocated, states
+
+
+@click.command()
+@click.option('--tasks', '-t', multiple=True, type=click.INT, default=[100, 300],
+              help='Number of tasks of the synthetic model (the option can be repeated)')
+@click.option('--total_cases', default=200000, type=click.INT, help='Number of cases in progress')
+@click.option('--seed', default=42, type=click.INT, help='Seed of the models and of the branching decisions')
+def main(tasks, total_cases, seed):
+    print('| %s | %s | %s | %s | %s |' % ('Tasks'.ljust(5), 'Flows'.ljust(5), 'Cases'.ljust(7),
+                                          'Dense (bytes/case)'.ljust(18), 'Sparse (bytes/case)'.ljust(19)))
+    with tempfile.TemporaryDirectory() as scenario_dir:
+        for t_count in tasks:
+            gateways = max(1, t_count // 10)
+            params = ScenarioParams(tasks=t_count, xor_gateways=gateways, and_gateways=gateways,
+                                    or_gateways=max(1, gateways // 2), loops=max(1, gateways // 2),
+                                    resources_per_task=2, pools=4, pool_size=5, shared_ratio=0.1, calendars=1,
+                                    calendar_intervals=0, seed=seed)
+            compiled_graph = SimDiffSetup(*generate_scenario(scenario_dir, "model_%d" % t_count, params)).compiled_graph
+            total_flows = len(compiled_graph.flow_ids)
+            sparse_bytes, p_states = measure_bytes(lambda: in_flight_states(compiled_graph, total_cases, seed))
+            dense_bytes, _ = measure_bytes(lambda: [DenseProcessState(p_state, total_flows) for p_state in p_states])
+            print('| %s | %s | %s | %s | %s |' % (str(t_count).ljust(5), str(total_flows).ljust(5),
+                                                  str(total_cases).ljust(7),
+                                                  ('%.1f' % (dense_bytes / total_cases)).ljust(18),
+                                                  ('%.1f' % (sparse_bytes / total_cases)).ljust(19)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import csv
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import click
+import pytz
+
+from bpdfr_discovery.log_parser import sort_by_completion_times
+from bpdfr_simulation_engine.execution_info import TaskEvent, Trace
+from bpdfr_simulation_engine.simulation_engine import run_simulation
+from bpdfr_simulation_engine.simulation_properties_parser import parse_simulation_model
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_scenario_generator import ScenarioParams, generate_scenario
+
+
+def read_simulated_log(log_path):
+    # Same traces as event_list_from_csv, but parsing the (ISO) dates of the simulated log with fromisoformat, which is
+    # much faster than pandas.to_datetime per date
+    trace_map = dict()
+    with open(log_path, mode='r') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        next(csv_reader)
+        for row in csv_reader:
+            event_info = TaskEvent(row[0], row[1], row[5], datetime.datetime.fromisoformat(row[2]))
+            event_info.started_at = datetime.datetime.fromisoformat(row[3])
+            event_info.completed_at = datetime.datetime.fromisoformat(row[4])
+            if row[0] not in trace_map:
+                trace_map[row[0]] = Trace(row[0])
+            trace_map[row[0]].event_list.append(event_info)
+    return list(trace_map.values())
+
+
+def replay_log(bpmn_path, trace_list, by_variant):
+    # Replays every trace of the log on a new graph (i.e., without cached variants), returning the replay time, the
+    # flow frequencies and the enabling times of each trace
+    bpmn_graph = parse_simulation_model(bpmn_path)
+    flow_arcs_frequency = dict()
+    enabling_times = list()
+    s_t = time.perf_counter()
+    for trace_info in trace_list:
+        task_sequence = sort_by_completion_times(trace_info)
+        if by_variant:
+            result = bpmn_graph.reply_trace_variant(task_sequence, flow_arcs_frequency, trace_info.event_list)
+        else:
+            result = bpmn_graph.reply_trace(task_sequence, flow_arcs_frequency, True, trace_info.event_list)
+        enabling_times.append(result[3])
+    return time.perf_counter() - s_t, flow_arcs_frequency, enabling_times, len(bpmn_graph.replayed_variants)
+
+
+@click.command()
+@click.option('--tasks', '-t', multiple=True, type=click.INT, default=[10, 20, 50],
+              help='Number of tasks of the synthetic model (the option can be repeated)')
+@click.option('--total_cases', default=2000, type=click.INT, help='Number of cases of the simulated log')
+@click.option('--seed', default=42, type=click.INT, help='Seed of the models and of the simulation')
+def main(tasks, total_cases, seed):
+    print('| %s | %s | %s | %s | %s | %s |' % ('Tasks'.ljust(5), 'Traces'.ljust(7), 'Variants'.ljust(8),
+                                               'Per trace (s)'.ljust(13), 'Per variant (s)'.ljust(15),
+                                               'Speedup'.ljust(7)))
+    with tempfile.TemporaryDirectory() as scenario_dir:
+        for t_count in tasks:
+            gateways = max(1, t_count // 10)
+            params = ScenarioParams(tasks=t_count, xor_gateways=gateways, and_gateways=gateways,
+                                    or_gateways=max(1, gateways // 2), loops=max(1, gateways // 2),
+                                    resources_per_task=2, pools=4, pool_size=5, shared_ratio=0.1, calendars=1,
+                                    calendar_intervals=0, seed=seed)
+            bpmn_path, json_path = generate_scenario(scenario_dir, "model_%d" % t_count, params)
+            log_path = os.path.join(scenario_dir, "model_%d_log.csv" % t_count)
+            run_simulation(bpmn_path, json_path, total_cases, None, log_path,
+                           pytz.utc.localize(datetime.datetime(2022, 1, 3, 8)), seed=seed)
+            trace_list = read_simulated_log(log_path)
+
+            trace_time, trace_frequency, trace_enabling, _ = replay_log(bpmn_path, trace_list, False)
+            variant_time, variant_frequency, variant_enabling, variants = replay_log(bpmn_path, trace_list, True)
+            if trace_frequency != variant_frequency or trace_enabling != variant_enabling:
+                raise RuntimeError("The replay by variant differs from the replay by trace on the model with %d tasks"
+                                   % t_count)
+            print('| %s | %s | %s | %s | %s | %s |'
+                  % (str(t_count).ljust(5), str(len(trace_list)).ljust(7), str(variants).ljust(8),
+                     ('%.3f' % trace_time).ljust(13), ('%.3f' % variant_time).ljust(15),
+                     ('%.1fx' % (trace_time / variant_time)).ljust(7)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import pytz
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_scenario_generator import ScenarioParams, generate_scenario
+
+# End-to-end benchmark of the simulator over a matrix of synthetic scenarios (number of tasks x number of cases).
+# Each run is executed in a new (spawned) process, so the peak memory is not inherited from the previous runs.
+
+
+def run_benchmark_case(bpmn_path, json_path, total_cases, seed):
+    from bpdfr_simulation_engine.execution_info import ArrivalEvent
+    from bpdfr_simulation_engine.simulation_engine import SimBPMEnv
+    from bpdfr_simulation_engine.simulation_setup import SimDiffSetup
+
+    base_rss = _peak_rss_mb()
+    s_t = time.perf_counter()
+    diffsim_info = SimDiffSetup(bpmn_path, json_path)
+    diffsim_info.set_starting_satetime(pytz.utc.localize(datetime.datetime(2022, 1, 3, 8)))
+    diffsim_info.set_random_streams(seed)
+    bpm_env = SimBPMEnv(diffsim_info, None, None)
+    setup_time = time.perf_counter() - s_t
+
+    # Same loop as execute_full_process, but recording the wall time until the first task event is executed
+    first_event_time = None
+    bpm_env.start_arrival_process(total_cases)
+    current_event = bpm_env.events_queue.pop_next_event()
+    while current_event is not None:
+        if isinstance(current_event, ArrivalEvent):
+            bpm_env.execute_arrival_event(current_event)
+        else:
+            bpm_env.execute_enabled_event(current_event)
+        if first_event_time is None and bpm_env.executed_events > 0:
+            first_event_time = time.perf_counter() - s_t
+        current_event = bpm_env.events_queue.pop_next_event()
+    total_time = time.perf_counter() - s_t
+    sim_time = total_time - setup_time
+
+    return {"total_cases": total_cases,
+            "executed_events": bpm_env.executed_events,
+            "setup_seconds": setup_time,
+            "simulation_seconds": sim_time,
+            "total_seconds": total_time,
+            "events_per_second": bpm_env.executed_events / sim_time if sim_time > 0 else 0,
+            "time_to_first_event_seconds": first_event_time,
+            "base_rss_mb": base_rss,
+            "peak_rss_mb": _peak_rss_mb()}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command()
+@click.option('--tasks', '-t', multiple=True, type=click.INT, default=[10, 50, 200],
+              help='Number of tasks of the synthetic models (the option can be repeated)')
+@click.option('--total_cases', '-n', multiple=True, type=click.INT, default=[1000, 10000],
+              help='Number of process instances to simulate (the option can be repeated)')
+@click.option('--pools', default=4, type=click.INT, help='Number of resource pools')
+@click.option('--pool_size', default=5, type=click.INT, help='Number of resources per pool')
+@click.option('--resources_per_task', default=2, type=click.INT, help='Resources of the pool allocated to each task')
+@click.option('--calendar_intervals', default=2, type=click.INT,
+              help='Working intervals per day in each calendar (0 for 24/7 calendars)')
+@click.option('--repetitions', default=1, type=click.INT, help='Runs of each scenario and number of cases')
+@click.option('--seed', default=42, type=click.INT, help='Seed of the generated models and of the simulations')
+@click.option('--scenario_dir', help='Folder where the synthetic models are kept (a temporary one by default)')
+@click.option('--output', 'output_path', default='simulation_benchmark.json', help='Path to the JSON with the results')
+def main(tasks, total_cases, pools, pool_size, resources_per_task, calendar_intervals, repetitions, seed,
+         scenario_dir, output_path):
+    temp_dir = None
+    if scenario_dir is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        scenario_dir = temp_dir.name
+    spawn_context = multiprocessing.get_context("spawn")
+
+    runs = list()
+    print('| %s | %s | %s | %s | %s | %s |' % ('Tasks'.ljust(5), 'Cases'.ljust(8), 'Events'.ljust(9),
+                                              'Events/s'.ljust(10), 'First event (s)'.ljust(15),
+                                              'Peak RSS (MB)'.ljust(13)))
+    try:
+        for t_count in tasks:
+            # Gateways and loops grow with the size of the model, 1 block every 5 tasks
+            blocks = max(1, t_count // 5)
+            params = ScenarioParams(tasks=t_count, xor_gateways=(blocks + 3) // 4, and_gateways=(blocks + 2) // 4,
+                                    or_gateways=(blocks + 1) // 4, loops=blocks // 4,
+                                    resources_per_task=resources_per_task, pools=pools, pool_size=pool_size,
+                                    calendars=2, calendar_intervals=calendar_intervals, seed=seed)
+            bpmn_path, json_path = generate_scenario(scenario_dir, "synthetic_%d_tasks" % t_count, params)
+            for p_cases in total_cases:
+                for r in range(0, repetitions):
+                    with ProcessPoolExecutor(max_workers=1, mp_context=spawn_context) as executor:
+                        run_info = executor.submit(run_benchmark_case, bpmn_path, json_path, p_cases, seed).result()
+                    run_info["scenario"] = params.to_dict()
+                    run_info["repetition"] = r
+                    runs.append(run_info)
+                    print('| %s | %s | %s | %s | %s | %s |' % (
+                        str(t_count).ljust(5), str(p_cases).ljust(8), str(run_info["executed_events"]).ljust(9),
+                        ('%.1f' % run_info["events_per_second"]).ljust(10),
+                        ('%.4f' % run_info["time_to_first_event_seconds"]).ljust(15),
+                        ('%.1f' % run_info["peak_rss_mb"]).ljust(13)))
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    with open(output_path, 'w') as json_file:
+        json.dump({"created_at": datetime.datetime.now().isoformat(),
+                   "git_commit": _git_commit(),
+                   "python": platform.python_version(),
+                   "platform": platform.platform(),
+                   "runs": runs}, json_file, indent=4)
+    print("Results saved in %s" % output_path)
+
+
+if __name__ == "__main__":
+    main()
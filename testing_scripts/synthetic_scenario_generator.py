@@ -0,0 +1,280 @@
+import json
+import os
+import xml.etree.ElementTree as ET
+
+import click
+import numpy
+
+bpmn_schema_url = 'http://www.omg.org/spec/BPMN/20100524/MODEL'
+week_days = ["MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY", "SUNDAY"]
+
+
+class ScenarioParams:
+    def __init__(self, tasks=20, xor_gateways=2, and_gateways=2, or_gateways=1, loops=1, resources_per_task=2,
+                 pools=2, pool_size=4, shared_ratio=0.2, calendars=2, calendar_intervals=2, mean_duration=600,
+                 target_utilization=0.7, seed=None):
+        self.tasks = tasks
+        self.xor_gateways = xor_gateways
+        self.and_gateways = and_gateways
+        self.or_gateways = or_gateways
+        self.loops = loops
+        self.resources_per_task = resources_per_task
+        self.pools = pools
+        self.pool_size = pool_size
+        self.shared_ratio = shared_ratio  # Probability of a task to be also allocated to a resource of another pool
+        self.calendars = calendars
+        self.calendar_intervals = calendar_intervals  # Working intervals per day (0 means 24/7 calendars)
+        self.mean_duration = mean_duration
+        self.target_utilization = target_utilization
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class ProcessBuilder:
+    # Block-structured process model, i.e., each XOR/AND/OR split has its join and each loop is a XOR join/split pair.
+    # It also keeps the expected number of visits of each task to estimate the workload of a case.
+    def __init__(self, rng):
+        self.rng = rng
+        self.elements = list()  # (BPMN tag, id, name)
+        self.flows = list()  # (flow id, source id, target id)
+        self.probabilities = list()  # (gateway id, [(flow id, probability)])
+        self.task_visits = dict()
+        self.gateways_count = 0
+
+    def add_element(self, tag, name=None):
+        e_id = "%s_%d" % ("Activity" if tag == "task" else tag, len(self.elements) + 1)
+        self.elements.append((tag, e_id, name if name else e_id))
+        return e_id
+
+    def add_flow(self, source_id, target_id):
+        f_id = "Flow_%d" % (len(self.flows) + 1)
+        self.flows.append((f_id, source_id, target_id))
+        return f_id
+
+    def add_task_sequence(self, from_id, task_count, visits):
+        for _ in range(0, task_count):
+            t_id = self.add_element("task", "Task %d" % (len(self.task_visits) + 1))
+            self.task_visits[t_id] = visits
+            self.add_flow(from_id, t_id)
+            from_id = t_id
+        return from_id
+
+    def add_gateway_block(self, from_id, tag, branch_tasks, visits):
+        self.gateways_count += 1
+        split_id = self.add_element(tag, "split_%d" % self.gateways_count)
+        join_id = self.add_element(tag, "join_%d" % self.gateways_count)
+        self.add_flow(from_id, split_id)
+        if tag != "parallelGateway":
+            branch_probs = self.rng.dirichlet([2.0] * len(branch_tasks))
+        else:
+            branch_probs = numpy.ones(len(branch_tasks))
+        gateway_probs = list()
+        for i in range(0, len(branch_tasks)):
+            first_flow = len(self.flows)
+            last_id = self.add_task_sequence(split_id, branch_tasks[i], visits * branch_probs[i])
+            gateway_probs.append((self.flows[first_flow][0], float(branch_probs[i])))
+            self.add_flow(last_id, join_id)
+        if tag != "parallelGateway":
+            # The probabilities of XOR/OR splits must add up to 1, OR splits fall back to them if no flow is taken
+            gateway_probs[-1] = (gateway_probs[-1][0], 1 - sum([p for _, p in gateway_probs[:-1]]))
+        if tag != "parallelGateway":
+            self.probabilities.append((split_id, gateway_probs))
+        return join_id
+
+    def add_loop_block(self, from_id, task_count, visits, repeat_probability=0.2):
+        self.gateways_count += 1
+        join_id = self.add_element("exclusiveGateway", "loop_join_%d" % self.gateways_count)
+        split_id = self.add_element("exclusiveGateway", "loop_split_%d" % self.gateways_count)
+        self.add_flow(from_id, join_id)
+        last_id = self.add_task_sequence(join_id, task_count, visits / (1 - repeat_probability))
+        self.add_flow(last_id, split_id)
+        back_flow = self.add_flow(split_id, join_id)
+        exit_flow = len(self.flows)
+        self.probabilities.append((split_id, [(back_flow, repeat_probability),
+                                              ("Flow_%d" % (exit_flow + 1), 1 - repeat_probability)]))
+        return split_id
+
+    def to_xml(self):
+        ET.register_namespace('', bpmn_schema_url)
+        definitions = ET.Element("{%s}definitions" % bpmn_schema_url, {"id": "synthetic_definitions"})
+        process = ET.SubElement(definitions, "{%s}process" % bpmn_schema_url, {"id": "synthetic_process"})
+        for tag, e_id, name in self.elements:
+            ET.SubElement(process, "{%s}%s" % (bpmn_schema_url, tag), {"id": e_id, "name": name})
+        for f_id, source_id, target_id in self.flows:
+            ET.SubElement(process, "{%s}sequenceFlow" % bpmn_schema_url,
+                          {"id": f_id, "sourceRef": source_id, "targetRef": target_id})
+        return ET.ElementTree(definitions)
+
+
+def build_process(params: ScenarioParams, rng):
+    # Each gateway block needs two tasks (one per branch) and each loop one task, the remaining tasks are spread
+    # randomly as sequences between the blocks or as longer branches
+    blocks = ["exclusiveGateway"] * params.xor_gateways + ["parallelGateway"] * params.and_gateways + \
+             ["inclusiveGateway"] * params.or_gateways + ["loop"] * params.loops
+    min_tasks = 2 * (len(blocks) - params.loops) + params.loops
+    if params.tasks < min_tasks:
+        raise ValueError("At least %d tasks are required for the requested gateways and loops" % min_tasks)
+    rng.shuffle(blocks)
+    # Slot 0 are the tasks before the first block, then the branches of each block and the tasks after it
+    block_tasks = list()
+    for block in blocks:
+        block_tasks.append([1] if block == "loop" else [1, 1])
+    sequence_tasks = [0] * (len(blocks) + 1)
+    for _ in range(0, params.tasks - min_tasks):
+        b_index = rng.integers(0, 2 * len(blocks) + 1)
+        if b_index <= len(blocks):
+            sequence_tasks[b_index] += 1
+        else:
+            branches = block_tasks[b_index - len(blocks) - 1]
+            if len(branches) < 3 and rng.random() < 0.3:
+                branches.append(1)
+            else:
+                branches[rng.integers(0, len(branches))] += 1
+
+    builder = ProcessBuilder(rng)
+    last_id = builder.add_element("startEvent", "Start")
+    last_id = builder.add_task_sequence(last_id, sequence_tasks[0], 1.0)
+    if len(blocks) == 0 and sequence_tasks[0] == 0:
+        last_id = builder.add_task_sequence(last_id, 1, 1.0)
+    for i in range(0, len(blocks)):
+        if blocks[i] == "loop":
+            last_id = builder.add_loop_block(last_id, block_tasks[i][0], 1.0)
+        else:
+            last_id = builder.add_gateway_block(last_id, blocks[i], block_tasks[i], 1.0)
+        last_id = builder.add_task_sequence(last_id, sequence_tasks[i + 1], 1.0)
+    end_id = builder.add_element("endEvent", "End")
+    builder.add_flow(last_id, end_id)
+    return builder
+
+
+def build_calendars(params: ScenarioParams):
+    # Calendar k works Monday to Friday, the working day (from 8 + k hours, 10 hours long) is fragmented in
+    # calendar_intervals intervals separated by breaks of 30 minutes
+    calendars = list()
+    for k in range(0, max(1, params.calendars)):
+        time_periods = list()
+        if params.calendar_intervals <= 0:
+            time_periods.append({"from": "MONDAY", "to": "SUNDAY", "beginTime": "00:00:00.000",
+                                 "endTime": "23:59:59.999"})
+        else:
+            day_start = (8 + k % 8) * 60
+            interval_length = (600 - 30 * (params.calendar_intervals - 1)) / params.calendar_intervals
+            for i in range(0, params.calendar_intervals):
+                begin = day_start + i * (interval_length + 30)
+                time_periods.append({"from": "MONDAY", "to": "FRIDAY", "beginTime": _time_of_day(begin),
+                                     "endTime": _time_of_day(begin + interval_length)})
+        calendars.append({"id": "calendar_%d" % (k + 1), "name": "Calendar %d" % (k + 1),
+                          "time_periods": time_periods})
+    return calendars
+
+
+def _time_of_day(minutes):
+    seconds = int(round(minutes * 60))
+    return "%02d:%02d:%02d.000" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def _distribution_params(values):
+    return [{"value": value} for value in values]
+
+
+def build_simulation_parameters(params: ScenarioParams, builder: ProcessBuilder, rng):
+    resource_ids = list()
+    for p in range(0, params.pools):
+        resource_ids.append(["Resource_%d_%d" % (p + 1, r + 1) for r in range(0, params.pool_size)])
+
+    assigned_tasks = dict()
+    task_resources = dict()
+    task_ids = list(builder.task_visits.keys())
+    for i in range(0, len(task_ids)):
+        pool = i % params.pools
+        candidates = list(rng.choice(resource_ids[pool], min(params.resources_per_task, params.pool_size),
+                                     replace=False))
+        if params.pools > 1 and rng.random() < params.shared_ratio:
+            other_pool = (pool + rng.integers(1, params.pools)) % params.pools
+            candidates.append(rng.choice(resource_ids[other_pool]))
+        task_resources[task_ids[i]] = [str(r_id) for r_id in candidates]
+        for r_id in task_resources[task_ids[i]]:
+            assigned_tasks.setdefault(r_id, list()).append(task_ids[i])
+
+    resource_profiles = list()
+    for p in range(0, params.pools):
+        resource_list = list()
+        for r_id in resource_ids[p]:
+            if r_id not in assigned_tasks:
+                continue
+            resource_list.append({"id": r_id, "name": r_id, "cost_per_hour": str(int(rng.integers(10, 50))),
+                                  "amount": 1, "calendar": "calendar_%d" % (len(resource_list) % params.calendars + 1),
+                                  "assignedTasks": assigned_tasks[r_id]})
+        resource_profiles.append({"id": "Pool_%d" % (p + 1), "name": "Pool %d" % (p + 1),
+                                  "resource_list": resource_list})
+
+    task_resource_distribution = list()
+    for t_id in task_ids:
+        resources = list()
+        for r_id in task_resources[t_id]:
+            mean = params.mean_duration * rng.uniform(0.5, 1.5)
+            resources.append({"resource_id": r_id, "distribution_name": "norm",
+                              "distribution_params": _distribution_params([mean, mean * 0.2, 0, mean * 5])})
+        task_resource_distribution.append({"task_id": t_id, "resources": resources})
+
+    gateway_branching_probabilities = list()
+    for g_id, probabilities in builder.probabilities:
+        gateway_branching_probabilities.append({"gateway_id": g_id,
+                                                "probabilities": [{"path_id": f_id, "value": str(prob)}
+                                                                  for f_id, prob in probabilities]})
+
+    # Inter-arrival mean such that the expected work per case fits the working resources at the target utilization
+    expected_work = sum(builder.task_visits.values()) * params.mean_duration
+    arrival_mean = expected_work / (len(assigned_tasks) * params.target_utilization)
+    return {"resource_profiles": resource_profiles,
+            "arrival_time_distribution": {"distribution_name": "expon",
+                                          "distribution_params": _distribution_params([0, arrival_mean, 0,
+                                                                                       arrival_mean * 50])},
+            "gateway_branching_probabilities": gateway_branching_probabilities,
+            "task_resource_distribution": task_resource_distribution,
+            "resource_calendars": build_calendars(params)}
+
+
+def generate_scenario(out_dir, scenario_name, params: ScenarioParams):
+    # Writes <scenario_name>.bpmn and <scenario_name>.json into out_dir, and returns their paths
+    rng = numpy.random.default_rng(params.seed)
+    builder = build_process(params, rng)
+    sim_parameters = build_simulation_parameters(params, builder, rng)
+    os.makedirs(out_dir, exist_ok=True)
+    bpmn_path = os.path.join(out_dir, "%s.bpmn" % scenario_name)
+    json_path = os.path.join(out_dir, "%s.json" % scenario_name)
+    builder.to_xml().write(bpmn_path, encoding="UTF-8", xml_declaration=True)
+    with open(json_path, 'w') as json_file:
+        json.dump(sim_parameters, json_file, indent=1)
+    return bpmn_path, json_path
+
+
+@click.command()
+@click.option('--out_dir', required=True, help='Folder where the BPMN and JSON files are written')
+@click.option('--name', default='synthetic', help='Name of the scenario, i.e., <name>.bpmn and <name>.json')
+@click.option('--tasks', default=20, type=click.INT, help='Number of tasks')
+@click.option('--xor', 'xor_gateways', default=2, type=click.INT, help='Number of XOR split/join blocks')
+@click.option('--and', 'and_gateways', default=2, type=click.INT, help='Number of AND split/join blocks')
+@click.option('--or', 'or_gateways', default=1, type=click.INT, help='Number of OR split/join blocks')
+@click.option('--loops', default=1, type=click.INT, help='Number of loops')
+@click.option('--resources_per_task', default=2, type=click.INT, help='Resources of the pool allocated to each task')
+@click.option('--pools', default=2, type=click.INT, help='Number of resource pools')
+@click.option('--pool_size', default=4, type=click.INT, help='Number of resources per pool')
+@click.option('--shared_ratio', default=0.2, type=click.FLOAT,
+              help='Probability of a task to be also allocated to a resource of another pool')
+@click.option('--calendars', default=2, type=click.INT, help='Number of different resource calendars')
+@click.option('--calendar_intervals', default=2, type=click.INT,
+              help='Working intervals per day in each calendar (0 for 24/7 calendars)')
+@click.option('--seed', type=click.INT, help='Seed of the generator')
+def main(out_dir, name, tasks, xor_gateways, and_gateways, or_gateways, loops, resources_per_task, pools, pool_size,
+         shared_ratio, calendars, calendar_intervals, seed):
+    params = ScenarioParams(tasks, xor_gateways, and_gateways, or_gateways, loops, resources_per_task, pools,
+                            pool_size, shared_ratio, calendars, calendar_intervals, seed=seed)
+    bpmn_path, json_path = generate_scenario(out_dir, name, params)
+    print("Generated %s and %s" % (bpmn_path, json_path))
+
+
+if __name__ == "__main__":
+    main()
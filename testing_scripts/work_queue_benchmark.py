@@ -0,0 +1,56 @@
+import time
+
+import click
+import numpy
+
+from bpdfr_simulation_engine.execution_info import EnabledEvent
+from bpdfr_simulation_engine.simulation_queues_ds import WorkQueues
+
+
+def run_backlog(discipline, backlog, dispatches, tasks, resources, seed):
+    # A backlog of enabled tasks waits in the work queues, then each dispatch (a resource taking the next task) is
+    # followed by a new enabled task, i.e., the backlog keeps its length while measuring
+    rng = numpy.random.default_rng(seed)
+    task_resource_map = dict()
+    for t_index in range(0, tasks):
+        task_resource_map["task_%d" % t_index] = {"resource_%d" % (t_index % resources): None}
+    expected_durations = dict()
+    for task_id in task_resource_map:
+        for r_id in task_resource_map[task_id]:
+            expected_durations[(task_id, r_id)] = float(rng.exponential(600))
+    work_queues = WorkQueues(task_resource_map, discipline, expected_durations)
+
+    task_ids = list(task_resource_map.keys())
+    enabled_tasks = rng.integers(0, tasks, backlog + dispatches).tolist()
+    enabled_at = 0.0
+    for p_case in range(0, backlog):
+        enabled_at += 1
+        work_queues.push(EnabledEvent(p_case, None, task_ids[enabled_tasks[p_case]], enabled_at), enabled_at)
+
+    released = rng.integers(0, resources, dispatches).tolist()
+    s_t = time.perf_counter()
+    for p_case, r_index in zip(range(backlog, backlog + dispatches), released):
+        enabled_at += 1
+        work_queues.pop_for("resource_%d" % r_index, enabled_at)
+        work_queues.push(EnabledEvent(p_case, None, task_ids[enabled_tasks[p_case]], enabled_at), enabled_at)
+    return (time.perf_counter() - s_t) / dispatches
+
+
+@click.command()
+@click.option('--backlog', '-b', multiple=True, type=click.INT, default=[1000, 10000, 100000, 1000000],
+              help='Number of queued tasks (the option can be repeated)')
+@click.option('--dispatches', default=100000, type=click.INT, help='Number of dispatches (pop + push) measured')
+@click.option('--tasks', default=40, type=click.INT, help='Number of tasks')
+@click.option('--resources', default=10, type=click.INT, help='Number of resources (i.e., of work queues)')
+@click.option('--seed', default=42, type=click.INT, help='Seed of the enabled tasks and released resources')
+def main(backlog, dispatches, tasks, resources, seed):
+    print('| %s | %s | %s |' % ('Backlog'.ljust(9), 'Discipline'.ljust(13), 'Dispatch (us)'.ljust(13)))
+    for b_size in backlog:
+        for discipline in WorkQueues.DISCIPLINES:
+            dispatch_time = run_backlog(discipline, b_size, dispatches, tasks, resources, seed)
+            print('| %s | %s | %s |' % (str(b_size).ljust(9), discipline.ljust(13),
+                                        ('%.3f' % (dispatch_time * 1e6)).ljust(13)))
+
+
+if __name__ == "__main__":
+    main()